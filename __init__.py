@@ -2,9 +2,9 @@
     Store module level imports, constants, and global variables
 """
 from transaction_type import Trans_Type
-from position import Position
+from position import Position, Special_Position
 from staffing_model import Staffing_Models
-from sequence import Sequence
+from context import set_position_seed
 import logging
 
 # Configure logging for everyone
@@ -16,10 +16,6 @@ info = l.info
 error = l.error
 stop_on_validation = False
 
-# Unique id generators for worker and position
-worker_seq = Sequence("worker")
-position_seq = Sequence("position")
-
 # NOTE: Key to the below is the sequence. This should match the
 # relative sequence in the implementation suite
 HIRE = Trans_Type("Hire", 1, ["Hire", "a-Hire"])
@@ -31,10 +27,15 @@ LOA_START = Trans_Type("LOA Start", 6, ["LOA-START", "LOA Start"])
 LOA_STOP = Trans_Type("LOA Stop", 7, ["LOA_RETURN", "LOA Stop"])
 TERM = Trans_Type("Term", 8, ["Term", "z-Term"])
 
-PRE_HIRE = Position("Pre-Hire", Staffing_Models.JOB_MGMT)
-JOB_MGMT_POS = Position("Job Management Position", Staffing_Models.JOB_MGMT)
-TERMED_EMP = Position("Terminated", Staffing_Models.JOB_MGMT)
-DUMMY = Position("Dummy", Staffing_Models.JOB_MGMT)
+PRE_HIRE = Special_Position("Pre-Hire", Staffing_Models.JOB_MGMT)
+JOB_MGMT_POS = Special_Position("Job Management Position", Staffing_Models.JOB_MGMT)
+TERMED_EMP = Special_Position("Terminated", Staffing_Models.JOB_MGMT)
+DUMMY = Special_Position("Dummy", Staffing_Models.JOB_MGMT)
+# Positions that aren't in the input files
+SPECIAL_POSITIONS = [PRE_HIRE, JOB_MGMT_POS, TERMED_EMP, DUMMY]
+# Every run numbers its positions after these (the worker and position key
+# counters are per run, see context.py)
+set_position_seed(len(SPECIAL_POSITIONS))
 
 JOB_MGMT = Staffing_Models.JOB_MGMT
 POSITION_MGMT = Staffing_Models.POSITION_MGMT
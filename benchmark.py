@@ -0,0 +1,151 @@
+#!/usr/bin/env python -B
+"""
+    Benchmarks wave.py on generated data (see generate.py) at several scales.
+
+    Each scale is a number of workers. The input file is generated once per
+    scale into the work directory, then wave.py is run --repeat times with
+    --timing and the fastest time of each phase is kept (see timing.py).
+    The parse cache is off so ingest is measured every time.
+
+    With --baseline the results are compared to a saved run and the benchmark
+    fails (exit 1) when a phase is more than --threshold slower than it was,
+    phases shorter than --min-seconds are too noisy to fail on. --save-baseline
+    writes the results as the new baseline instead.
+
+    Ex:
+        benchmark.py --scales 10000 50000 --save-baseline base.json
+        benchmark.py --scales 10000 50000 --baseline base.json --wave-args="-j 4"
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import tempfile
+import argparse
+import subprocess
+from collections import OrderedDict
+from generate import Data_Generator
+
+WAVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wave.py")
+
+DEFAULT_SCALES = [1000, 10000, 50000]
+
+def generate(work_dir, workers, seed):
+    """ Generate the input file for a scale (once), returns its name """
+    fname = os.path.join(work_dir, "bench_{}_{}.csv".format(workers, seed))
+    if not os.path.exists(fname):
+        rows = Data_Generator(workers, seed=seed).write(fname)
+        print("Generated {} rows for {} workers".format(rows, workers))
+    return fname
+
+def run_wave(python, input_file, wave_args):
+    """ Run wave.py on input_file, returns its timing report """
+    output_file = os.path.splitext(input_file)[0] + ".out.csv"
+    cmd = [python, "-B", WAVE, input_file, "-o", output_file, "--timing", "--no-cache"] + wave_args
+    with open(os.devnull, "w") as devnull:
+        proc = subprocess.Popen(cmd, stdout=devnull, stderr=subprocess.PIPE)
+        err = proc.communicate()[1]
+    if proc.returncode != 0:
+        print("wave.py failed: {}".format(" ".join(cmd)))
+        print(err[-4000:])
+        sys.exit(1)
+    with open(os.path.splitext(output_file)[0] + ".timing.json") as f:
+        ret = json.load(f)
+    return ret
+
+def benchmark(scale, args):
+    """ Return the fastest phase times over args.repeat runs at scale """
+    input_file = generate(args.work_dir, scale, args.seed)
+    phases = OrderedDict()
+    total = None
+    rows = 0
+    for i in range(args.repeat):
+        report = run_wave(args.python, input_file, shlex.split(args.wave_args))
+        for p in report["phases"]:
+            phases[p["name"]] = min(phases.get(p["name"], p["seconds"]), p["seconds"])
+            if p["name"] == "ingest":
+                rows = p["counts"].get("rows", 0)
+        total = report["total_seconds"] if total is None else min(total, report["total_seconds"])
+    phases["total"] = total
+    return OrderedDict([("rows", rows), ("phases", phases)])
+
+def compare(results, baseline, threshold, min_seconds):
+    """ Print phases that are slower than the baseline allows, returns how many """
+    ret = 0
+    for scale, result in results.items():
+        base = baseline["scales"].get(scale)
+        if base is None:
+            print("No baseline for scale {}".format(scale))
+            continue
+        for name, seconds in result["phases"].items():
+            was = base["phases"].get(name)
+            if was is None:
+                continue
+            if seconds > was * (1 + threshold) and seconds - was > min_seconds:
+                print("REGRESSION scale {} phase {}: {:0.3f}s, was {:0.3f}s ({:+.0%})".format(
+                        scale, name, seconds, was, seconds / was - 1 if was else 1))
+                ret += 1
+    return ret
+
+def print_results(results):
+    """ One line per scale, one column per phase """
+    names = []
+    for result in results.values():
+        names += [n for n in result["phases"] if n not in names]
+    print("{:>8} {:>9} ".format("workers", "rows") + " ".join("{:>10}".format(n) for n in names))
+    for scale, result in results.items():
+        print("{:>8} {:>9} ".format(scale, result["rows"]) + " ".join(
+                "{:>10.3f}".format(result["phases"][n]) if n in result["phases"] else "{:>10}".format("-")
+                for n in names))
+    return
+
+def parse_command_line():
+    """ Process command line arguments """
+    parser = argparse.ArgumentParser(description="Benchmark wave.py phases on generated data")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="Numbers of workers to generate data for")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scale, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for generate.py")
+    parser.add_argument("--wave-args", default="", help="Extra arguments for wave.py, e.g. \"-j 4\"")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter to run wave.py with")
+    parser.add_argument("--work-dir", help="Directory for the generated and output files (default a temp dir)")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Save the results to FILE")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Fail if a phase is this much slower than the baseline (0.25 is 25%%)")
+    parser.add_argument("--min-seconds", type=float, default=0.1,
+                        help="Don't fail on phases less than this many seconds slower")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_command_line()
+    if args.work_dir is None:
+        args.work_dir = tempfile.mkdtemp(prefix="wave_bench.")
+    elif not os.path.isdir(args.work_dir):
+        os.makedirs(args.work_dir)
+
+    results = OrderedDict()
+    for scale in args.scales:
+        results[str(scale)] = benchmark(scale, args)
+        print("Benchmarked {} workers".format(scale))
+    print_results(results)
+
+    report = OrderedDict([("date", time.strftime("%Y-%m-%dT%H:%M:%S")), ("wave_args", args.wave_args),
+                          ("repeat", args.repeat), ("seed", args.seed), ("scales", results)])
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print("Saved baseline {}".format(args.save_baseline))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print("{} phase(s) slower than the baseline allows".format(regressions))
+            sys.exit(1)
+        print("No regressions against {}".format(args.baseline))
@@ -0,0 +1,45 @@
+"""
+    Builds the Worker and Position objects from the transactions
+"""
+from worker import Worker
+from __init__ import *
+
+def build_structures(trans_list, worker_dict, position_dict):
+    """
+        Add each transaction to its Worker and (if it has one) its Position,
+        creating them in worker_dict / position_dict as needed
+    """
+    for row in trans_list:
+        # Employee should always exist, check
+        if row.emp_id == "":
+            print("Missing employee id")
+            print(row)
+            raise Exception
+        elif row.emp_id not in worker_dict:
+            worker_dict[row.emp_id] = Worker(row.emp_id)
+
+        # Add the transaction to the worker, and the worker to the trans
+        worker = worker_dict[row.emp_id]
+        row.worker = worker
+        worker.add_transaction(row)
+
+        # Now check position
+        if row.position_id == "" and row.ttype in [
+                    HIRE, CHANGE_JOB, ORG_ASSN]:
+                print("Missing position ID where required")
+                print(row)
+                raise Exception
+        # LOAs, TERMS don't have positions, we'll fix later
+        elif row.position_id != "":
+            if row.position_id not in position_dict:
+                if row.position_id == "Pre_Conversion":
+                    position_dict[row.position_id] = Position(row.position_id, JOB_MGMT)
+                else:
+                    position_dict[row.position_id] = Position(row.position_id)
+
+            # Add the position to the transaction and the transaction to the
+            # position
+            position = position_dict[row.position_id]
+            row.to_position = position
+            position.add_transaction(row)
+    return
@@ -0,0 +1,316 @@
+"""
+    On disk cache of parsed input files.
+
+    Reruns against the same input files (to change --dump-worker, --stats,
+    --file-by-type, ...) don't need to parse the csv and decode dates / types
+    again. After a file is parsed its rows are saved in a compact binary file,
+    and the next run maps that file and rebuilds the rows from it.
+
+    An entry is keyed by the file content hash, size and mtime, the column
+    indexes, the rows ignored at the top of the file and the transaction type
+    keywords, so changing any of them is a cache miss.
+
+    Entry layout (all integers little endian):
+        header      magic, version, row count, string count, string bytes
+        blob        the distinct record / emp / position id strings, utf-8,
+                    NUL separated (csv can't read NUL so ids never contain one)
+        rec, emp, pos   uint32 * row count each, index into the strings
+        date        int32 * row count, date ordinal
+        type        uint8 * row count, transaction type seq
+
+    The cache is trimmed to its size limit after every store, least recently
+    used entries first (a hit touches the entry).
+"""
+import gc
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+try:
+    from itertools import imap, izip
+except ImportError:
+    imap, izip = map, zip
+from decoder import intern_id, date_from_ordinal
+from __init__ import *
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "wave")
+DEFAULT_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+
+_MAGIC = b"WAVC"
+_VERSION = 2
+_HEADER = struct.Struct("<4sIIII")
+_SUFFIX = ".wcache"
+_LITTLE = sys.byteorder == "little"
+
+def _typed_array(code, size):
+    """ Return an empty array with the given code, checking the item size is what we store """
+    ret = array(code)
+    if ret.itemsize != size:
+        print("Array type {} is {} bytes on this platform, expected {}".format(code, ret.itemsize, size))
+        raise Exception
+    return ret
+
+def _to_bytes(a):
+    if not _LITTLE:
+        a = array(a.typecode, a)
+        a.byteswap()
+    if hasattr(a, "tobytes"):
+        ret = a.tobytes()
+    else:
+        ret = a.tostring()
+    return ret
+
+def _from_bytes(code, size, data):
+    ret = _typed_array(code, size)
+    if hasattr(ret, "frombytes"):
+        ret.frombytes(data)
+    else:
+        ret.fromstring(data)
+    if not _LITTLE:
+        ret.byteswap()
+    return ret
+
+def _take(m, offset, code, size, count):
+    """ Read count items from the mapped file at offset, return (array, offset after them) """
+    end = offset + size * count
+    return _from_bytes(code, size, m[offset:end]), end
+
+def _encode(s):
+    if isinstance(s, bytes):
+        ret = s
+    else:
+        ret = s.encode("utf-8")
+    return ret
+
+def _decode(b):
+    """ csv gives us bytes on 2.x and text on 3.x, hand back the same """
+    if isinstance(b, str):
+        ret = b
+    else:
+        ret = b.decode("utf-8")
+    return ret
+
+def file_hash(fname, block_size=1024 * 1024):
+    """ Return the sha1 hex digest of the contents of fname """
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        block = f.read(block_size)
+        while block:
+            h.update(block)
+            block = f.read(block_size)
+    return h.hexdigest()
+
+class Parse_Cache(object):
+    """
+        Stores and loads the parsed rows of input files.
+        Rows are (record id, emp id, date, Trans_Type, position id), the same
+        thing the ingest readers produce
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE,
+                 indexes=None, ignore_rows=None):
+        self._dir = os.path.expanduser(cache_dir)
+        self._max_bytes = max_bytes
+        self._indexes = indexes
+        self._ignore_rows = ignore_rows or 0
+        self._types = dict((tt.seq, tt) for tt in Trans_Type.all_types())
+        self._keywords = sorted((k, tt.seq) for k, tt in Trans_Type.keyword_map().items())
+        self._hits = 0
+        self._misses = 0
+        return
+
+    def key(self, fname):
+        """ Return the cache key for fname as it is on disk now """
+        st = os.stat(fname)
+        h = hashlib.sha1()
+        h.update(_encode(repr((_VERSION, file_hash(fname), st.st_size, int(st.st_mtime),
+                                self._indexes, self._ignore_rows, self._keywords))))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._dir, key + _SUFFIX)
+
+    def has(self, key):
+        """
+            Return True if key has an entry, without reading it. Counts a miss if
+            it hasn't, load counts the hit (or the miss, if the entry is unreadable)
+        """
+        ret = os.path.isfile(self._path(key))
+        if not ret:
+            self._misses += 1
+        return ret
+
+    def load(self, fname, key=None, stream=False):
+        """
+            Return the cached rows for fname, or None if it isn't cached. With stream
+            the rows are an iterator that builds each row as it is reached
+        """
+        path = self._path(key or self.key(fname))
+        if not os.path.isfile(path):
+            self._misses += 1
+            return None
+        try:
+            rows = self._read(path, stream)
+        except Exception as e:
+            error("Ignoring unreadable cache entry {} for {}: {}".format(path, fname, e))
+            self._misses += 1
+            return None
+        # Mark as recently used for eviction
+        os.utime(path, None)
+        self._hits += 1
+        return rows
+
+    def _read(self, path, stream=False):
+        with open(path, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, n, nstr, blob_len = _HEADER.unpack_from(m, 0)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("not a version {} cache entry".format(_VERSION))
+            offset = _HEADER.size
+            if nstr:
+                strings = _decode(m[offset:offset + blob_len]).split("\0")
+            else:
+                # No rows, and "".split gives one empty string rather than none
+                strings = []
+            offset += blob_len
+            if len(strings) != nstr:
+                raise ValueError("string count mismatch")
+            rec, offset = _take(m, offset, "I", 4, n)
+            emp, offset = _take(m, offset, "I", 4, n)
+            position, offset = _take(m, offset, "I", 4, n)
+            ordinals, offset = _take(m, offset, "i", 4, n)
+            types, offset = _take(m, offset, "B", 1, n)
+            if offset != len(m):
+                raise ValueError("size mismatch")
+        finally:
+            m.close()
+
+        dates = dict((d, date_from_ordinal(d)) for d in set(ordinals))
+        # Share the emp / position ids with the other files (see decoder.py),
+        # record ids are one per row so leave them be
+        for i in set(emp) | set(position):
+            strings[i] = intern_id(strings[i])
+        string = strings.__getitem__
+        ret = izip(imap(string, rec), imap(string, emp), imap(dates.__getitem__, ordinals),
+                   imap(self._types.__getitem__, types), imap(string, position))
+        if not stream:
+            # Building the row tuples triggers the cyclic gc over and over for no
+            # reason (nothing here can be a cycle), hold it off until we're done
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                ret = list(ret)
+            finally:
+                if gc_enabled:
+                    gc.enable()
+        return ret
+
+    def store(self, fname, rows, key=None):
+        """ Save the rows parsed from fname, then trim the cache to its size limit """
+        for row in self.storing(fname, rows, key):
+            pass
+        return
+
+    def storing(self, fname, rows, key=None):
+        """
+            Pass the rows parsed from fname through, saving them on the way. The
+            entry is written, and the cache trimmed, once rows run out
+        """
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+        path = self._path(key or self.key(fname))
+
+        codes = {}
+        strings = []
+        def code(s):
+            ret = codes.get(s)
+            if ret is None:
+                ret = codes[s] = len(strings)
+                strings.append(_encode(s))
+            return ret
+
+        rec = _typed_array("I", 4)
+        emp = _typed_array("I", 4)
+        position = _typed_array("I", 4)
+        ordinals = _typed_array("i", 4)
+        types = _typed_array("B", 1)
+        for row in rows:
+            r, e, d, ttype, p = row
+            rec.append(code(r))
+            emp.append(code(e))
+            position.append(code(p))
+            ordinals.append(d.toordinal())
+            types.append(ttype.seq)
+            yield row
+
+        blob = b"\0".join(strings)
+
+        # Write to a temp file and rename so a reader never sees half an entry
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(rec), len(strings), len(blob)))
+            f.write(blob)
+            for a in (rec, emp, position, ordinals, types):
+                f.write(_to_bytes(a))
+        os.rename(tmp, path)
+        self.evict(keep=path)
+        return
+
+    def entries(self):
+        """ Return (mtime, size, path) for every cache entry, oldest first """
+        ret = []
+        if os.path.isdir(self._dir):
+            for name in os.listdir(self._dir):
+                if name.endswith(_SUFFIX):
+                    path = os.path.join(self._dir, name)
+                    st = os.stat(path)
+                    ret.append((st.st_mtime, st.st_size, path))
+        ret.sort()
+        return ret
+
+    def evict(self, keep=None):
+        """ Remove the least recently used entries until the cache fits in max_bytes """
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self._max_bytes:
+                break
+            if path == keep:
+                continue
+            info("Evicting cache entry {}".format(path))
+            os.remove(path)
+            total -= size
+        return
+
+    def stats(self):
+        """ Return a one line summary of cache usage """
+        return "Parse cache {}: {} hits, {} misses".format(self._dir, self._hits, self._misses)
+
+
+if __name__ == "__main__":
+    # Round trip check: store rows and read them back, an empty file included
+    import shutil
+    import tempfile
+    from datetime import date
+    tmp = tempfile.mkdtemp(prefix="wave_cache.")
+    try:
+        cache = Parse_Cache(tmp)
+        cases = [
+            ("empty", []),
+            ("empty ids", [("", "", date(2010, 1, 1), HIRE, "")]),
+            ("rows", [("1000", "E1", date(2010, 1, 1), HIRE, "P1"),
+                      ("1001", "E1", date(2011, 2, 3), TERM, "P1"),
+                      ("R1002", "E2", date(2011, 2, 3), HIRE, "")]),
+        ]
+        for name, rows in cases:
+            cache.store(name, rows, key=name)
+            loaded = cache.load(name, key=name)
+            if loaded != rows:
+                print("Round trip of {} gave {}, expected {}".format(name, loaded, rows))
+                sys.exit(1)
+        print("{} round trips OK. {}".format(len(cases), cache.stats()))
+    finally:
+        shutil.rmtree(tmp)
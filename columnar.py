@@ -0,0 +1,463 @@
+"""
+    Columnar (array backed) alternative to the Transaction / Worker / Position
+    object engine. Selected with --engine columnar.
+
+    Rather than an object per row, every field is a column in a NumPy array:
+        emp ids and position ids as integer codes
+        dates as ordinals
+        transaction types as their seq
+        worker and position edges as row indexes
+
+    Sorting, edge building and wave assignment are vectorized. Worker
+    validation is an integer indexed pass over the sorted rows, it follows
+    Worker._validate step for step so the output file is the same as the
+    object engine's.
+
+    Rows are indexed by lineno - 1. Position codes 0..n-1 are the positions
+    from the input files, the special positions (PRE_HIRE etc.) follow.
+
+    Only supports generating output files, the debugging options need the
+    object engine.
+"""
+import csv
+import datetime as dt
+from decoder import Row_Decoder
+from context import current_context
+from __init__ import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NONE = -1
+
+class _Tie(object):
+    """
+        Stands in for a transaction when sorting rows with the same date and
+        type. Compares the same way as Transaction.__lt__ does for those rows
+    """
+    __slots__ = ("row", "frm", "to")
+
+    def __init__(self, row, frm, to):
+        self.row = row
+        self.frm = frm
+        self.to = to
+        return
+
+    def __lt__(self, other):
+        return self.frm == other.to
+
+class Columnar_Engine(object):
+    """
+        Holds the columns for every transaction read and runs the
+        validate / edges / schedule phases over them
+    """
+
+    def __init__(self, record_index, emp_index, date_index, pos_index, type_index,
+                 anonymize=False):
+        if np is None:
+            error("The columnar engine requires numpy")
+            raise Exception
+        self._indexes = (record_index, emp_index, date_index, pos_index, type_index)
+        self._anonymize = anonymize
+        self._decoder = Row_Decoder()
+        self._types = dict((tt.seq, tt) for tt in Trans_Type.all_types())
+        # Raw columns, filled in by load()
+        self._rec = []
+        self._emp_l = []
+        self._date_l = []
+        self._pos_l = []
+        self._type_l = []
+        self._emp_codes = {}
+        self._emp_ids = []
+        self._pos_codes = {}
+        self._pos_ids = []
+        self._rows = 0
+        self._max_seq = -1
+        return
+
+    def load(self, fname, ignore_rows=None):
+        """ Read a csv file and append its rows to the columns. Returns rows read """
+        rec_i, emp_i, date_i, pos_i, type_i = self._indexes
+        start = self._rows
+        with open(fname, "rU") as csvfile:
+            reader = csv.reader(csvfile)
+            if ignore_rows is not None:
+                for i in range(ignore_rows):
+                    next(reader)
+            for row in reader:
+                try:
+                    self._add(row[rec_i], row[emp_i], self._decoder.date(row[date_i]),
+                              self._decoder.ttype(row[type_i]), row[pos_i])
+                except:
+                    error("Exception reading row")
+                    error(row)
+                    error("From file {}".format(fname))
+                    raise
+        return self._rows - start
+
+    def add_rows(self, rows):
+        """ Append already decoded (record id, emp id, date, Trans_Type, position id) rows """
+        for rec, emp, d, ttype, pos in rows:
+            self._add(rec, emp, d, ttype, pos)
+        return
+
+    def _add(self, rec, emp, d, ttype, pos):
+        code = self._emp_codes.get(emp)
+        if code is None:
+            code = self._emp_codes[emp] = len(self._emp_ids)
+            self._emp_ids.append(emp)
+        self._emp_l.append(code)
+        if pos == "":
+            code = NONE
+        else:
+            code = self._pos_codes.get(pos)
+            if code is None:
+                code = self._pos_codes[pos] = len(self._pos_ids)
+                self._pos_ids.append(pos)
+        self._pos_l.append(code)
+        self._date_l.append(d.toordinal())
+        self._type_l.append(ttype.seq)
+        self._rec.append(rec)
+        self._rows += 1
+        return
+
+    def _build(self):
+        """ Turn the loaded lists into arrays and set up the positions """
+        self._emp = np.array(self._emp_l, dtype=np.int32)
+        self._pos = np.array(self._pos_l, dtype=np.int32)
+        self._date = np.array(self._date_l, dtype=np.int32)
+        self._type = np.array(self._type_l, dtype=np.int8)
+        self._emp_l = self._pos_l = self._date_l = self._type_l = None
+        n = self._rows
+
+        # Same checks (and first failing row) as building the objects
+        missing_emp = np.array([e == "" for e in self._emp_ids], dtype=bool)
+        bad = missing_emp[self._emp] if n else np.zeros(0, dtype=bool)
+        needs_pos = np.in1d(self._type, [HIRE.seq, CHANGE_JOB.seq, ORG_ASSN.seq])
+        bad_pos = needs_pos & (self._pos == NONE)
+        if (bad | bad_pos).any():
+            i = int(np.argmax(bad | bad_pos))
+            if bad[i]:
+                print("Missing employee id")
+            else:
+                print("Missing position ID where required")
+            print(self._row_str(i))
+            raise Exception
+
+        # Positions: input positions, then the special ones
+        p = len(self._pos_ids)
+        self._specials = [PRE_HIRE, JOB_MGMT_POS, TERMED_EMP, DUMMY]
+        self.PRE_HIRE, self.JOB_MGMT_POS, self.TERMED_EMP, self.DUMMY = range(p, p + 4)
+        staffing = [JOB_MGMT if pid == "Pre_Conversion" else POSITION_MGMT for pid in self._pos_ids]
+        staffing += [sp.staffing_model for sp in self._specials]
+        self._staffing = staffing
+        self._pos_mgmt = np.array([s == POSITION_MGMT for s in staffing] + [False], dtype=bool)
+
+        # Worker and position keys, handed out in the same order as the objects get them
+        context = current_context()
+        self._emp_keys = ["W{:06d}".format(context.worker_seq.next()) for e in self._emp_ids]
+        self._pos_keys = ["P{:06d}".format(context.position_seq.next()) for pid in self._pos_ids]
+        self._pos_keys += [sp.pos_id for sp in self._specials]
+
+        # Starting to / from positions as set by Transaction()
+        self._to = np.where(self._pos != NONE, self._pos,
+                            np.where(self._type == TERM.seq, self.TERMED_EMP, NONE)).astype(np.int32)
+        self._from = np.where(self._type == HIRE.seq, self.PRE_HIRE, NONE).astype(np.int32)
+        self._valid = np.ones(n, dtype=bool)
+        self._seq = np.zeros(n, dtype=np.int32)
+        self._msgs = {}
+        return
+
+    @staticmethod
+    def _sort_ties(order, group_keys, frm, to):
+        """
+            order is sorted by group_keys + (date, type). Re-sort each run of rows with
+            the same group key, date and type the same way sort_transactions does
+        """
+        if len(order) < 2:
+            return order
+        same = np.ones(len(order) - 1, dtype=bool)
+        for k in group_keys:
+            k = k[order]
+            same &= k[1:] == k[:-1]
+        starts = np.flatnonzero(same & ~np.concatenate(([False], same[:-1])))
+        if len(starts) == 0:
+            return order
+        order = order.copy()
+        for s in starts.tolist():
+            e = s + 1
+            while e < len(same) and same[e]:
+                e += 1
+            rows = order[s:e + 1].tolist()
+            ties = sorted(_Tie(r, int(frm[r]), int(to[r])) for r in rows)
+            order[s:e + 1] = [t.row for t in ties]
+        return order
+
+    def validate(self):
+        """ Same as Worker.validate for every worker, fills in to / from positions """
+        self._build()
+        n = self._rows
+        # Each worker's transactions, sorted as Worker._sort would
+        order = np.lexsort((np.arange(n), self._type, self._date, self._emp))
+        order = self._sort_ties(order, (self._emp, self._date, self._type), self._from, self._to)
+        emp_sorted = self._emp[order]
+        bounds = np.flatnonzero(np.diff(emp_sorted)) + 1
+        starts = np.concatenate(([0], bounds)).tolist()
+        ends = np.concatenate((bounds, [n])).tolist()
+        worker_codes = emp_sorted[starts].tolist() if n else []
+        span = dict(zip(worker_codes, zip(starts, ends)))
+
+        order_l = order.tolist()
+        ttype = self._type.tolist()
+        to = self._to.tolist()
+        frm = self._from.tolist()
+        valid = [True] * n
+        from_entries = []  # (position, row) in the order from_position is set
+
+        hire, term, loa_start, loa_stop = HIRE.seq, TERM.seq, LOA_START.seq, LOA_STOP.seq
+        moves = (ORG_ASSN.seq, CHANGE_JOB.seq, EFFECTIVE_DATED_COMP.seq, REQ_COMP_CHANGE.seq)
+        inactive, active, on_leave = 0, 1, 2
+        invalid_workers = 0
+
+        # Go through workers in the same order as worker_dict.values()
+        worker_dict = {}
+        for code, emp in enumerate(self._emp_ids):
+            worker_dict[emp] = code
+        for code in worker_dict.values():
+            s, e = span[code]
+            rows = order_l[s:e]
+            if ttype[rows[0]] != hire:
+                invalid_workers += 1
+                for r in rows:
+                    valid[r] = False
+                    self._msgs[r] = "All transactions for this worker are invalid due to impossible first staffing action"
+                continue
+            last_to = NONE
+            status = inactive
+            for r in rows:
+                t = ttype[r]
+                if t == hire:
+                    status = active
+                    if to[r] == NONE:
+                        to[r] = self.JOB_MGMT_POS
+                    if frm[r] == NONE:
+                        frm[r] = self.PRE_HIRE
+                        from_entries.append((self.PRE_HIRE, r))
+                    last_to = to[r]
+                elif t == term:
+                    to[r] = self.TERMED_EMP
+                    frm[r] = last_to
+                    from_entries.append((last_to, r))
+                    last_to = self.TERMED_EMP
+                    status = inactive
+                elif t in moves:
+                    if to[r] == NONE:
+                        to[r] = self.JOB_MGMT_POS
+                    if frm[r] == NONE:
+                        frm[r] = last_to
+                        from_entries.append((last_to, r))
+                        last_to = to[r]
+                elif t == loa_start or t == loa_stop:
+                    if t == loa_start and status != active:
+                        valid[r] = False
+                        self._msgs[r] = "Start of LOA but worker is not active"
+                        continue
+                    if t == loa_stop and status != on_leave:
+                        valid[r] = False
+                        self._msgs[r] = "End of LOA but worker was not on LOA"
+                        continue
+                    status = on_leave if t == loa_start else active
+                    if to[r] == NONE:
+                        to[r] = last_to if last_to != NONE else self.JOB_MGMT_POS
+                    if frm[r] == NONE:
+                        frm[r] = last_to
+                        from_entries.append((last_to, r))
+                    last_to = to[r]
+
+        self._valid = np.array(valid, dtype=bool)
+        self._to = np.array(to, dtype=np.int32)
+        self._from = np.array(frm, dtype=np.int32)
+        # Invalid transactions get DUMMY where they had no position
+        invalid = ~self._valid
+        self._to[invalid & (self._to == NONE)] = self.DUMMY
+        self._from[invalid & (self._from == NONE)] = self.DUMMY
+        self._seq[invalid] = -1
+        self._worker_order = order[self._valid[order]]
+        self._from_entries = from_entries
+        info("Columnar engine: {} invalid workers, {} invalid transactions".format(
+                invalid_workers, int(invalid.sum())))
+        return
+
+    def calc_edges(self):
+        """ Find the worker and position edge for every valid transaction """
+        n = self._rows
+        # Worker edge: prior valid transaction for the same worker
+        w_edge = np.full(n, NONE, dtype=np.int32)
+        wo = self._worker_order
+        if len(wo) > 1:
+            same = self._emp[wo[1:]] == self._emp[wo[:-1]]
+            w_edge[wo[1:][same]] = wo[:-1][same]
+
+        # Position lists: rows added when building (if still valid), then the
+        # from_position entries in the order they were set
+        build_rows = np.flatnonzero((self._pos != NONE) & self._valid).astype(np.int32)
+        if self._from_entries:
+            fe = np.array(self._from_entries, dtype=np.int32)
+        else:
+            fe = np.zeros((0, 2), dtype=np.int32)
+        e_pos = np.concatenate((self._pos[build_rows], fe[:, 0]))
+        e_row = np.concatenate((build_rows, fe[:, 1]))
+        keep = self._pos_mgmt[e_pos]
+        e_pos = e_pos[keep]
+        e_row = e_row[keep]
+        e_order = np.arange(len(e_pos))
+        order = np.lexsort((e_order, self._type[e_row], self._date[e_row], e_pos))
+        # Ties are compared by row, so sort entry indexes through a row lookup
+        order = self._sort_ties(order, (e_pos, self._date[e_row], self._type[e_row]),
+                                self._from[e_row], self._to[e_row])
+        e_pos = e_pos[order]
+        e_row = e_row[order]
+
+        # Position edge: entry before the first time the row appears in its to_position list
+        p_edge = np.full(n, NONE, dtype=np.int32)
+        mine = (e_pos == self._to[e_row]) & self._valid[e_row]
+        idx = np.flatnonzero(mine)
+        rows, first = np.unique(e_row[idx], return_index=True)
+        idx = idx[first]
+        has_prior = np.zeros(len(idx), dtype=bool)
+        if len(idx):
+            has_prior = idx > 0
+            has_prior[has_prior] = e_pos[idx[has_prior] - 1] == e_pos[idx[has_prior]]
+        p_edge[rows[has_prior]] = e_row[idx[has_prior] - 1]
+
+        self._w_edge = w_edge
+        self._p_edge = p_edge
+        self._from_entries = None
+        return
+
+    def _derive(self, pred, node):
+        """ Vectorized Transaction.__derive_seq, pred and node are row arrays """
+        pt = self._type[pred]
+        nt = self._type[node]
+        loa = (LOA_START.seq, LOA_STOP.seq)
+        both_loa = np.in1d(pt, loa) & np.in1d(nt, loa)
+        bump = ((pt > nt) & ~both_loa) | ((pt == nt) & np.in1d(nt, [HIRE.seq, TERM.seq, CHANGE_JOB.seq]))
+        return self._seq[pred] + bump
+
+    def schedule(self):
+        """ Assign waves, a vectorized version of Wave_Scheduler (one level per round) """
+        n = self._rows
+        valid = np.flatnonzero(self._valid)
+        indeg = np.zeros(n, dtype=np.int32)
+        src = []
+        dst = []
+        for edge in (self._w_edge, self._p_edge):
+            has = valid[edge[valid] != NONE]
+            indeg[has] += 1
+            src.append(edge[has])
+            dst.append(has)
+        src = np.concatenate(src)
+        dst = np.concatenate(dst)
+        # Children of each row in CSR form
+        by_src = np.argsort(src, kind="mergesort")
+        children = dst[by_src]
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+
+        frontier = valid[indeg[valid] == 0]
+        done = 0
+        while len(frontier):
+            seq = np.zeros(len(frontier), dtype=np.int32)
+            for edge in (self._w_edge, self._p_edge):
+                pred = edge[frontier]
+                has = pred != NONE
+                if has.any():
+                    seq[has] = np.maximum(seq[has], self._derive(pred[has], frontier[has]))
+            self._seq[frontier] = seq
+            done += len(frontier)
+            # Release children
+            counts = indptr[frontier + 1] - indptr[frontier]
+            total = int(counts.sum())
+            if total == 0:
+                break
+            offsets = np.repeat(indptr[frontier] - np.cumsum(counts) + counts, counts)
+            kids = children[offsets + np.arange(total)]
+            np.subtract.at(indeg, kids, 1)
+            kids = np.unique(kids)
+            frontier = kids[indeg[kids] == 0]
+
+        if done != len(valid):
+            error("Dependency cycle, {} transactions could not be sequenced".format(len(valid) - done))
+            raise Exception
+        if len(valid):
+            self._max_seq = int(self._seq[valid].max())
+        return done
+
+    def set_final_term_seq(self):
+        """ Push each worker's top of stack term to the final wave """
+        wo = self._worker_order
+        if len(wo):
+            last = np.concatenate((self._emp[wo[1:]] != self._emp[wo[:-1]], [True]))
+            tops = wo[last]
+            self._seq[tops[self._type[tops] == TERM.seq]] = self._max_seq
+        return
+
+    @property
+    def max_seq(self):
+        return self._max_seq
+
+    def _row_str(self, i):
+        return "{}, {}, {}, {}, {}".format(dt.date.fromordinal(int(self._date[i])),
+                self._emp_ids[int(self._emp[i])],
+                self._pos_ids[int(self._pos[i])] if self._pos[i] != NONE else "",
+                self._types[int(self._type[i])], i + 1)
+
+    def output_lines(self, rows=None):
+        """ Generate the same lines as Transaction.output() for the given rows (default all) """
+        if rows is None:
+            rows = range(self._rows)
+        emp_out = self._emp_keys if self._anonymize else self._emp_ids
+        pos_out = self._pos_keys if self._anonymize else self._pos_ids + [sp.pos_id for sp in self._specials]
+        dates = {}
+        emp = self._emp.tolist()
+        seq = self._seq.tolist()
+        date = self._date.tolist()
+        ttype = self._type.tolist()
+        to = self._to.tolist()
+        frm = self._from.tolist()
+        valid = self._valid.tolist()
+        for i in rows:
+            d = dates.get(date[i])
+            if d is None:
+                d = dates[date[i]] = dt.date.fromordinal(date[i])
+            yield "{},{},{},{},{},{},{},{},{},{},{}".format(
+                self._rec[i], emp_out[emp[i]], seq[i], d,
+                self._types[ttype[i]], pos_out[to[i]], self._staffing[to[i]],
+                pos_out[frm[i]], self._staffing[frm[i]], i + 1, valid[i])
+
+    def write(self, fname, header):
+        """ Write every transaction in load order """
+        with open(fname, "w") as f:
+            f.write(header + "\n")
+            for line in self.output_lines():
+                f.write(line + "\n")
+        return
+
+    def write_by_type(self, timestamp, header):
+        """ Same files as --file-by-type, one per type ordered by record id """
+        rec_sort = np.array([int(r) if r else i + 1 for i, r in enumerate(self._rec)], dtype=np.int64)
+        for tt in Trans_Type.all_types():
+            rows = np.flatnonzero(self._type == tt.seq)
+            rows = rows[np.argsort(rec_sort[rows], kind="mergesort")]
+            fname = "{}.{}.csv".format(str(tt.ttype).replace(" ", "_"), timestamp)
+            info("Writing file {}".format(fname))
+            with open(fname, "w") as f:
+                f.write(header + "\n")
+                for line in self.output_lines(rows.tolist()):
+                    f.write(line + "\n")
+        return
+
+    def stats(self):
+        """ Return the row decoder stats """
+        return self._decoder.stats()
@@ -0,0 +1,93 @@
+"""
+    Per run state. Everything a run accumulates outside its own Transaction,
+    Worker and Position objects lives in a Run_Context rather than in class
+    attributes or module globals:
+        the max seq and the transaction that has it (Transaction.max_seq)
+        the invalid transactions and their messages (Transaction.add_to_invalid_list)
+        the transactions of each type (Trans_Type.add_transaction)
+        the transactions of the special positions (PRE_HIRE etc., see Special_Position)
+        the worker / position key counters and the anonymize flag
+
+    The classes read the current context, which is per thread. wave.py and the
+    other scripts just use the default one; a Sequencer (see sequencer.py) makes
+    its own and enters it (with context: ...) for every step, so runs in the
+    same process, or in different threads, don't see each other's state.
+"""
+import threading
+from sequence import Sequence
+
+# Positions of every new context are numbered after the special positions,
+# which are created once (see __init__.py)
+_position_seed = 0
+
+def set_position_seed(seed):
+    """ First position key number for new contexts """
+    global _position_seed
+    _position_seed = seed
+    return
+
+class Type_State(object):
+    """ The transactions of one Trans_Type in one run """
+
+    __slots__ = ("transactions", "invalid", "record_sorted")
+
+    def __init__(self):
+        self.transactions = []
+        self.invalid = []
+        self.record_sorted = []
+        return
+
+class Run_Context(object):
+    """ The state of one run, see the module doc """
+
+    def __init__(self, anonymize=False):
+        self.max_seq = -1
+        self.max_seq_t = None
+        self.invalid_list = {}
+        self.anonymize = anonymize
+        self.worker_seq = Sequence("worker")
+        self.position_seq = Sequence("position", _position_seed)
+        self._types = {}
+        self._specials = {}
+        return
+
+    def type_state(self, ttype):
+        """ Return the Type_State of ttype """
+        try:
+            ret = self._types[ttype]
+        except KeyError:
+            ret = self._types[ttype] = Type_State()
+        return ret
+
+    def special_position(self, position):
+        """ Return this run's copy of a special position """
+        try:
+            ret = self._specials[position]
+        except KeyError:
+            ret = self._specials[position] = position.run_copy()
+        return ret
+
+    def __enter__(self):
+        """ Make this the current context of this thread until __exit__ """
+        if not hasattr(_local, "stack"):
+            _local.stack = []
+        _local.stack.append(current_context())
+        _local.context = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.context = _local.stack.pop()
+        return False
+
+_local = threading.local()
+_default = Run_Context()
+# Threads that never enter a context share the default one, like the class
+# attributes used to be shared
+_local.context = _default
+
+def current_context():
+    """ Return the Run_Context of the calling thread """
+    try:
+        return _local.context
+    except AttributeError:
+        return _default
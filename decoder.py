@@ -0,0 +1,105 @@
+"""
+    Row decoding stage for the ingest loop.
+
+    Input files only ever contain a few thousand distinct dates and a dozen
+    distinct type strings, so rather than calling strptime and scanning the
+    type keywords for every row we memoize the parsed dates and look the
+    types up in a prebuilt keyword -> Trans_Type table.
+
+    The results must match the old decoder exactly:
+        dt.datetime.strptime(date_str, "%m/%d/%Y").date()
+        Trans_Type.get_type(type_str)
+
+    A worker is in dozens of rows and a date in thousands, so every reader
+    hands out one shared copy of each emp / position id (intern_id) and of
+    each date (shared_date) rather than a new object per row.
+"""
+import datetime as dt
+from transaction_type import Trans_Type
+
+DATE_FORMAT = "%m/%d/%Y"
+
+try:
+    intern_id = intern
+except NameError:
+    from sys import intern as intern_id
+
+# Every date handed out by a reader, dates are immutable so all runs can share them
+_dates = {}
+
+def shared_date(d):
+    """ Return the shared copy of date d """
+    try:
+        ret = _dates[d]
+    except KeyError:
+        ret = _dates[d] = d
+    return ret
+
+def date_from_ordinal(ordinal):
+    """ Return the shared copy of the date for ordinal """
+    return shared_date(dt.date.fromordinal(ordinal))
+
+class Row_Decoder(object):
+    """
+        Decodes the date and transaction type fields of an input row.
+        Keeps counters so we can report how well the caches are doing.
+    """
+
+    def __init__(self):
+        self._dates = {}
+        self._types = Trans_Type.keyword_map()
+        self._date_hits = 0
+        self._date_misses = 0
+        self._type_lookups = 0
+        return
+
+    @staticmethod
+    def _parse_date(date_str):
+        """
+            Fast path for m/d/Y. Anything that doesn't look like plain
+            digits goes through strptime so odd values fail (or pass) the
+            same way they always have
+        """
+        parts = date_str.split("/")
+        if len(parts) == 3:
+            m, d, y = parts
+            if (0 < len(m) < 3 and 0 < len(d) < 3 and len(y) == 4
+                    and m.isdigit() and d.isdigit() and y.isdigit()):
+                return dt.date(int(y), int(m), int(d))
+        return dt.datetime.strptime(date_str, DATE_FORMAT).date()
+
+    def date(self, date_str):
+        """ Return the date for date_str, parsing it only the first time we see it """
+        try:
+            ret = self._dates[date_str]
+            self._date_hits += 1
+        except KeyError:
+            ret = shared_date(self._parse_date(date_str))
+            self._dates[date_str] = ret
+            self._date_misses += 1
+        return ret
+
+    def ttype(self, type_str):
+        """ Map values in file for transaction type to supported transactions """
+        self._type_lookups += 1
+        ret = self._types.get(type_str)
+        if ret is None:
+            print("Error, unknown type {}".format(type_str))
+            raise Exception
+        return ret
+
+    @property
+    def date_hit_rate(self):
+        total = self._date_hits + self._date_misses
+        if total == 0:
+            ret = 0.0
+        else:
+            ret = float(self._date_hits) / total
+        return ret
+
+    def stats(self):
+        """ Return a one line summary of cache usage """
+        return ("Row decoder: {} date lookups, {} distinct dates, {:.1%} date cache hit rate, "
+                "{} type lookups against {} keywords").format(
+                self._date_hits + self._date_misses, len(self._dates),
+                self.date_hit_rate, self._type_lookups, len(self._types))
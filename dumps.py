@@ -0,0 +1,69 @@
+"""
+    Debugging output for a finished run, shared by wave.py and query.py
+    (which answers the same questions from a saved snapshot)
+"""
+from __init__ import *
+
+def print_debug(worker_dict, invalid_list_msg, max_seq_t):
+    """ Dump the max sequence transaction, the invalid workers and the invalid transactions """
+    print("Dumping max sequence transaction\n{}".format(max_seq_t))
+    print(max_seq_t.dump())
+    print("Dumping bad workers")
+    for w in worker_dict.values():
+        if w.invalid:
+            print(w.dump())
+    print("Done printing invalid workers")
+    print("Dumping bad transactions")
+    for t, m in invalid_list_msg:
+        print("Reason: {}".format(m))
+        print("\t{}".format(t.dump()))
+    print("Done printing invalid transactions")
+    return
+
+def _lookup(transaction_index, lineno):
+    """ Return the transaction at lineno (a string from the command line), None if there isn't one """
+    try:
+        i = int(lineno)
+    except ValueError:
+        i = 0
+    return transaction_index[i] if 0 < i < len(transaction_index) else None
+
+def print_dumps(worker_dict, position_dict, transaction_index,
+                workers=None, positions=None, transactions=None):
+    """
+        Dump the workers (emp ids), positions (position ids) and transactions (linenos)
+        asked for. transaction_index is a list of the transactions by lineno
+    """
+    if workers:
+        print("Dumping worker(s)")
+        for w in workers:
+            if w not in worker_dict:
+                print("Employee id {} not found in data file".format(w))
+            else:
+                print(worker_dict[w].dump())
+    if positions:
+        print("Dumping position(s)")
+        for p in positions:
+            if p not in position_dict:
+                print("Position id {} not found in data file".format(p))
+            else:
+                print(position_dict[p].dump())
+    if transactions:
+        for lineno in transactions:
+            t = _lookup(transaction_index, lineno)
+            if t is None:
+                print("Transaction lineno {} not found in data file".format(lineno))
+            else:
+                print(t.dump())
+    return
+
+def print_sequence(worker_dict, sequence):
+    """ Print the pre-reqs of the workers with a max sequence of at least sequence """
+    for w in worker_dict.values():
+        if w.max_seq >= sequence:
+            t = w.top_of_stack()
+            print("Found top-level worker transaction w seq > {}".format(sequence))
+            print("Pre-reqs for {}".format(t))
+            for ts in t.return_pre_reqs():
+                print("\t{}".format(ts))
+    return
@@ -0,0 +1,90 @@
+"""
+    Builds the output for --errored-records-file: only the transactions
+    needed to reload a list of records that failed to load.
+
+    Records are looked up by (type, record id) in the transaction list of
+    their type. Only the components (see partition.py) holding those records
+    are validated, everything a record depends on is in its own component.
+    The components are found by walking out from the records, not by
+    partitioning the whole run.
+    The records and their pre-reqs (the worker / position edges walked back,
+    see Transaction.return_pre_reqs) are then the only transactions sequenced.
+"""
+import csv
+from scheduler import Wave_Scheduler
+from sorting import sort_transactions
+from __init__ import *
+
+def read_record_ids(fname):
+    """ Return the record ids in fname, the first column of each non blank line """
+    ret = []
+    with open(fname, "rU") as f:
+        for row in csv.reader(f):
+            if row and row[0].strip():
+                ret.append(row[0].strip())
+    return ret
+
+def record_index(ttype):
+    """ Map record id to transaction for the transactions of type ttype, first one wins """
+    ret = {}
+    for t in ttype.get_ordered_transactions():
+        ret.setdefault(t.rec_number, t)
+    return ret
+
+def record_components(records, worker_dict, position_dict):
+    """
+        Return the workers and the positions of the components holding records,
+        in dict order. Walks out from the records' workers through the position
+        management positions they move into, the links partition.py joins
+        components on, so only those components are looked at
+    """
+    workers = set()
+    positions = set()
+    todo = [t.worker for t in records]
+    while todo:
+        w = todo.pop()
+        if w in workers:
+            continue
+        workers.add(w)
+        for t in w.get_transactions():
+            p = t.to_position
+            if (p is not None and p.staffing_model is POSITION_MGMT and p not in positions
+                    and p not in SPECIAL_POSITIONS):
+                positions.add(p)
+                todo.extend(pt.worker for pt in p.get_transactions())
+    return ([w for w in worker_dict.values() if w in workers],
+            [p for p in position_dict.values() if p in positions])
+
+def errored_records(ttype, rec_ids, worker_dict, position_dict, trans_list):
+    """
+        Validate and sequence what the records rec_ids of type ttype need. Returns
+        the records plus all their pre-reqs, sorted
+    """
+    index = record_index(ttype)
+    records = []
+    for rec in rec_ids:
+        if rec not in index:
+            print("Record {} of type {} not found in input file(s)".format(rec, ttype))
+        else:
+            records.append(index[rec])
+
+    # Validate the components holding the records, in the same order as a full run
+    workers, positions = record_components(records, worker_dict, position_dict)
+    for w in workers:
+        w.validate()
+    for p in positions:
+        p.validate()
+    info("Validated {} workers and {} positions for {} records".format(
+            len(workers), len(positions), len(records)))
+
+    ret = set()
+    for t in records:
+        if not t.valid:
+            print("Record {} of type {} is invalid: {}".format(t.rec_number, ttype, t.invalid_msg))
+            continue
+        ret.add(t)
+        ret.update(t.return_pre_reqs())
+    ret = list(ret)
+    Wave_Scheduler().schedule(ret)
+    sort_transactions(ret)
+    return ret
@@ -0,0 +1,153 @@
+#!/usr/bin/env python -B
+"""
+    Generates synthetic input files in wave.py's column layout:
+    record id, employee id, event date, position id, transaction type
+
+    Each worker is hired and then gets a history of job changes, org
+    assignments, comp changes, LOAs and terms (with rehires). Positions
+    people leave go back into a pool and are handed to later movers, which is
+    what links workers into the components wave.py has to sequence together.
+    A share of workers are in job management (Pre_Conversion), and a share of
+    rows are made invalid (an LOA Stop without an LOA Start).
+
+    The same arguments and seed always give the same file.
+
+    Ex:
+        generate.py data.csv --workers 50000 --history 6 --position-reuse 0.8
+"""
+import csv
+import random
+import argparse
+import datetime as dt
+
+START_DATE = dt.date(2010, 1, 1)
+# Hires are spread over this many days from START_DATE
+HIRE_DAYS = 400
+# Days between the events of a worker
+STEP_DAYS = [1, 5, 30, 90]
+LOA_DAYS = [10, 40]
+JOB_MGMT_POSITION = "Pre_Conversion"
+
+class Data_Generator(object):
+    """
+        Builds the rows of a synthetic input file, see the module doc. Rates are
+        probabilities between 0 and 1, history is the average number of events
+        after the hire
+    """
+
+    def __init__(self, workers, history=4, position_reuse=0.6, loa_rate=0.15, job_mgmt=0.2,
+                 invalid_rate=0.01, seed=1):
+        self._workers = workers
+        self._history = history
+        self._position_reuse = position_reuse
+        self._loa_rate = loa_rate
+        self._job_mgmt = job_mgmt
+        self._invalid_rate = invalid_rate
+        self._random = random.Random(seed)
+        # (date the position was left, position id)
+        self._free = []
+        self._position_count = 0
+        return
+
+    def _position(self, d):
+        """ A position to move into on date d, a free one if we can reuse one """
+        rnd = self._random
+        if self._free and rnd.random() < self._position_reuse:
+            i = rnd.randrange(len(self._free))
+            left, pos_id = self._free[i]
+            # Nobody can move in before the last person moved out
+            if left < d:
+                self._free[i] = self._free[-1]
+                self._free.pop()
+                return pos_id
+        self._position_count += 1
+        return "P{:07d}".format(self._position_count)
+
+    def _leave(self, pos_id, d):
+        if pos_id != JOB_MGMT_POSITION:
+            self._free.append((d, pos_id))
+        return
+
+    def _worker_rows(self, emp_id):
+        """ Return the (emp id, date, position, type) rows of one worker """
+        rnd = self._random
+        d = START_DATE + dt.timedelta(days=rnd.randrange(HIRE_DAYS))
+        job_mgmt = rnd.random() < self._job_mgmt
+        pos = JOB_MGMT_POSITION if job_mgmt else self._position(d)
+        rows = [(emp_id, d, pos, "Hire")]
+        for i in range(rnd.randint(0, 2 * self._history)):
+            d += dt.timedelta(days=rnd.choice(STEP_DAYS))
+            if rnd.random() < self._invalid_rate:
+                # Not on leave, so this is invalid
+                rows.append((emp_id, d, "", "LOA Stop"))
+                continue
+            if rnd.random() < self._loa_rate:
+                rows.append((emp_id, d, "", "LOA Start"))
+                # Some LOAs are still open at the end of the history
+                if rnd.random() < 0.1:
+                    break
+                d += dt.timedelta(days=rnd.choice(LOA_DAYS))
+                rows.append((emp_id, d, "", "LOA Stop"))
+                continue
+            r = rnd.random()
+            if r < 0.45:
+                if not job_mgmt:
+                    self._leave(pos, d)
+                    pos = self._position(d)
+                rows.append((emp_id, d, pos, "Job Change"))
+            elif r < 0.65:
+                rows.append((emp_id, d, pos, "Assign Org"))
+            elif r < 0.8:
+                rows.append((emp_id, d, pos, "Effective Dated Comp"))
+            elif r < 0.88:
+                rows.append((emp_id, d, pos, "Request Comp Change"))
+            else:
+                rows.append((emp_id, d, "", "Term"))
+                if not job_mgmt:
+                    self._leave(pos, d)
+                if rnd.random() < 0.5:
+                    break
+                d += dt.timedelta(days=rnd.choice(STEP_DAYS))
+                pos = JOB_MGMT_POSITION if job_mgmt else self._position(d)
+                rows.append((emp_id, d, pos, "Hire"))
+        return rows
+
+    def rows(self):
+        """ Return every row, as csv fields, in random order """
+        rows = []
+        for w in range(self._workers):
+            rows += self._worker_rows("E{:07d}".format(w))
+        self._random.shuffle(rows)
+        ret = []
+        for i, (emp_id, d, pos, ttype) in enumerate(rows):
+            ret.append((str(i + 1000), emp_id, "{}/{}/{}".format(d.month, d.day, d.year), pos, ttype))
+        return ret
+
+    def write(self, fname):
+        """ Write the rows to fname, returns the number of rows """
+        rows = self.rows()
+        with open(fname, "wb") as f:
+            csv.writer(f, lineterminator="\n").writerows(rows)
+        return len(rows)
+
+def parse_command_line():
+    """ Process command line arguments """
+    parser = argparse.ArgumentParser(description="Generate a synthetic input file for wave.py")
+    parser.add_argument("output_file", metavar="Output File")
+    parser.add_argument("--workers", type=int, default=10000, help="Number of workers")
+    parser.add_argument("--history", type=int, default=4, help="Average number of events per worker after the hire")
+    parser.add_argument("--position-reuse", type=float, default=0.6,
+                        help="Chance a mover gets a position someone else left rather than a new one")
+    parser.add_argument("--loa-rate", type=float, default=0.15, help="Chance an event is an LOA")
+    parser.add_argument("--job-mgmt", type=float, default=0.2, help="Share of workers in job management")
+    parser.add_argument("--invalid-rate", type=float, default=0.01, help="Share of events that are invalid")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_command_line()
+    generator = Data_Generator(args.workers, args.history, args.position_reuse, args.loa_rate,
+                               args.job_mgmt, args.invalid_rate, args.seed)
+    print("Wrote {} rows to {}".format(generator.write(args.output_file), args.output_file))
@@ -0,0 +1,238 @@
+"""
+    Incremental re-sequencing. Applies delta files to a snapshot saved by an
+    earlier run (wave.py --save-snapshot) instead of running everything again.
+
+    Delta rows are treated as more input files: the result is the same as a
+    full run over the original files followed by the delta files. A delta row
+    can only change the component (see partition.py) of its worker and of the
+    position management position it moves into, merging them if they differ.
+    Those components are rebuilt from their saved input rows plus the delta
+    rows and go through validation and sequencing again. Every other
+    component is restored as it was saved.
+
+    The saved transactions can also be removed or given a new date (see
+    whatif.py), their components are rebuilt the same way without them or
+    with the new date.
+
+    changes() then reports the waves and (wave, type) files whose contents
+    differ from the saved run, moved() the transactions whose wave changed.
+"""
+import gc
+from collections import OrderedDict
+from operator import attrgetter
+from snapshot import Snapshot
+from transaction import Transaction
+from partition import Component_Processor
+from build import build_structures
+from __init__ import *
+
+class Incremental_Run(object):
+    """ A saved run plus delta files, see run() """
+
+    def __init__(self, snapshot_fname):
+        self._snapshot = Snapshot(snapshot_fname)
+        self._saved = {}
+        self._removed = []
+        self._trans_list = []
+        self._worker_dict = None
+        self._position_dict = None
+        self._input_positions = []
+        return
+
+    def _read_delta(self, batches):
+        """
+            Make transactions for the delta rows, numbered after the saved ones.
+            Returns the transactions and their position ids as read
+        """
+        delta = []
+        input_positions = []
+        lineno = self._snapshot.transaction_count
+        for fname, rows in batches:
+            for rec, emp, d, ttype, pos in rows:
+                lineno += 1
+                delta.append(Transaction(d, ttype, emp, pos, lineno, rec))
+                input_positions.append(pos)
+            info("Read {} delta lines from {}".format(len(rows), fname))
+        return delta, input_positions
+
+    def _affected(self, delta, linenos):
+        """ Return the saved components the delta transactions and the saved linenos reach """
+        snapshot = self._snapshot
+        ret = set(snapshot.component_of_transaction(lineno) for lineno in linenos)
+        for t in delta:
+            for c in (snapshot.component_of_worker(t.emp_id), snapshot.component_of_position(t.position_id)):
+                if c is not None:
+                    ret.add(c)
+        return ret
+
+    def run(self, batches, jobs=1, remove=(), dates=None):
+        """
+            Apply the delta rows from batches (see ingest.Input_Reader), drop the saved
+            transactions with the linenos in remove and move the ones in dates
+            ({lineno: date}). Validates and sequences the affected components, using
+            jobs processes if asked to
+        """
+        # Nothing restored here is garbage, don't let the cyclic gc walk it
+        # over and over while we allocate
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._run(batches, jobs, set(remove), dates or {})
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return
+
+    def _check_linenos(self, linenos):
+        for lineno in linenos:
+            if self._snapshot.component_of_transaction(lineno) is None:
+                error("No transaction with lineno {} in the snapshot".format(lineno))
+                raise Exception("No transaction with lineno {} in the snapshot".format(lineno))
+        return
+
+    def _edit(self, transactions, remove, dates):
+        """ Return the rebuilt transactions without the removed ones, with the new dates """
+        ret = []
+        for t in transactions:
+            if t.lineno in remove:
+                self._removed.append(t)
+                continue
+            if t.lineno in dates:
+                t = Transaction(dates[t.lineno], t.ttype, t.emp_id, t.position_id, t.lineno, t.rec_number)
+            ret.append(t)
+        return ret
+
+    def _run(self, batches, jobs, remove, dates):
+        """ See run() """
+        snapshot = self._snapshot
+        self._check_linenos(remove)
+        self._check_linenos(dates)
+        delta, delta_positions = self._read_delta(batches)
+        affected = self._affected(delta, remove | set(dates))
+        info("Delta files reach {} of {} components".format(len(affected), snapshot.component_count))
+
+        records = snapshot.load_all(affected)
+        restored = snapshot.trans_list
+        for t in restored:
+            self._saved[t.lineno] = (t.seq, t.valid, t.to_position, t.from_position)
+        rebuilt = []
+        for c in sorted(records):
+            transactions, saved = snapshot.rebuild_component(records[c])
+            rebuilt += self._edit(transactions, remove, dates)
+            self._saved.update(saved)
+        rebuilt.sort(key=attrgetter("lineno"))
+        rebuilt += delta
+        info("Restored {} transactions, rebuilding {}".format(len(restored), len(rebuilt)))
+
+        self._worker_dict = snapshot.worker_lookup()
+        self._position_dict = snapshot.position_dict
+        build_structures(rebuilt, self._worker_dict, self._position_dict)
+        self._trans_list = sorted(restored + rebuilt, key=attrgetter("lineno"))
+        for t in self._trans_list:
+            t.ttype.add_transaction(t)
+        for t, msg in snapshot.invalid_list_msg():
+            t.ttype.add_to_invalid_list(t)
+            Transaction.add_to_invalid_list(t, msg)
+        self._input_positions = [snapshot.input_position(lineno)
+                                 for lineno in range(1, snapshot.transaction_count + 1)] + delta_positions
+
+        # Validation adds transactions to the position lists in worker order, so
+        # the dicts are filled in the order a full run over the input files would
+        worker_dict = {}
+        position_dict = {}
+        input_positions = self._input_positions
+        for t in self._trans_list:
+            pos_id = input_positions[t.lineno - 1]
+            if t.emp_id not in worker_dict:
+                worker_dict[t.emp_id] = t.worker
+            if pos_id and pos_id not in position_dict:
+                position_dict[pos_id] = self._position_dict[pos_id]
+        self._worker_dict = worker_dict
+        self._position_dict = position_dict
+
+        # Validate and sequence only what we rebuilt
+        rebuilt_workers = set(t.worker for t in rebuilt)
+        rebuilt_positions = set(t.to_position for t in rebuilt)
+        workers = OrderedDict((k, w) for k, w in worker_dict.items() if w in rebuilt_workers)
+        positions = OrderedDict((k, p) for k, p in position_dict.items() if p in rebuilt_positions)
+        Component_Processor(workers, positions).run(jobs)
+        for w in workers.values():
+            if w.valid:
+                for t in w.get_transactions():
+                    t.calc_edges()
+
+        # A saved final term has the max seq of the saved run, put it back to
+        # its own seq (wave.py moves it again for --final-term-file)
+        for w in self._worker_dict.values():
+            if w.valid and w.top_of_stack().ttype is TERM:
+                w.top_of_stack().calc_seq()
+        for t in self._trans_list:
+            if t.valid:
+                Transaction.max_seq(t.seq, t)
+        return
+
+    def _changed(self):
+        """ Yield (transaction, saved, now) for what differs from the saved run, None if absent """
+        for t in self._trans_list:
+            saved = self._saved.get(t.lineno)
+            now = (t.seq, t.valid, t.to_position, t.from_position)
+            if saved != now:
+                yield t, saved, now
+        for t in self._removed:
+            yield t, self._saved[t.lineno], None
+        return
+
+    def changes(self):
+        """
+            Return (waves, files) that differ from the saved run, where files are
+            (wave, Trans_Type) pairs, both sorted
+        """
+        waves = set()
+        files = set()
+        for t, saved, now in self._changed():
+            for seq, valid in [state[:2] for state in (now, saved) if state]:
+                if valid:
+                    waves.add(seq)
+                    files.add((seq, t.ttype))
+        return sorted(waves), sorted(files)
+
+    def moved(self):
+        """
+            Return (transaction, saved wave, wave) for the transactions whose wave
+            changed, in lineno order. The wave is None when the transaction is
+            invalid, removed or wasn't in the saved run
+        """
+        ret = []
+        for t, saved, now in self._changed():
+            before = saved[0] if saved and saved[1] else None
+            after = now[0] if now and now[1] else None
+            if before != after:
+                ret.append((t, before, after))
+        ret.sort(key=lambda m: m[0].lineno)
+        return ret
+
+    def close(self):
+        self._snapshot.close()
+        return
+
+    @property
+    def baseline_max_seq(self):
+        """ The max seq of the saved run """
+        return self._snapshot.max_seq
+
+    @property
+    def trans_list(self):
+        return self._trans_list
+
+    @property
+    def worker_dict(self):
+        return self._worker_dict
+
+    @property
+    def position_dict(self):
+        return self._position_dict
+
+    @property
+    def input_positions(self):
+        """ Position id as read from the file, by lineno - 1 """
+        return self._input_positions
@@ -0,0 +1,241 @@
+"""
+    Parallel ingest of the input files.
+
+    CSV parsing and row decoding are CPU bound, so with --jobs > 1 each file
+    (or each chunk of a large file) is parsed and decoded in a worker process.
+    Chunks are cut on line boundaries, which assumes fields don't contain
+    embedded newlines (true for the id / date / type files we load).
+
+    Results come back in file / chunk order, so the parent numbers the rows
+    (ctr / lineno) exactly as a serial read would.
+
+    Input_Reader is what wave.py uses: it takes files from the parse cache
+    (see cache.py) when it can, and parses the rest serially or with
+    Parallel_Reader. With stream set the rows of a file are handed over as
+    they are read rather than as a list, for callers that don't keep them
+    (see outofcore.py).
+"""
+import csv
+import os
+from multiprocessing import Pool
+from decoder import Row_Decoder, intern_id, date_from_ordinal
+from __init__ import *
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+def _text(data):
+    """ csv wants str, which is bytes on 2.x and text on 3.x """
+    if not isinstance(data, str):
+        data = data.decode()
+    return data
+
+def _chunk_bounds(fname, chunk_size):
+    """ Return (start, end) byte offsets for each chunk, ending just after a newline """
+    size = os.path.getsize(fname)
+    bounds = []
+    start = 0
+    with open(fname, "rb") as f:
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+def _parse_chunk(task):
+    """
+        Runs in the worker process. Parses and decodes the rows of one chunk
+        Returns a list of (record id, emp id, date ordinal, type seq, position id)
+    """
+    fname, start, end, skip, indexes = task
+    rec_i, emp_i, date_i, pos_i, type_i = indexes
+    decoder = Row_Decoder()
+    with open(fname, "rb") as f:
+        f.seek(start)
+        data = _text(f.read(end - start))
+    reader = csv.reader(data.splitlines(True))
+    for i in range(skip):
+        next(reader)
+    rows = []
+    for row in reader:
+        try:
+            # Interned ids are pickled once per chunk rather than once per row
+            rows.append((row[rec_i], intern_id(row[emp_i]), decoder.date(row[date_i]).toordinal(),
+                         decoder.ttype(row[type_i]).seq, intern_id(row[pos_i])))
+        except:
+            error("Exception reading row")
+            error(row)
+            error("From file {}".format(fname))
+            raise
+    return rows
+
+class Parallel_Reader(object):
+    """
+        Reads a list of input files with a pool of worker processes.
+        batches() yields (file name, rows) in file order, one per file however
+        many chunks it was cut into, where rows are
+        (record id, emp id, date, Trans_Type, position id). With stream rows
+        is an iterator that reads the chunks as it goes
+    """
+
+    def __init__(self, fnames, indexes, ignore_rows=None, jobs=2, chunk_size=DEFAULT_CHUNK_SIZE,
+                 stream=False):
+        self._fnames = fnames
+        self._indexes = indexes
+        self._ignore_rows = ignore_rows or 0
+        self._jobs = jobs
+        self._chunk_size = chunk_size
+        self._stream = stream
+        self._types = dict((tt.seq, tt) for tt in Trans_Type.all_types())
+        # Share date objects across chunks the same way Row_Decoder does within one
+        self._dates = {}
+        return
+
+    def _tasks(self):
+        """
+            One task per chunk, the rows to ignore only apply to the first chunk of a file.
+            Returns the tasks and the number of chunks of each file
+        """
+        tasks = []
+        counts = []
+        for fname in self._fnames:
+            bounds = _chunk_bounds(fname, self._chunk_size)
+            for i, (start, end) in enumerate(bounds):
+                skip = self._ignore_rows if i == 0 else 0
+                tasks.append((fname, start, end, skip, self._indexes))
+            counts.append(len(bounds))
+        return tasks, counts
+
+    def _date(self, ordinal):
+        ret = self._dates.get(ordinal)
+        if ret is None:
+            ret = self._dates[ordinal] = date_from_ordinal(ordinal)
+        return ret
+
+    def _rows(self, results, count):
+        """ Yield the rows of the next count chunks of results """
+        for i in range(count):
+            for rec, emp, d, seq, pos in next(results):
+                yield rec, intern_id(emp), self._date(d), self._types[seq], intern_id(pos)
+        return
+
+    def batches(self):
+        tasks, counts = self._tasks()
+        info("Parsing {} chunk(s) from {} file(s) with {} processes".format(
+                len(tasks), len(self._fnames), self._jobs))
+        pool = Pool(self._jobs)
+        try:
+            results = pool.imap(_parse_chunk, tasks)
+            for fname, count in zip(self._fnames, counts):
+                rows = self._rows(results, count)
+                yield fname, rows if self._stream else list(rows)
+        finally:
+            pool.terminate()
+            pool.join()
+        return
+
+def iter_file(fname, indexes, ignore_rows=None, decoder=None):
+    """
+        Serial read of one file, a row at a time.
+        Yields (record id, emp id, date, Trans_Type, position id)
+    """
+    rec_i, emp_i, date_i, pos_i, type_i = indexes
+    decoder = decoder or Row_Decoder()
+    with open(fname, "rU") as csvfile:
+        reader = csv.reader(csvfile)
+        if ignore_rows is not None:
+            for i in range(ignore_rows):
+                next(reader)
+        for row in reader:
+            try:
+                parsed = (row[rec_i], intern_id(row[emp_i]), decoder.date(row[date_i]),
+                          decoder.ttype(row[type_i]), intern_id(row[pos_i]))
+            except:
+                error("Exception reading row")
+                error(row)
+                error("From file {}".format(fname))
+                raise
+            yield parsed
+    return
+
+def read_file(fname, indexes, ignore_rows=None, decoder=None):
+    """
+        Serial read of one file.
+        Returns a list of (record id, emp id, date, Trans_Type, position id)
+    """
+    return list(iter_file(fname, indexes, ignore_rows, decoder))
+
+class Input_Reader(object):
+    """
+        Reads the input files, through the parse cache when one is given.
+        batches() yields (file name, rows) in file order, where rows are
+        (record id, emp id, date, Trans_Type, position id). With stream
+        rows is an iterator, good for one pass before the next batch
+    """
+
+    def __init__(self, fnames, indexes, ignore_rows=None, jobs=1,
+                 chunk_size=DEFAULT_CHUNK_SIZE, cache=None, stream=False):
+        self._fnames = fnames
+        self._indexes = indexes
+        self._ignore_rows = ignore_rows
+        self._jobs = jobs
+        self._chunk_size = chunk_size
+        self._cache = cache
+        self._stream = stream
+        return
+
+    def _parsed(self, fnames):
+        """ Parse fnames (serially or in parallel), yield (file name, rows) """
+        if self._jobs > 1:
+            reader = Parallel_Reader(fnames, self._indexes, self._ignore_rows,
+                                     self._jobs, self._chunk_size, self._stream)
+            for fname, rows in reader.batches():
+                yield fname, rows
+        else:
+            decoder = Row_Decoder()
+            read = iter_file if self._stream else read_file
+            for fname in fnames:
+                info("Opening {}".format(fname))
+                yield fname, read(fname, self._indexes, self._ignore_rows, decoder)
+            info(decoder.stats())
+        return
+
+    def batches(self):
+        cache = self._cache
+        if cache is None:
+            for batch in self._parsed(self._fnames):
+                yield batch
+            return
+
+        keys = [cache.key(fname) for fname in self._fnames]
+        # Only find out which files need parsing up front, each cached file is
+        # loaded when its turn comes rather than all of them at once
+        cached = [cache.has(key) for key in keys]
+        parsed = self._parsed([fname for fname, hit in zip(self._fnames, cached) if not hit])
+        for fname, key, hit in zip(self._fnames, keys, cached):
+            rows = cache.load(fname, key, self._stream) if hit else None
+            if rows is None:
+                if hit:
+                    # Unreadable entry, it wasn't given to the parser
+                    rows = read_file(fname, self._indexes, self._ignore_rows)
+                else:
+                    fname, rows = next(parsed)
+                if self._stream:
+                    # Saved once the caller has been through them
+                    rows = cache.storing(fname, rows, key)
+                else:
+                    cache.store(fname, rows, key)
+            else:
+                info("Loaded {} from the parse cache".format(fname))
+            yield fname, rows
+        if not all(cached):
+            # Let the parser finish up (decoder stats, pool shutdown)
+            for batch in parsed:
+                pass
+        info(cache.stats())
+        return
@@ -0,0 +1,211 @@
+"""
+    Memory sizing helpers. Used to report how much memory the core objects
+    take per instance so we can size the hosts that run wave.py
+
+    Memory_Monitor follows the memory use of a run: RSS, the bytes held by the
+    transactions, workers, positions and their pre-req edges and, when
+    tracemalloc is available (Python 3), the traced allocations by source line.
+    It also enforces --memory-limit, see Phase_Timer.check in timing.py
+"""
+import os
+import sys
+import struct
+from collections import OrderedDict
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, the report has RSS and object sizes only
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_CONTAINERS = (list, dict, set, tuple)
+
+def _attr_names(obj):
+    """ Return the names of the instance attributes of obj, slots or __dict__ """
+    names = []
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            if name.startswith("__") and not name.endswith("__"):
+                name = "_{}{}".format(cls.__name__.lstrip("_"), name)
+            names.append(name)
+    if hasattr(obj, "__dict__"):
+        names.extend(obj.__dict__.keys())
+    return names
+
+def object_size(obj):
+    """
+        Return the bytes used by obj itself: the instance, its __dict__ (if it
+        has one) and any containers it holds directly. Objects that are
+        shared between instances (positions, types, dates) are not counted
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    for name in _attr_names(obj):
+        value = getattr(obj, name, None)
+        if isinstance(value, _CONTAINERS):
+            size += sys.getsizeof(value)
+    return size
+
+def average_size(objs):
+    """ Average object_size over an iterable of objects, 0 if it's empty """
+    total = 0
+    count = 0
+    for o in objs:
+        total += object_size(o)
+        count += 1
+    if count == 0:
+        ret = 0
+    else:
+        ret = total // count
+    return ret
+
+def footprint_report(trans_list, workers, positions):
+    """ Return formatted text with bytes per object for the core classes """
+    ret_str = "Memory footprint:\n"
+    ret_str += "\tBytes per transaction: {}\n".format(average_size(trans_list))
+    ret_str += "\tBytes per worker: {}\n".format(average_size(workers))
+    ret_str += "\tBytes per position: {}\n".format(average_size(positions))
+    return ret_str
+
+def total_size(objs):
+    """ Sum of object_size over objs, returns (count, bytes) """
+    count = 0
+    size = 0
+    for o in objs:
+        size += object_size(o)
+        count += 1
+    return count, size
+
+def current_rss():
+    """ Resident set size of this process in bytes, None if we can't tell """
+    try:
+        with open("/proc/self/statm") as f:
+            ret = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        ret = None
+    return ret
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes, None if we can't tell """
+    if resource is None:
+        return None
+    ret = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    if sys.platform != "darwin":
+        ret *= 1024
+    return ret
+
+# Bytes per pre-req edge, the edges are references held in Transaction slots
+_POINTER_SIZE = struct.calcsize("P")
+
+# Allocation sites listed per phase when tracing
+TRACE_TOP = 10
+
+def _mb(size):
+    return "{:0.1f} MB".format(size / (1024.0 * 1024)) if size is not None else "n/a"
+
+class Memory_Monitor(object):
+    """
+        Measures memory at the end of each phase (measure) and checks RSS against
+        a limit (over_limit). track() hands over the run's containers so the
+        bytes can be split between transactions, workers, positions and edges.
+        report asks for a measure at the end of each phase, it starts tracemalloc
+        (if there is one) as early as possible
+    """
+
+    def __init__(self, limit=None, report=False):
+        self._limit = limit
+        self._report = report
+        self._trace = report and tracemalloc is not None
+        if self._trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._trans_list = ()
+        self._worker_dict = {}
+        self._position_dict = {}
+        self._transaction_index = []
+        return
+
+    def track(self, trans_list, worker_dict, position_dict, transaction_index):
+        """ The containers to size, they're read at each measure """
+        self._trans_list = trans_list
+        self._worker_dict = worker_dict
+        self._position_dict = position_dict
+        self._transaction_index = transaction_index
+        return
+
+    @property
+    def limit(self):
+        """ RSS limit in bytes, None for no limit """
+        return self._limit
+
+    @property
+    def report(self):
+        return self._report
+
+    def over_limit(self):
+        """ Return the current RSS if it is over the limit, None otherwise """
+        if self._limit is None:
+            return None
+        rss = current_rss()
+        if rss is None:
+            rss = peak_rss()
+        return rss if rss is not None and rss > self._limit else None
+
+    def _objects(self):
+        """ Bytes held by the tracked objects, by kind """
+        ret = OrderedDict()
+        count, size = total_size(self._trans_list)
+        ret["transactions"] = OrderedDict([("count", count), ("bytes", size)])
+        count, size = total_size(self._worker_dict.values())
+        ret["workers"] = OrderedDict([("count", count), ("bytes", size)])
+        count, size = total_size(self._position_dict.values())
+        ret["positions"] = OrderedDict([("count", count), ("bytes", size)])
+        edges = 0
+        for t in self._trans_list:
+            edges += len(t.edges)
+        ret["pre_req_edges"] = OrderedDict([("count", edges), ("bytes", edges * _POINTER_SIZE)])
+        ret["containers"] = OrderedDict([
+                ("trans_list", sys.getsizeof(self._trans_list)),
+                ("transaction_index", sys.getsizeof(self._transaction_index)),
+                ("worker_dict", sys.getsizeof(self._worker_dict)),
+                ("position_dict", sys.getsizeof(self._position_dict))])
+        return ret
+
+    def measure(self):
+        """ Return the memory use now as a dict, see the module doc """
+        ret = OrderedDict()
+        ret["rss"] = current_rss()
+        ret["peak_rss"] = peak_rss()
+        ret["objects"] = self._objects()
+        if self._trace:
+            current, peak = tracemalloc.get_traced_memory()
+            ret["traced"] = current
+            ret["traced_peak"] = peak
+            stats = tracemalloc.take_snapshot().statistics("lineno")[:TRACE_TOP]
+            ret["top_allocations"] = [OrderedDict([("line", str(s.traceback[0])), ("bytes", s.size),
+                                                   ("count", s.count)]) for s in stats]
+            # Each phase gets its own peak
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        return ret
+
+def memory_report(memory):
+    """ Return formatted text for a measure() result """
+    ret_str = "Memory use:\n"
+    ret_str += "\tRSS: {}\tPeak RSS: {}\n".format(_mb(memory["rss"]), _mb(memory["peak_rss"]))
+    for kind, v in memory["objects"].items():
+        if kind == "containers":
+            for name, size in v.items():
+                ret_str += "\t{}: {}\n".format(name, _mb(size))
+        else:
+            ret_str += "\t{}: {} ({})\n".format(kind.replace("_", " ").capitalize(), _mb(v["bytes"]), v["count"])
+    if "traced" in memory:
+        ret_str += "\tTraced: {}\tTraced peak: {}\n".format(_mb(memory["traced"]), _mb(memory["traced_peak"]))
+        ret_str += "\tTop allocations:\n"
+        for a in memory["top_allocations"]:
+            ret_str += "\t\t{}: {} ({} blocks)\n".format(a["line"], _mb(a["bytes"]), a["count"])
+    return ret_str
@@ -0,0 +1,269 @@
+"""
+    Out-of-core mode (--out-of-core) for inputs whose Transaction, Worker and
+    Position objects don't fit in memory.
+
+    The input rows are spilled to a SQLite database in a temporary file as
+    they are read. Only the worker and position ids stay in memory, joined
+    into components (see partition.py) as the rows go by. Components share
+    nothing, so they are packed into batches of about batch_rows rows and
+    each batch is read back, built into objects, validated and sequenced on
+    its own, like Component_Processor does for a whole run. The results go
+    back to the database and the objects are dropped before the next batch.
+    The output files are then written from the database.
+
+    Workers are validated in the same order as wave.py would (the order of
+    its worker dict), so the waves are the same as an in-memory run. A
+    component bigger than batch_rows is still processed in one piece, it is
+    the smallest unit that can be validated on its own.
+"""
+import os
+import gc
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from decoder import date_from_ordinal
+from transaction import Transaction
+from partition import Component_Processor, Union_Find
+from build import build_structures
+from output import write_rows, write_sqlite_rows, Wave_Writer
+from __init__ import *
+
+DEFAULT_BATCH_ROWS = 100000
+# Rows held in memory before they are written to the database
+SPILL_ROWS = 10000
+
+SCHEMA = """
+    create table rows (lineno integer primary key, rec text, worker integer, date integer,
+                       type integer, pos text);
+    create table workers (worker integer primary key, emp_id text, batch integer);
+    create table results (lineno integer primary key, type integer,
+                          valid integer, final_term integer, rec text, emp_id text, seq integer,
+                          date text, ttype text, to_pos text, to_pos_staffing text,
+                          from_pos text, from_pos_staffing text);
+    create table invalid (lineno integer primary key, message text);
+"""
+
+# Output row columns of the results table, see Transaction.output_row
+_ROW_COLUMNS = "rec, emp_id, seq, date, ttype, to_pos, to_pos_staffing, from_pos, from_pos_staffing, lineno, valid"
+
+def _rec_sort(rec, lineno):
+    """
+        Transaction.rec_sort_id of a results row, the order of --file-by-type and
+        --file-by-wave. Only called when writing those, record ids needn't be numbers otherwise
+    """
+    if rec:
+        ret = int(rec)
+    else:
+        ret = int(lineno)
+    return ret
+
+class Out_Of_Core_Run(object):
+    """ Sequences input rows a batch of components at a time, see the module doc """
+
+    def __init__(self, spill_dir=None, batch_rows=DEFAULT_BATCH_ROWS):
+        fd, self._fname = tempfile.mkstemp(prefix="wave.", suffix=".db", dir=spill_dir)
+        os.close(fd)
+        self._conn = sqlite3.connect(self._fname)
+        self._conn.text_factory = str
+        # Scratch data, nothing to recover after a crash
+        self._conn.execute("pragma journal_mode = off")
+        self._conn.execute("pragma synchronous = off")
+        self._conn.executescript(SCHEMA)
+        self._conn.create_function("rec_sort", 2, _rec_sort)
+        # Otherwise a record id that isn't a number only shows up as "user-defined
+        # function raised exception"
+        sqlite3.enable_callback_tracebacks(True)
+        self._batch_rows = batch_rows
+        self._batch_count = 0
+        self._types = dict((tt.seq, tt) for tt in Trans_Type.all_types())
+        # Position in the worker / position dicts of an in-memory run
+        self._worker_rank = {}
+        self._position_rank = {}
+        self._max_seq = -1
+        return
+
+    def close(self):
+        """ Close and delete the spill database """
+        self._conn.close()
+        os.remove(self._fname)
+        return
+
+    def read(self, batches):
+        """
+            Spill the rows from batches (see ingest.Input_Reader, best with stream set
+            so a file is never read whole) and split the workers into batches of
+            components. Returns the number of rows
+        """
+        conn = self._conn
+        uf = Union_Find(0)
+        emp_index = {}
+        positions = {}
+        worker_sets = []
+        worker_rows = []
+        lineno = 0
+        spilled = []
+        for fname, rows in batches:
+            start = lineno
+            for rec, emp, d, ttype, pos in rows:
+                lineno += 1
+                w = emp_index.get(emp)
+                if w is None:
+                    w = emp_index[emp] = len(worker_sets)
+                    worker_sets.append(uf.add())
+                    worker_rows.append(0)
+                worker_rows[w] += 1
+                if pos:
+                    p = positions.get(pos)
+                    if p is None:
+                        p = positions[pos] = uf.add()
+                    # Job management positions never link workers
+                    if pos != "Pre_Conversion":
+                        uf.union(worker_sets[w], p)
+                spilled.append((lineno, rec, w, d.toordinal(), ttype.seq, pos))
+                if len(spilled) == SPILL_ROWS:
+                    self._spill(spilled)
+                    spilled = []
+            info("Spilled {} lines from {}".format(lineno - start, fname))
+        self._spill(spilled)
+
+        # Both dicts were filled in the same order as wave.py fills its worker and
+        # position dicts, so they iterate in the same order
+        self._worker_rank = dict((emp, i) for i, emp in enumerate(emp_index))
+        self._position_rank = dict((pos, i) for i, pos in enumerate(positions))
+
+        # Pack whole components into batches, in first seen order
+        comp_workers = OrderedDict()
+        for w in range(len(worker_sets)):
+            comp_workers.setdefault(uf.find(worker_sets[w]), []).append(w)
+        emp_ids = [None] * len(worker_sets)
+        for emp, w in emp_index.items():
+            emp_ids[w] = emp
+        batch = 0
+        batch_size = 0
+        assigned = []
+        for workers in comp_workers.values():
+            size = sum(worker_rows[w] for w in workers)
+            if batch_size and batch_size + size > self._batch_rows:
+                batch += 1
+                batch_size = 0
+            batch_size += size
+            assigned += [(w, emp_ids[w], batch) for w in workers]
+        self._batch_count = batch + 1 if assigned else 0
+        with conn:
+            conn.executemany("insert into workers values (?, ?, ?)", assigned)
+        conn.execute("create index rows_worker on rows (worker)")
+        conn.execute("create index workers_batch on workers (batch)")
+        info("{} components in {} batches".format(len(comp_workers), self._batch_count))
+        return lineno
+
+    def _spill(self, rows):
+        """ Write rows to the rows table """
+        with self._conn:
+            self._conn.executemany("insert into rows values (?, ?, ?, ?, ?, ?)", rows)
+        return
+
+    def _load_batch(self, batch):
+        """ Return the transactions of batch in lineno order """
+        dates = {}
+        types = self._types
+        ret = []
+        for lineno, rec, emp, d, ttype, pos in self._conn.execute(
+                "select r.lineno, r.rec, w.emp_id, r.date, r.type, r.pos from rows r "
+                "join workers w on r.worker = w.worker where w.batch = ? order by r.lineno", (batch,)):
+            if d not in dates:
+                dates[d] = date_from_ordinal(d)
+            ret.append(Transaction(dates[d], types[ttype], emp, pos, lineno, rec))
+        return ret
+
+    def _process_batch(self, batch):
+        """ Validate and sequence one batch, saving the results """
+        trans_list = self._load_batch(batch)
+        worker_dict = {}
+        position_dict = {}
+        build_structures(trans_list, worker_dict, position_dict)
+        worker_rank = self._worker_rank
+        position_rank = self._position_rank
+        workers = OrderedDict(sorted(worker_dict.items(), key=lambda i: worker_rank[i[0]]))
+        positions = OrderedDict(sorted(position_dict.items(), key=lambda i: position_rank[i[0]]))
+        Component_Processor(workers, positions).run(1)
+
+        final_terms = set()
+        for w in workers.values():
+            if not w.valid:
+                continue
+            for t in w.get_transactions():
+                t.calc_edges()
+            if w.top_of_stack().ttype is TERM:
+                final_terms.add(w.top_of_stack())
+        with self._conn:
+            self._conn.executemany("insert into results values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   self._results(trans_list, final_terms))
+            self._conn.executemany("insert into invalid values (?, ?)",
+                                   ((t.lineno, msg) for t, msg in Transaction.get_invalid_list_msg()))
+
+        # Drop everything that still points at this batch
+        Transaction.clear_invalid_list()
+        for p in SPECIAL_POSITIONS:
+            p.reset()
+        for tt in Trans_Type.all_types():
+            tt.reset()
+        return len(trans_list)
+
+    def _results(self, trans_list, final_terms):
+        """ Yield the results rows of trans_list as they are inserted, noting the max seq """
+        for t in trans_list:
+            if t.valid and t.seq > self._max_seq:
+                self._max_seq = t.seq
+            yield (t.lineno, t.ttype.seq, t.valid, t in final_terms) + t.output_row()[:-2]
+        return
+
+    def run(self):
+        """ Validate and sequence every batch """
+        for batch in range(self._batch_count):
+            count = self._process_batch(batch)
+            # Workers, positions and transactions all point at each other
+            gc.collect()
+            info("Processed batch {} of {}, {} transactions".format(batch + 1, self._batch_count, count))
+        self._conn.execute("create index results_type on results (type)")
+        return
+
+    @property
+    def max_seq(self):
+        return self._max_seq
+
+    def _rows(self, where="", order="lineno", final_term=False):
+        """ Output rows from the results, final terms in the last wave if final_term """
+        sql = "select {}, final_term, type from results {} order by {}".format(_ROW_COLUMNS, where, order)
+        max_seq = self._max_seq
+        for row in self._conn.execute(sql):
+            seq = max_seq if final_term and row[11] and row[10] else row[2]
+            yield row[:2] + (seq,) + row[3:10] + (bool(row[10]),), row[12]
+
+    def write(self, fname, header, final_term=False):
+        """ Write every transaction in load order """
+        write_rows(fname, header, (row for row, ttype in self._rows(final_term=final_term)))
+        return
+
+    def write_by_type(self, timestamp, header, final_term=False):
+        """ Same files as --file-by-type, one per type ordered by record id """
+        for tt in Trans_Type.all_types():
+            fname = "{}.{}.csv".format(str(tt.ttype).replace(" ", "_"), timestamp)
+            info("Writing file {}".format(fname))
+            rows = self._rows("where type = {}".format(tt.seq), "rec_sort(rec, lineno), lineno", final_term)
+            write_rows(fname, header, (row for row, ttype in rows))
+        return
+
+    def write_by_wave(self, timestamp, header, final_term=False):
+        """ Same files as --file-by-wave """
+        writer = Wave_Writer(timestamp, header)
+        for row, ttype in self._rows("where valid = 1", "type, rec_sort(rec, lineno), lineno", final_term):
+            writer.add_row(row[2], self._types[ttype], row)
+        for fname in writer.close():
+            info("Wrote file {}".format(fname))
+        return
+
+    def write_sqlite(self, fname, final_term=False):
+        """ Same database as --sqlite """
+        write_sqlite_rows(fname, (row for row, ttype in self._rows(final_term=final_term)),
+                          self._conn.execute("select lineno, message from invalid order by lineno"))
+        return
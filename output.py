@@ -0,0 +1,176 @@
+"""
+    Writes the output files. Rows go through csv.writer in batches into
+    files with large buffers rather than one write call per transaction.
+
+    write_transactions writes one file (the default output), write_by_type
+    one file per type (--file-by-type) and write_by_wave one file per
+    (wave, type) (--file-by-wave), which are the files that actually get
+    loaded. All of them make a single pass over the transactions.
+
+    write_sqlite puts the same rows in an indexed SQLite database (--sqlite)
+    so lookups by worker, position, wave / type or record don't have to
+    scan the csv files.
+"""
+import os
+import csv
+import sqlite3
+from __init__ import *
+
+# Rows handed to csv.writer at a time and the file buffer size
+BATCH_SIZE = 4096
+BUFFER_SIZE = 1024 * 1024
+
+def _open(fname, header, mode="wb"):
+    """ Open fname for csv output, writing header if the file is new """
+    f = open(fname, mode, BUFFER_SIZE)
+    if mode == "wb":
+        f.write(header + "\n")
+    return f
+
+def _writer(f):
+    return csv.writer(f, lineterminator="\n")
+
+def write_rows(fname, header, rows):
+    """ Write output rows (see Transaction.output_row) to fname in the order given """
+    with _open(fname, header) as f:
+        writer = _writer(f)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                writer.writerows(batch)
+                batch = []
+        writer.writerows(batch)
+    return
+
+def write_transactions(fname, header, transactions):
+    """ Write transactions to fname in the order given """
+    write_rows(fname, header, (t.output_row() for t in transactions))
+    return
+
+def write_by_type(timestamp, header, needed=None):
+    """
+        One file per type named <type>.<timestamp>.csv, ordered by record id. Only
+        transactions in needed are written if given. Returns the file names
+    """
+    ret = []
+    for tt in Trans_Type.all_types():
+        fname = "{}.{}.csv".format(str(tt.ttype).replace(" ", "_"), timestamp)
+        info("Writing file {}".format(fname))
+        transactions = tt.get_ordered_transactions()
+        if needed is not None:
+            transactions = (t for t in transactions if t in needed)
+        write_transactions(fname, header, transactions)
+        ret.append(fname)
+    return ret
+
+class Wave_Writer(object):
+    """
+        Writes the valid transactions into one file per (wave, type), named
+        Wave_<wave>.<type>.<timestamp>.csv. Rows are buffered per file and the
+        file is appended to when its buffer fills, so only one file is open
+        at a time however many waves there are
+    """
+
+    def __init__(self, timestamp, header):
+        self._timestamp = timestamp
+        self._header = header
+        self._buffers = {}
+        self._fnames = {}
+        return
+
+    def _flush(self, key):
+        """ Write out the buffered rows for key, creating the file the first time """
+        if key in self._fnames:
+            mode = "ab"
+        else:
+            seq, tt = key
+            self._fnames[key] = "Wave_{}.{}.{}.csv".format(seq, str(tt.ttype).replace(" ", "_"), self._timestamp)
+            mode = "wb"
+        with _open(self._fnames[key], self._header, mode) as f:
+            _writer(f).writerows(self._buffers[key])
+        self._buffers[key] = []
+        return
+
+    def add(self, t):
+        """ Add a transaction, invalid ones have no wave and are skipped """
+        if t.valid:
+            self.add_row(t.seq, t.ttype, t.output_row())
+        return
+
+    def add_row(self, seq, ttype, row):
+        """ Add the output row of a valid transaction of type ttype in wave seq """
+        key = (seq, ttype)
+        batch = self._buffers.get(key)
+        if batch is None:
+            batch = self._buffers[key] = []
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            self._flush(key)
+        return
+
+    def close(self):
+        """ Flush everything, returns the file names in (wave, type) order """
+        for key in self._buffers:
+            if self._buffers[key] or key not in self._fnames:
+                self._flush(key)
+        return [self._fnames[key] for key in sorted(self._fnames)]
+
+def write_by_wave(timestamp, header, needed=None):
+    """
+        One file per (wave, type), see Wave_Writer. Each file is ordered by record
+        id. Only transactions in needed are written if given. Returns the file names
+    """
+    writer = Wave_Writer(timestamp, header)
+    for tt in Trans_Type.all_types():
+        for t in tt.get_ordered_transactions():
+            if needed is None or t in needed:
+                writer.add(t)
+    ret = writer.close()
+    for fname in ret:
+        info("Wrote file {}".format(fname))
+    return ret
+
+# Same columns as Transaction.output_row / Transaction.header
+SQLITE_SCHEMA = """
+    create table transactions (
+        rec_number text, emp_id text, seq integer, date text, type text,
+        to_pos text, to_pos_staffing text, from_pos text, from_pos_staffing text,
+        lineno integer primary key, valid integer);
+    create table invalid (lineno integer primary key, message text);
+"""
+SQLITE_INDEXES = """
+    create index transactions_emp_id on transactions (emp_id);
+    create index transactions_to_pos on transactions (to_pos);
+    create index transactions_from_pos on transactions (from_pos);
+    create index transactions_seq_type on transactions (seq, type);
+    create index transactions_rec_number on transactions (rec_number);
+"""
+
+def write_sqlite(fname, transactions, invalid_list_msg):
+    """
+        Write transactions and the (transaction, message) pairs of invalid_list_msg
+        to a new SQLite database fname, replacing it if it exists
+    """
+    write_sqlite_rows(fname, (t.output_row() for t in transactions),
+                      ((t.lineno, msg) for t, msg in invalid_list_msg))
+    return
+
+def write_sqlite_rows(fname, rows, invalid):
+    """ write_sqlite for output rows and (lineno, message) pairs """
+    if os.path.exists(fname):
+        os.remove(fname)
+    conn = sqlite3.connect(fname)
+    try:
+        # Nothing to recover if we die half way, the file is rewritten every run
+        conn.execute("pragma journal_mode = off")
+        conn.execute("pragma synchronous = off")
+        conn.executescript(SQLITE_SCHEMA)
+        with conn:
+            conn.executemany("insert or ignore into transactions values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("insert into invalid values (?, ?)", invalid)
+        # Indexes are cheaper to build once the rows are in
+        conn.executescript(SQLITE_INDEXES)
+    finally:
+        conn.close()
+    return
@@ -0,0 +1,205 @@
+"""
+    Splits the workers and positions into independent components and
+    processes the components in parallel.
+
+    Workers and positions form a bipartite graph through transactions (a
+    worker is linked to every position management position one of its
+    transactions moves into). Job management positions never create a
+    position edge so they don't link anything. Components that share no
+    worker or position are independent for Worker.validate, Position.validate,
+    the pre-req edges and the wave calculation.
+
+    Each worker process validates and sequences a bucket of components on its
+    own (forked) copy of the objects and sends back, per transaction, the
+    result: valid flag / message, to and from position and seq. The parent
+    then replays those results on its objects, in the same per worker order
+    the serial validation would have, so everything downstream (dumps,
+    pre-reqs, output) sees the same state as a serial run.
+"""
+import os
+import threading
+import multiprocessing
+from scheduler import Wave_Scheduler
+from __init__ import *
+
+# Set in the parent before forking, read by the worker processes. Runs in
+# other threads (see sequencer.py) wait for the fork before setting it again
+_processor = None
+_fork_lock = threading.Lock()
+
+class Union_Find(object):
+    """ Disjoint sets over the integers 0..n-1 """
+
+    def __init__(self, n):
+        self._parent = list(range(n))
+        return
+
+    def find(self, i):
+        parent = self._parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def add(self):
+        """ Add a new set, returns its integer """
+        self._parent.append(len(self._parent))
+        return len(self._parent) - 1
+
+    def union(self, i, j):
+        i = self.find(i)
+        j = self.find(j)
+        if i != j:
+            self._parent[j] = i
+        return
+
+def _process_bucket(bucket):
+    """ Runs in the worker process, see Component_Processor._process """
+    return _processor._process(bucket)
+
+class Component_Processor(object):
+    """
+        Finds the components and validates / sequences them, in parallel
+        when fork is available
+    """
+
+    def __init__(self, worker_dict, position_dict):
+        workers = list(worker_dict.values())
+        positions = list(position_dict.values())
+        # Position codes sent back by the worker processes
+        self._positions = SPECIAL_POSITIONS + positions
+        self._pos_codes = dict((p, i) for i, p in enumerate(self._positions))
+        self._components = self._find_components(workers, positions)
+        return
+
+    @staticmethod
+    def _find_components(workers, positions):
+        """ Return a list of (workers, positions) tuples, both in dict order """
+        w_count = len(workers)
+        pos_index = dict((p, w_count + i) for i, p in enumerate(positions))
+        uf = Union_Find(w_count + len(positions))
+        for i, w in enumerate(workers):
+            for t in w.get_transactions():
+                p = t.to_position
+                if p is not None and p.staffing_model is POSITION_MGMT and p in pos_index:
+                    uf.union(i, pos_index[p])
+        components = {}
+        roots = []
+        for i, w in enumerate(workers):
+            r = uf.find(i)
+            if r not in components:
+                components[r] = ([], [])
+                roots.append(r)
+            components[r][0].append(w)
+        for p in positions:
+            r = uf.find(pos_index[p])
+            if r in components:
+                components[r][1].append(p)
+        return [components[r] for r in roots]
+
+    @property
+    def components(self):
+        return self._components
+
+    def _buckets(self, jobs):
+        """ Spread the components over jobs * 4 buckets, biggest components first """
+        count = min(len(self._components), jobs * 4)
+        buckets = [[] for i in range(count)]
+        sizes = [0] * count
+        order = sorted(range(len(self._components)),
+                       key=lambda c: -sum(len(w.get_transactions()) for w in self._components[c][0]))
+        for c in order:
+            i = sizes.index(min(sizes))
+            buckets[i].append(c)
+            sizes[i] += sum(len(w.get_transactions()) for w in self._components[c][0])
+        return buckets
+
+    def _validate_and_schedule(self, workers, positions):
+        """ Everything the serial pipeline does for one component """
+        for w in workers:
+            w.validate()
+        for p in positions:
+            p.validate()
+        scheduler = Wave_Scheduler()
+        for w in workers:
+            if w.valid:
+                scheduler.schedule(w.get_transactions())
+        return
+
+    def _process(self, bucket):
+        """
+            Validate and sequence the components in bucket, return the results as
+            (component, index of the worker in it, worker valid flag,
+             [(lineno, valid, msg, seq, to code, from code), ...])
+            per worker
+        """
+        codes = self._pos_codes
+        ret = []
+        for c in bucket:
+            workers, positions = self._components[c]
+            self._validate_and_schedule(workers, positions)
+            for i, w in enumerate(workers):
+                rows = []
+                for t in w.get_transactions() + w.get_invalid_transactions():
+                    rows.append((t.lineno, t.valid, None if t.valid else t.invalid_msg, t.seq,
+                                 codes.get(t.to_position), codes.get(t.from_position)))
+                ret.append((c, i, w.valid, rows))
+        return ret
+
+    def _apply(self, results):
+        """ Replay the results from a worker process on our objects """
+        positions = self._positions
+        for c, i, w_valid, rows in results:
+            w = self._components[c][0][i]
+            # Walk the sorted transactions, the same order validate() uses, so
+            # the position lists end up in the same order as a serial run
+            by_lineno = dict((r[0], r) for r in rows)
+            for t in list(w.get_transactions()):
+                lineno, valid, msg, seq, to_code, from_code = by_lineno[t.lineno]
+                if not valid:
+                    t.invalidate(msg)
+                    continue
+                # validate() always sets to_position when there is no position id,
+                # which also fills in the position id
+                to_pos = positions[to_code]
+                if t.to_position is not to_pos or not t.position_id:
+                    t.to_position = to_pos
+                if t.from_position is None:
+                    t.from_position = positions[from_code]
+                t.set_seq(seq)
+            w.mark_validated(w_valid)
+        return
+
+    def run(self, jobs):
+        """ Validate and sequence every component, using jobs processes if we can fork """
+        global _processor
+        info("Found {} independent components".format(len(self._components)))
+        if jobs <= 1 or not hasattr(os, "fork"):
+            for workers, positions in self._components:
+                self._validate_and_schedule(workers, positions)
+            return
+
+        # Worker processes are forked when the pool is created and get a copy
+        # of the objects as they are now
+        with _fork_lock:
+            _processor = self
+            if hasattr(multiprocessing, "get_context"):
+                pool = multiprocessing.get_context("fork").Pool(jobs)
+            else:
+                pool = multiprocessing.Pool(jobs)
+        try:
+            done = 0
+            for results in pool.imap_unordered(_process_bucket, self._buckets(jobs)):
+                self._apply(results)
+                done += 1
+            info("Processed {} buckets of components".format(done))
+        finally:
+            pool.terminate()
+            pool.join()
+
+        # Serial validation leaves every position management position sorted
+        for workers, positions in self._components:
+            for p in positions:
+                if p.staffing_model is POSITION_MGMT:
+                    p.get_transactions()
+        return
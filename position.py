@@ -1,4 +1,6 @@
 from staffing_model import Staffing_Models
+from sorting import insert_transaction, find_transaction, sort_ties, key_order
+from context import current_context
 import __init__
 
 class Position(object):
@@ -7,22 +9,33 @@ class Position(object):
         dependencies between transactions
     """
 
+    __slots__ = ("_pos_id", "_staffing", "_tlist", "_keys", "_ties",
+                 "_invalid_list", "_sorted", "_key")
+
     # Set this to true if you want it to log transactions
     _log_trans = False
-    _anonymize = False
 
     @classmethod
     def anonymize(cls):
-        cls._anonymize = True
+        """ Output keys rather than position ids for the rest of this run """
+        current_context().anonymize = True
         return
 
-    def __init__(self, pos_id, staffing=Staffing_Models.POSITION_MGMT):
+    def __init__(self, pos_id, staffing=Staffing_Models.POSITION_MGMT, key=None):
         self._pos_id = pos_id
         self._staffing = staffing
+        # In sort key order, with the keys alongside (see sorting.py)
         self._tlist = []
-        self._invalid_list = []
+        self._keys = []
+        # Keys shared by more than one transaction, allocated on first use
+        self._ties = None
+        # Allocated on first use, most positions never have an invalid transaction
+        self._invalid_list = None
+        # Runs of transactions with the same key are in order
         self._sorted = False
-        self._key = "P{:06d}".format(__init__.position_seq.next())
+        if key is None:
+            key = "P{:06d}".format(current_context().position_seq.next())
+        self._key = key
         return
 
     def dump(self):
@@ -34,7 +47,7 @@ class Position(object):
         for t in self._tlist:
             ret_str += "\t\t{}\t\n".format(t)
         ret_str += "\tInvalid Transaction List:\n"
-        for t in self._invalid_list:
+        for t in self._invalid_list or []:
             ret_str += "\t\t{}\t\n".format(t)
         ret_str += "\n"
         return ret_str
@@ -44,8 +57,9 @@ class Position(object):
             Position is a special snowflake, when we sort we need to care about if we're going into a 
             position or out of a position. The out-of must happen first
         """
-        if not self._sorted and self._tlist:
-            self._tlist.sort()
+        if not self._sorted:
+            if self._ties:
+                sort_ties(self._tlist, self._keys, self._ties)
         self._sorted = True
         return
 
@@ -83,19 +97,28 @@ class Position(object):
         """
         if not self._sorted:
             self._sort()
-        if t not in self._tlist:
+        i = find_transaction(self._tlist, self._keys, t)
+        if not i:
             ret = None
         else:
-            i = self._tlist.index(t)
-            if i is 0:
-                ret = None
-            else:
-                ret = self._tlist[i-1]
+            ret = self._tlist[i-1]
         return ret
 
     def add_transaction(self, trans):
         """ Add a transaction to the list of transactions that involve this position """
-        self._tlist.append(trans)
+        if insert_transaction(self._tlist, self._keys, trans):
+            if self._ties is None:
+                self._ties = set()
+            self._ties.add(trans.sort_key)
+        self._sorted = False
+        return
+
+    def reset(self):
+        """ Forget every transaction (the special positions are reused, see outofcore.py) """
+        self._tlist = []
+        self._keys = []
+        self._ties = None
+        self._invalid_list = None
         self._sorted = False
         return
 
@@ -106,11 +129,31 @@ class Position(object):
 
     def remove_transaction(self, trans):
         """ If transaction is in our list, moves it to "invalid" list and out of tlist """
-        if trans in self._tlist:
-            self._tlist.remove(trans)
+        i = find_transaction(self._tlist, self._keys, trans)
+        if i is not None:
+            # Only the first one if it's in the list twice (moving from and to this position)
+            del self._tlist[i]
+            del self._keys[i]
+            if self._invalid_list is None:
+                self._invalid_list = []
             self._invalid_list.append(trans)
         return
 
+    def get_state(self):
+        """ Return our state as plain values, transactions as linenos (see snapshot.py) """
+        return (self._pos_id, self._staffing.name, self._key, self._sorted,
+                [t.lineno for t in self._tlist], [t.lineno for t in self._invalid_list or []])
+
+    def set_state(self, state, transaction):
+        """ Restore a state from get_state, transaction maps a lineno back to a Transaction """
+        pos_id, staffing, self._key, self._sorted, tlist, invalid_list = state
+        self._pos_id = pos_id
+        self._staffing = Staffing_Models[staffing]
+        self._tlist = [transaction(i) for i in tlist]
+        self._keys, self._ties = key_order(self._tlist)
+        self._invalid_list = [transaction(i) for i in invalid_list] or None
+        return
+
     @property
     def staffing_model(self):
         """ Returns the staffing model of this position """
@@ -119,7 +162,7 @@ class Position(object):
     @property
     def pos_id(self):
         """ Returns the ID of this position """
-        if Position._anonymize:
+        if current_context().anonymize:
             ret = self._key
         else:
             ret = self._pos_id
@@ -138,3 +181,53 @@ class Position(object):
         else:
             ret_str = "Pos id: [{}] Staffing: [{}]\n".format(self._pos_id, self._staffing)
         return ret_str
+
+
+class Special_Position(Position):
+    """
+        A position that isn't in the input files (PRE_HIRE etc., see __init__.py).
+        These are shared by every run, so the transactions are kept in a copy per
+        run (see context.py) and everything that touches them is passed on to it
+    """
+
+    __slots__ = ()
+
+    def run_copy(self):
+        """ A plain Position with our id and key, for Run_Context """
+        return Position(self._pos_id, self._staffing, self._key)
+
+    def _run_position(self):
+        return current_context().special_position(self)
+
+    def dump(self):
+        return self._run_position().dump()
+
+    def top_of_stack(self):
+        return self._run_position().top_of_stack()
+
+    def validate(self):
+        return self._run_position().validate()
+
+    def get_prior_transaction(self, t):
+        return self._run_position().get_prior_transaction(t)
+
+    def add_transaction(self, trans):
+        return self._run_position().add_transaction(trans)
+
+    def reset(self):
+        return self._run_position().reset()
+
+    def get_transactions(self):
+        return self._run_position().get_transactions()
+
+    def remove_transaction(self, trans):
+        return self._run_position().remove_transaction(trans)
+
+    def get_state(self):
+        return self._run_position().get_state()
+
+    def set_state(self, state, transaction):
+        return self._run_position().set_state(state, transaction)
+
+    def __repr__(self):
+        return repr(self._run_position())
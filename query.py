@@ -0,0 +1,67 @@
+#!/usr/bin/env python -B
+"""
+    Answers the debugging questions wave.py can answer (--dump-worker,
+    --dump-position, --dump-transaction, --sequence, --debug) from a snapshot
+    saved with wave.py --save-snapshot, without reading the input files or
+    validating / sequencing again.
+
+    Ex:
+        wave.py data/*.csv --save-snapshot run.snap
+        query.py run.snap --dump-worker E00010 --dump-transaction 1500
+"""
+import sys
+import time
+import argparse
+from snapshot import Snapshot
+from dumps import print_debug, print_dumps, print_sequence
+from __init__ import *
+
+def parse_command_line():
+    """ Process command line arguments """
+    parser = argparse.ArgumentParser(
+        description="Query a snapshot saved with wave.py --save-snapshot")
+    parser.add_argument("snapshot", metavar="Snapshot File", help="Snapshot saved by wave.py")
+    parser.add_argument("--dump-worker", action="append", help="Dump transaction list for worker with worker id")
+    parser.add_argument("--dump-position", action="append", help="Dump transaction list for position with worker id")
+    parser.add_argument("--dump-transaction", action="append", help="Dump transaction list for transaction with lineno")
+    parser.add_argument("-s", "--sequence", help="Print pre-reqs for workers w max sequence > value", type=int)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("-d", "--debug", action="store_true",
+                        help="Dump the max sequence transaction, invalid workers and invalid transactions")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    start = time.time()
+
+    args = parse_command_line()
+
+    if args.verbose:
+        l.setLevel(logging.INFO)
+    else:
+        l.setLevel(logging.WARNING)
+
+    snapshot = Snapshot(args.snapshot)
+    info("Snapshot {} has {} transactions in {} components, max sequence is {}".format(
+            args.snapshot, snapshot.transaction_count, snapshot.component_count, snapshot.max_seq))
+
+    # Only read the components needed to answer the question
+    snapshot.load_workers(args.dump_worker)
+    snapshot.load_positions(args.dump_position)
+    snapshot.load_transactions(args.dump_transaction)
+    if args.sequence is not None:
+        snapshot.load_sequence(args.sequence)
+    if args.debug:
+        snapshot.load_invalid()
+    info("Loaded {} components in {:0.3f} seconds".format(snapshot.loaded_count, time.time() - start))
+
+    worker_dict = snapshot.worker_dict
+    if args.debug:
+        print_debug(worker_dict, snapshot.invalid_list_msg(), snapshot.max_seq_t)
+    print_dumps(worker_dict, snapshot.position_dict, snapshot.transaction_index,
+                args.dump_worker, args.dump_position, args.dump_transaction)
+    if args.sequence is not None:
+        print_sequence(worker_dict, args.sequence)
+    snapshot.close()
+    sys.exit(0)
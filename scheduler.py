@@ -0,0 +1,73 @@
+"""
+    Assigns wave numbers (seq) to transactions.
+
+    Every transaction has at most two incoming edges, the prior transaction
+    for the worker and the prior transaction for the position (see
+    Transaction.calc_edges). The wave of a transaction is the longest path
+    to it through those edges, bumped by the rules in Transaction.calc_seq.
+
+    Rather than recursing back along the edges (which blows the stack for
+    long worker or position histories) we do a single Kahn style
+    topological pass: a transaction is sequenced as soon as everything on
+    the other end of its edges has been sequenced.
+"""
+from collections import deque
+from __init__ import *
+
+class Wave_Scheduler(object):
+    """
+        Sequences a set of transactions plus any unsequenced transactions
+        they depend on. Can be called repeatedly, transactions that already
+        have a seq are treated as fixed.
+    """
+
+    def __init__(self):
+        self._scheduled = 0
+        return
+
+    def schedule(self, transactions):
+        """ Assign seq to each transaction (and its unsequenced pre-reqs). Returns count sequenced """
+        # Discover the unsequenced part of the graph and count the unsequenced
+        # pre-reqs for each node
+        pending = {}
+        children = {}
+        stack = [t for t in transactions if t.valid and not t.seq_calcd]
+        while stack:
+            t = stack.pop()
+            if t in pending:
+                continue
+            t.calc_edges()
+            n = 0
+            for e in t.edges:
+                if not e.seq_calcd:
+                    n += 1
+                    children.setdefault(e, []).append(t)
+                    if e not in pending:
+                        stack.append(e)
+            pending[t] = n
+
+        # Now sequence everything whose pre-reqs are done, releasing children as we go
+        ready = deque(t for t, n in pending.items() if n == 0)
+        count = 0
+        while ready:
+            t = ready.popleft()
+            t.calc_seq()
+            count += 1
+            for c in children.pop(t, ()):
+                pending[c] -= 1
+                if pending[c] == 0:
+                    ready.append(c)
+
+        if count != len(pending):
+            stuck = [t for t, n in pending.items() if n > 0]
+            error("Dependency cycle, {} transactions could not be sequenced".format(len(stuck)))
+            for t in sorted(stuck, key=lambda t: t.lineno)[:10]:
+                error("\t{}".format(t))
+            raise Exception
+        self._scheduled += count
+        return count
+
+    @property
+    def scheduled(self):
+        """ Total number of transactions sequenced by this scheduler """
+        return self._scheduled
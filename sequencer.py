@@ -0,0 +1,174 @@
+"""
+    Library entry point for sequencing, for callers that would rather not
+    start a wave.py process per run.
+
+    A Sequencer keeps everything of its run in its own Run_Context (see
+    context.py) and makes it the current context for each step, so any
+    number of runs can be done one after the other in the same process, or
+    at the same time in different threads, without seeing each other's
+    transactions, invalid lists or max seq.
+
+    Ex:
+        s = Sequencer()
+        s.load(["a.csv", "b.csv"])
+        s.validate()
+        s.schedule(final_term=True)
+        s.write("output.csv")
+
+    The steps are the same as wave.py's default run (no --worker, --position
+    or --errored-records-file) and give the same output.
+"""
+from transaction import Transaction
+from ingest import Input_Reader, DEFAULT_CHUNK_SIZE
+from partition import Component_Processor
+from build import build_structures
+from scheduler import Wave_Scheduler
+from context import Run_Context
+from output import write_transactions, write_by_type, write_by_wave, write_sqlite
+from __init__ import *
+
+# Column of each field in the input files, same as wave.py:
+# record id, emp id, effective date, position id, type
+DEFAULT_INDEXES = (0, 1, 2, 3, 4)
+
+class Sequencer(object):
+    """
+        One sequencing run: load() the input files (as many calls as needed),
+        then validate(), schedule() and write the output. jobs > 1 parses and
+        validates / sequences with that many processes (see partition.py).
+        cache is an optional Parse_Cache (see cache.py)
+    """
+
+    def __init__(self, indexes=DEFAULT_INDEXES, ignore_rows=None, jobs=1, anonymize=False, cache=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self._context = Run_Context(anonymize)
+        self._indexes = indexes
+        self._ignore_rows = ignore_rows
+        self._jobs = jobs
+        self._cache = cache
+        self._chunk_size = chunk_size
+        self._trans_list = []
+        self._worker_dict = {}
+        self._position_dict = {}
+        self._validated = False
+        self._scheduled = False
+        return
+
+    def _check(self, step, done, message):
+        if not done:
+            error("Sequencer.{}: {}".format(step, message))
+            raise Exception("Sequencer.{}: {}".format(step, message))
+        return
+
+    def load(self, input_files):
+        """ Read the transactions from input_files, returns the number of rows read """
+        self._check("load", not self._validated, "can't load more files once validated")
+        trans_list = self._trans_list
+        count = 0
+        with self._context:
+            reader = Input_Reader(input_files, self._indexes, self._ignore_rows, self._jobs,
+                                  self._chunk_size, self._cache)
+            for fname, rows in reader.batches():
+                for rec, emp, d, ttype, pos in rows:
+                    t = Transaction(d, ttype, emp, pos, len(trans_list) + 1, rec)
+                    trans_list.append(t)
+                    ttype.add_transaction(t)
+                count += len(rows)
+                info("Finished reading {} lines from {}".format(len(rows), fname))
+        return count
+
+    def validate(self):
+        """ Build the workers and positions and validate them, returns the number of invalid transactions """
+        self._check("validate", not self._validated, "already validated")
+        with self._context:
+            build_structures(self._trans_list, self._worker_dict, self._position_dict)
+            if self._jobs > 1:
+                # Sequences the components too
+                Component_Processor(self._worker_dict, self._position_dict).run(self._jobs)
+                self._scheduled = True
+            else:
+                for w in self._worker_dict.values():
+                    w.validate()
+                for p in self._position_dict.values():
+                    p.validate()
+            ret = len(Transaction.get_invalid_transactions())
+        self._validated = True
+        return ret
+
+    def schedule(self, final_term=False):
+        """
+            Work out the waves, with final_term the last term of each worker goes
+            in the last wave (--final-term-file). Returns the max seq
+        """
+        self._check("schedule", self._validated, "validate() first")
+        with self._context:
+            for w in self._worker_dict.values():
+                if w.valid:
+                    for t in w.get_transactions():
+                        t.calc_edges()
+            if not self._scheduled:
+                scheduler = Wave_Scheduler()
+                for w in self._worker_dict.values():
+                    if w.valid:
+                        scheduler.schedule(w.get_transactions())
+                self._scheduled = True
+            if final_term:
+                for w in self._worker_dict.values():
+                    if w.valid and w.top_of_stack().ttype is TERM:
+                        w.top_of_stack().set_final_term_seq()
+            ret = Transaction.get_max_seq()
+        return ret
+
+    def write(self, fname):
+        """ Write every transaction in load order to fname """
+        self._check("write", self._scheduled, "schedule() first")
+        with self._context:
+            write_transactions(fname, Transaction.header(), self._trans_list)
+        return
+
+    def write_by_type(self, timestamp):
+        """ Write one file per type (--file-by-type), returns the file names """
+        self._check("write_by_type", self._scheduled, "schedule() first")
+        with self._context:
+            ret = write_by_type(timestamp, Transaction.header())
+        return ret
+
+    def write_by_wave(self, timestamp):
+        """ Write one file per wave and type (--file-by-wave), returns the file names """
+        self._check("write_by_wave", self._scheduled, "schedule() first")
+        with self._context:
+            ret = write_by_wave(timestamp, Transaction.header())
+        return ret
+
+    def write_sqlite(self, fname):
+        """ Write the results to the SQLite database fname (--sqlite) """
+        self._check("write_sqlite", self._scheduled, "schedule() first")
+        with self._context:
+            write_sqlite(fname, self._trans_list, Transaction.get_invalid_list_msg())
+        return
+
+    @property
+    def context(self):
+        """ The Run_Context, enter it (with ...) to work on the objects directly """
+        return self._context
+
+    @property
+    def max_seq(self):
+        return self._context.max_seq
+
+    @property
+    def transactions(self):
+        return self._trans_list
+
+    @property
+    def workers(self):
+        return self._worker_dict
+
+    @property
+    def positions(self):
+        return self._position_dict
+
+    @property
+    def invalid(self):
+        """ Return (transaction, message) for each invalid transaction """
+        return self._context.invalid_list.items()
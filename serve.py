@@ -0,0 +1,346 @@
+#!/usr/bin/env python -B
+"""
+    Keeps a finished run in memory and answers dependency and wave queries
+    about it, so questions don't each need a wave.py run with --worker,
+    --position or --sequence.
+
+    The run is either sequenced from input files once at start up (through a
+    Sequencer, see sequencer.py) or loaded whole from a --snapshot. Queries
+    are JSON objects with an op and its arguments, sent one per line over a
+    Unix socket (--socket), or over HTTP on localhost (--port) as
+    GET /<op>?<arguments> or a POST of the JSON object. Transactions are
+    given as lineno, or record and type; workers as emp_id; positions as pos_id.
+
+        wave        lineno | record + type | emp_id
+                    the wave and the chain of edges that puts it there (for a
+                    worker, of its transaction in the highest wave)
+        prereqs     lineno | record + type
+                    every transaction that must load before it
+        dump        lineno | emp_id | pos_id
+                    the same text as --dump-transaction / worker / position
+        subgraph    linenos, emp_ids, pos_ids (lists, comma separated over HTTP)
+                    the transactions of those and all their pre-reqs, with the edges
+        stats       counts and the max sequence
+
+    Answers are JSON objects, with an error key if the query can't be answered.
+
+    Ex:
+        serve.py a.csv b.csv --socket /tmp/wave.sock
+        echo '{"op": "wave", "emp_id": "E00010"}' | nc -U /tmp/wave.sock
+        serve.py --snapshot run.snap --port 8765
+        curl 'localhost:8765/prereqs?record=1000&type=Hire'
+"""
+import os
+import sys
+import json
+import time
+import argparse
+try:
+    import SocketServer as socketserver
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from urlparse import urlparse, parse_qsl
+except ImportError:
+    import socketserver
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qsl
+from transaction import Transaction
+from snapshot import Snapshot
+from sequencer import Sequencer
+from sorting import sort_transactions
+from context import current_context
+from __init__ import *
+
+# Keys of a transaction in the answers, the fields of Transaction.output_row
+ROW_KEYS = ("rec_number", "emp_id", "seq", "date", "type", "to_pos", "to_pos_staffing",
+            "from_pos", "from_pos_staffing", "lineno", "valid")
+
+# Arguments that are lists, comma separated over HTTP
+LIST_ARGS = ("linenos", "emp_ids", "pos_ids")
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+def _row(t):
+    """ A transaction as a dict of ROW_KEYS """
+    ret = dict(zip(ROW_KEYS, t.output_row()))
+    ret["date"] = str(ret["date"])
+    return ret
+
+def _edge_kind(e, t):
+    """
+        position if e is t's position edge, worker if its worker edge. Not by emp id,
+        the position edge can be the same worker's earlier move into the position
+    """
+    return "position" if e is t._pos_edge else "worker"
+
+class Query_Engine(object):
+    """
+        Answers queries (see the module doc) about the transactions, workers and
+        positions of a finished run. context is the Run_Context they belong to
+    """
+
+    def __init__(self, trans_list, worker_dict, position_dict, context):
+        self._worker_dict = worker_dict
+        self._position_dict = position_dict
+        self._context = context
+        self._by_lineno = {}
+        self._by_record = {}
+        for t in trans_list:
+            self._by_lineno[t.lineno] = t
+            # Same as --errored-records-file, the first one wins
+            self._by_record.setdefault((t.rec_number, t.ttype), t)
+        self._ops = {"wave": self._wave, "prereqs": self._prereqs, "dump": self._dump,
+                     "subgraph": self._subgraph, "stats": self._stats}
+        return
+
+    def _lineno(self, lineno):
+        try:
+            ret = self._by_lineno.get(int(lineno))
+        except (TypeError, ValueError):
+            ret = None
+        if ret is None:
+            raise ValueError("No transaction with lineno {}".format(lineno))
+        return ret
+
+    def _transaction(self, req):
+        """ The transaction a query is about, by lineno or by record and type """
+        if "lineno" in req:
+            ret = self._lineno(req["lineno"])
+        elif "record" in req and "type" in req:
+            if not isinstance(req["type"], string_types):
+                raise ValueError("Type {} is not a string".format(json.dumps(req["type"])))
+            ttype = Trans_Type.get_type(req["type"])
+            if ttype is None:
+                raise ValueError("Unknown type {}".format(req["type"]))
+            ret = self._by_record.get((str(req["record"]), ttype))
+            if ret is None:
+                raise ValueError("No record {} of type {}".format(req["record"], ttype))
+        else:
+            raise ValueError("Give a lineno, or a record and a type")
+        return ret
+
+    def _list(self, req, key):
+        """ The list argument key of req, empty if it isn't given """
+        ret = req.get(key, [])
+        if not isinstance(ret, list):
+            raise ValueError("{} must be a list".format(key))
+        return ret
+
+    def _worker(self, emp_id):
+        if not isinstance(emp_id, string_types):
+            raise ValueError("Emp id {} is not a string".format(json.dumps(emp_id)))
+        if emp_id not in self._worker_dict:
+            raise ValueError("No worker with emp id {}".format(emp_id))
+        return self._worker_dict[emp_id]
+
+    def _position(self, pos_id):
+        if not isinstance(pos_id, string_types):
+            raise ValueError("Position id {} is not a string".format(json.dumps(pos_id)))
+        if pos_id not in self._position_dict:
+            raise ValueError("No position {}".format(pos_id))
+        return self._position_dict[pos_id]
+
+    def _wave(self, req):
+        if "emp_id" in req:
+            w = self._worker(req["emp_id"])
+            transactions = w.get_transactions()
+            if not transactions:
+                raise ValueError("Worker {} has no valid transactions".format(req["emp_id"]))
+            t = max(transactions, key=lambda t: t.seq)
+        else:
+            t = self._transaction(req)
+        path = []
+        e = t.critical_edge()
+        cur = t
+        while e is not None:
+            step = _row(e)
+            step["edge"] = _edge_kind(e, cur)
+            path.append(step)
+            cur = e
+            e = e.critical_edge()
+        return {"transaction": _row(t), "wave": t.seq, "valid": t.valid,
+                "invalid_msg": None if t.valid else t.invalid_msg, "path": path}
+
+    def _prereqs(self, req):
+        t = self._transaction(req)
+        return {"transaction": _row(t), "prereqs": [_row(p) for p in t.return_pre_reqs()]}
+
+    def _dump(self, req):
+        if "emp_id" in req:
+            ret = self._worker(req["emp_id"]).dump()
+        elif "pos_id" in req:
+            ret = self._position(req["pos_id"]).dump()
+        else:
+            ret = self._transaction(req).dump()
+        return {"dump": ret}
+
+    def _subgraph(self, req):
+        roots = [self._lineno(i) for i in self._list(req, "linenos")]
+        for emp_id in self._list(req, "emp_ids"):
+            roots += self._worker(emp_id).get_transactions()
+        for pos_id in self._list(req, "pos_ids"):
+            roots += self._position(pos_id).get_transactions()
+        nodes = set()
+        for t in roots:
+            if t not in nodes:
+                nodes.add(t)
+                nodes.update(t.return_pre_reqs())
+        edges = []
+        for t in nodes:
+            if t.valid:
+                t.calc_edges()
+                for e in t.edges:
+                    edges.append((e.lineno, t.lineno, _edge_kind(e, t)))
+        return {"transactions": [_row(t) for t in sort_transactions(list(nodes))], "edges": sorted(set(edges))}
+
+    def _stats(self, req):
+        return {"transactions": len(self._by_lineno), "workers": len(self._worker_dict),
+                "positions": len(self._position_dict), "invalid": len(self._context.invalid_list),
+                "max_seq": self._context.max_seq}
+
+    def answer(self, req):
+        """ Answer the query req (a dict), errors are returned under the error key """
+        start = time.time()
+        try:
+            op = self._ops.get(req.get("op"))
+            if op is None:
+                raise ValueError("Unknown op {}, expected one of {}".format(
+                        req.get("op"), ", ".join(sorted(self._ops))))
+            with self._context:
+                ret = op(req)
+        except ValueError as e:
+            ret = {"error": str(e)}
+        except (TypeError, KeyError) as e:
+            # An argument of a type we don't check for, the query is still answered
+            ret = {"error": "Bad query: {}: {}".format(type(e).__name__, e)}
+        ret["ms"] = round((time.time() - start) * 1000, 3)
+        return ret
+
+class Socket_Handler(socketserver.StreamRequestHandler):
+    """ One JSON query per line, one JSON answer per line """
+
+    def handle(self):
+        for line in iter(self.rfile.readline, b""):
+            if not line.strip():
+                continue
+            try:
+                req = json.loads(line)
+            except ValueError:
+                ret = {"error": "Query is not JSON"}
+            else:
+                ret = self.server.engine.answer(req if isinstance(req, dict) else {})
+            self.wfile.write((json.dumps(ret) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        return
+
+class Http_Handler(BaseHTTPRequestHandler):
+    """ GET /<op>?<arguments> or POST the JSON query """
+
+    def _send(self, ret):
+        body = json.dumps(ret).encode("utf-8")
+        self.send_response(400 if "error" in ret else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        req = dict(parse_qsl(url.query))
+        for k in LIST_ARGS:
+            if k in req:
+                req[k] = [v for v in req[k].split(",") if v]
+        req["op"] = url.path.strip("/")
+        self._send(self.server.engine.answer(req))
+        return
+
+    def do_POST(self):
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            req = None
+        if isinstance(req, dict):
+            self._send(self.server.engine.answer(req))
+        else:
+            self._send({"error": "Query is not a JSON object"})
+        return
+
+    def log_message(self, format, *args):
+        info(format % args)
+        return
+
+def parse_command_line():
+    """ Process command line arguments """
+    parser = argparse.ArgumentParser(description="Answer dependency and wave queries about a run")
+    parser.add_argument("input_file", metavar="Input File", nargs="*",
+                        help="Input files to sequence, unless --snapshot is given")
+    parser.add_argument("--snapshot", help="Load the run saved by wave.py --save-snapshot instead")
+    parser.add_argument("-i", "--ignore-rows", type=int, help="Ignore first n rows of input file")
+    parser.add_argument("--final-term-file", action="store_true",
+                        help="Hold \"final\" terms for the last wave, as wave.py does")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Processes used to sequence the input files")
+    parser.add_argument("--socket", help="Serve on this Unix socket")
+    parser.add_argument("--port", type=int, help="Serve HTTP on this port of localhost")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    start = time.time()
+
+    args = parse_command_line()
+
+    if args.verbose:
+        l.setLevel(logging.INFO)
+    else:
+        l.setLevel(logging.WARNING)
+
+    if bool(args.socket) == bool(args.port):
+        error("Give one of --socket or --port")
+        sys.exit(1)
+    if bool(args.snapshot) == bool(args.input_file):
+        error("Give input files or a --snapshot, not both")
+        sys.exit(1)
+
+    if args.snapshot:
+        snapshot = Snapshot(args.snapshot)
+        snapshot.load_all()
+        context = current_context()
+        context.max_seq = snapshot.max_seq
+        context.max_seq_t = snapshot.max_seq_t
+        context.invalid_list = dict(snapshot.invalid_list_msg())
+        engine = Query_Engine(snapshot.trans_list, snapshot.worker_lookup(), snapshot.position_dict, context)
+        snapshot.close()
+    else:
+        sequencer = Sequencer(ignore_rows=args.ignore_rows, jobs=args.jobs)
+        sequencer.load(args.input_file)
+        sequencer.validate()
+        sequencer.schedule(args.final_term_file)
+        engine = Query_Engine(sequencer.transactions, sequencer.workers, sequencer.positions,
+                              sequencer.context)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = socketserver.UnixStreamServer(args.socket, Socket_Handler)
+        os.chmod(args.socket, 0o600)
+        where = args.socket
+    else:
+        # Only local clients, there's no authentication
+        server = HTTPServer(("127.0.0.1", args.port), Http_Handler)
+        where = "http://127.0.0.1:{}".format(args.port)
+    server.engine = engine
+    print("Loaded in {:0.1f} seconds, serving on {}".format(time.time() - start, where))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -0,0 +1,412 @@
+"""
+    Saves the finished state of a run so it can be queried later without
+    running the pipeline again (see query.py).
+
+    Everything a dump looks at (a worker's transactions, a position's
+    transactions, the pre-reqs of a transaction) stays inside one component
+    of workers and position management positions (see partition.py). The
+    snapshot is saved per component, so a query only reads and rebuilds the
+    components it needs rather than the whole data set.
+
+    The objects aren't pickled directly (the edges make the object graph far
+    too deep), the file is a run of pickled flat records:
+        component   transactions (date ordinal, type seq, emp id, position id as
+                    read from the file, lineno, record #) + Transaction.get_state(), positions
+                    (code, Position.get_state()) and workers
+                    (index, Worker.get_state())
+        shared      Position.get_state() for each job management position,
+                    their lists cross components so they are only read when
+                    the position itself is dumped
+        index       where everything is, see save_snapshot
+    and the last 8 bytes are the offset of the index.
+    Positions are saved as their code (index into SPECIAL_POSITIONS followed
+    by the position dict) and transactions as their lineno.
+
+    The rows as read from the input files are kept (validation fills in
+    missing position ids) so a component can be rebuilt from scratch, see
+    incremental.py.
+"""
+import gc
+import struct
+from array import array
+from collections import OrderedDict
+from decoder import date_from_ordinal
+from worker import Worker
+from transaction import Transaction
+from partition import Union_Find
+from __init__ import *
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+SNAPSHOT_VERSION = 1
+
+_TRAILER = struct.Struct("<Q")
+
+def _array_to_bytes(a):
+    if hasattr(a, "tobytes"):
+        ret = a.tobytes()
+    else:
+        ret = a.tostring()
+    return ret
+
+def _array_from_bytes(code, data):
+    ret = array(code)
+    if hasattr(ret, "frombytes"):
+        ret.frombytes(data)
+    else:
+        ret.fromstring(data)
+    return ret
+
+def _components(workers, positions):
+    """
+        Return a list of (worker indexes, position codes), grouping workers with
+        the position management positions their transactions move in or out of
+    """
+    w_count = len(workers)
+    codes = dict((p, i) for i, p in enumerate(positions))
+    uf = Union_Find(w_count + len(positions))
+    for i, w in enumerate(workers):
+        for t in w.get_transactions() + w.get_invalid_transactions():
+            for p in (t.to_position, t.from_position):
+                if p is not None and p.staffing_model is POSITION_MGMT:
+                    uf.union(i, w_count + codes[p])
+    components = OrderedDict()
+    for i in range(w_count):
+        components.setdefault(uf.find(i), ([], []))[0].append(i)
+    for code, p in enumerate(positions):
+        if p.staffing_model is POSITION_MGMT:
+            r = uf.find(w_count + code)
+            if r in components:
+                components[r][1].append(code)
+    return list(components.values())
+
+def _dump(data, f):
+    """ Pickle data to f, return the offset it starts at """
+    ret = f.tell()
+    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    return ret
+
+def save_snapshot(fname, trans_list, worker_dict, position_dict, input_positions):
+    """
+        Save the transactions, workers and positions of a finished run.
+        input_positions[lineno - 1] is the position id read from the file
+    """
+    workers = list(worker_dict.values())
+    positions = SPECIAL_POSITIONS + list(position_dict.values())
+    codes = dict((p, i) for i, p in enumerate(positions))
+    pos_code = lambda p: codes[p] if p is not None else None
+
+    components = _components(workers, positions)
+    comp_of_lineno = array("i", [-1]) * (len(trans_list) + 1)
+    comp_of_worker = [0] * len(workers)
+    comp_of_position = {}
+    offsets = []
+    with open(fname, "wb") as f:
+        for c, (w_indexes, p_codes) in enumerate(components):
+            rows = []
+            for i in w_indexes:
+                comp_of_worker[i] = c
+                w = workers[i]
+                for t in w.get_transactions() + w.get_invalid_transactions():
+                    comp_of_lineno[t.lineno] = c
+                    rows.append((t.date.toordinal(), t.ttype.seq, t.emp_id,
+                                 input_positions[t.lineno - 1], t.lineno, t.rec_number)
+                                + t.get_state(pos_code))
+            for code in p_codes:
+                comp_of_position[code] = c
+            offsets.append(_dump({
+                    "transactions": rows,
+                    "positions": [(code, positions[code].get_state()) for code in p_codes],
+                    "workers": [(i, workers[i].get_state()) for i in w_indexes]}, f))
+
+        shared = {}
+        for code, p in enumerate(positions[len(SPECIAL_POSITIONS):], len(SPECIAL_POSITIONS)):
+            if p.staffing_model is not POSITION_MGMT:
+                shared[code] = _dump(p.get_state(), f)
+
+        max_seq_t = Transaction.get_max_seq_t()
+        index = {
+            "version": SNAPSHOT_VERSION,
+            "components": offsets,
+            # code -> ((pos id, staffing, key), component or None if shared)
+            "positions": [(p.get_state()[:3], comp_of_position.get(code))
+                          for code, p in enumerate(positions)],
+            "shared": shared,
+            # worker index -> (emp id, component, valid, max seq)
+            "workers": [(w.get_state()[0], comp_of_worker[i], w.valid, w.max_seq)
+                        for i, w in enumerate(workers)],
+            "linenos": _array_to_bytes(comp_of_lineno),
+            "invalid": [(t.lineno, msg) for t, msg in Transaction.get_invalid_list_msg()],
+            "max_seq": (Transaction.get_max_seq(), max_seq_t.lineno if max_seq_t is not None else None),
+        }
+        f.write(_TRAILER.pack(_dump(index, f)))
+    return
+
+class Snapshot(object):
+    """
+        Reads a snapshot saved by save_snapshot. Nothing is rebuilt until it is
+        asked for, the load_* methods read the components needed to answer a
+        question and worker_dict / position_dict / transaction_index hold
+        everything loaded so far
+    """
+
+    def __init__(self, fname):
+        self._f = open(fname, "rb")
+        self._f.seek(-_TRAILER.size, 2)
+        offset, = _TRAILER.unpack(self._f.read(_TRAILER.size))
+        self._index = self._read(offset)
+        if self._index.get("version") != SNAPSHOT_VERSION:
+            print("Snapshot {} is version {}, expected {}".format(
+                    fname, self._index.get("version"), SNAPSHOT_VERSION))
+            raise Exception
+        self._comp_of_lineno = _array_from_bytes("i", self._index["linenos"])
+        self._worker_index = dict((w[0], i) for i, w in enumerate(self._index["workers"]))
+        self._position_index = dict((p[0][0], code) for code, p in enumerate(self._index["positions"])
+                                    if code >= len(SPECIAL_POSITIONS))
+        self._types = dict((tt.seq, tt) for tt in Trans_Type.all_types())
+        self._dates = {}
+        self._loaded = set()
+        self._shared_loaded = set()
+        self._transactions = {}
+        self._input_positions = {}
+        self._workers = {}
+        self._positions = dict(enumerate(SPECIAL_POSITIONS))
+        return
+
+    def close(self):
+        self._f.close()
+        return
+
+    def _read(self, offset):
+        self._f.seek(offset)
+        return pickle.load(self._f)
+
+    def _position(self, code):
+        """ Return the Position for code, creating it (with no transactions yet) if needed """
+        if code is None:
+            return None
+        ret = self._positions.get(code)
+        if ret is None:
+            pos_id, staffing, key = self._index["positions"][code][0]
+            ret = self._positions[code] = Position(pos_id)
+            ret.set_state((pos_id, staffing, key, False, [], []), self._transactions.__getitem__)
+        return ret
+
+    def _date(self, d):
+        ret = self._dates.get(d)
+        if ret is None:
+            ret = self._dates[d] = date_from_ordinal(d)
+        return ret
+
+    def _load_component(self, c):
+        if c < 0 or c in self._loaded:
+            return
+        self._loaded.add(c)
+        data = self._read(self._index["components"][c])
+        transaction = self._transactions.__getitem__
+        # Nothing we build here is garbage, don't let the cyclic gc walk it
+        # over and over while we allocate
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            rows = data["transactions"]
+            for d, seq, emp, pos_id, lineno, rec in (row[:6] for row in rows):
+                self._transactions[lineno] = Transaction(self._date(d), self._types[seq],
+                                                         emp, pos_id, lineno, rec)
+                self._input_positions[lineno] = pos_id
+            for row in rows:
+                transaction(row[4]).set_state(row[6:], self._position, transaction)
+            for code, state in data["positions"]:
+                self._position(code).set_state(state, transaction)
+            for i, state in data["workers"]:
+                w = self._workers[i] = Worker(state[0])
+                w.set_state(state, transaction)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return
+
+    def read_component(self, c):
+        """ Return the saved records of component c without building anything """
+        return self._read(self._index["components"][c])
+
+    def component_of_worker(self, emp_id):
+        """ Return the component of the worker, None if there is no such worker """
+        i = self._worker_index.get(emp_id)
+        return self._index["workers"][i][1] if i is not None else None
+
+    def component_of_position(self, pos_id):
+        """ Return the component of the position, None if there is no such position or it is shared """
+        code = self._position_index.get(pos_id)
+        return self._index["positions"][code][1] if code is not None else None
+
+    def component_of_transaction(self, lineno):
+        """ Return the component of the transaction, None if there is no such lineno """
+        try:
+            ret = self._comp_of_lineno[int(lineno)] if int(lineno) > 0 else -1
+        except (TypeError, ValueError, IndexError):
+            ret = -1
+        return ret if ret >= 0 else None
+
+    def load_all(self, exclude=()):
+        """
+            Load every component except the ones in exclude, and the job management
+            positions with the transactions that got loaded. The workers and positions
+            of the excluded components are created empty (with their saved keys) so
+            worker_dict and position_dict still have everything in the saved order.
+            Returns {component: records} for the excluded components
+        """
+        ret = {}
+        for c in range(self.component_count):
+            if c in exclude:
+                data = ret[c] = self.read_component(c)
+                for code, state in data["positions"]:
+                    self._position(code)
+                for i, state in data["workers"]:
+                    w = self._workers[i] = Worker(state[0])
+                    w.set_state(state[:2] + (True, False, False, False, [], []), None)
+            else:
+                self._load_component(c)
+        for code in range(len(self._index["positions"])):
+            self._position(code)
+        for code, offset in self._index["shared"].items():
+            pos_id, staffing, key, is_sorted, tlist, invalid_list = self._read(offset)
+            loaded = self._transactions
+            self._positions[code].set_state(
+                    (pos_id, staffing, key, is_sorted, [i for i in tlist if i in loaded],
+                     [i for i in invalid_list if i in loaded]), loaded.__getitem__)
+        return ret
+
+    def rebuild_component(self, data):
+        """
+            For the records of a component (from load_all) return
+                new, unvalidated transactions made from the input rows
+                {lineno: (seq, valid, to position, from position)} as saved
+        """
+        transactions = []
+        saved = {}
+        for row in data["transactions"]:
+            d, seq, emp, pos_id, lineno, rec = row[:6]
+            transactions.append(Transaction(self._date(d), self._types[seq], emp, pos_id, lineno, rec))
+            self._input_positions[lineno] = pos_id
+            state = row[6:]
+            saved[lineno] = (state[9], state[3], self._position(state[1]), self._position(state[2]))
+        return transactions, saved
+
+    def input_position(self, lineno):
+        """ The position id of a loaded transaction as it was read from the file """
+        return self._input_positions[lineno]
+
+    def load_workers(self, emp_ids):
+        """ Load the workers with these emp ids, unknown ids are ignored """
+        for emp_id in emp_ids or []:
+            i = self._worker_index.get(emp_id)
+            if i is not None:
+                self._load_component(self._index["workers"][i][1])
+        return
+
+    def load_transactions(self, linenos):
+        """ Load the transactions with these linenos, unknown ones are ignored """
+        for lineno in linenos or []:
+            try:
+                c = self._comp_of_lineno[int(lineno)]
+            except (TypeError, ValueError, IndexError):
+                continue
+            self._load_component(c)
+        return
+
+    def load_positions(self, pos_ids):
+        """
+            Load the positions with these ids, unknown ids are ignored. A job
+            management position loads every component it has transactions from
+        """
+        for pos_id in pos_ids or []:
+            code = self._position_index.get(pos_id)
+            if code is None:
+                continue
+            c = self._index["positions"][code][1]
+            if c is not None:
+                self._load_component(c)
+            elif code not in self._shared_loaded:
+                state = self._read(self._index["shared"][code])
+                self.load_transactions(state[4] + state[5])
+                self._position(code).set_state(state, self._transactions.__getitem__)
+                self._shared_loaded.add(code)
+        return
+
+    def load_sequence(self, sequence):
+        """ Load the workers with a max sequence of at least sequence """
+        for emp_id, c, valid, max_seq in self._index["workers"]:
+            if max_seq >= sequence:
+                self._load_component(c)
+        return
+
+    def load_invalid(self):
+        """ Load the invalid workers and transactions and the max sequence transaction """
+        for emp_id, c, valid, max_seq in self._index["workers"]:
+            if not valid:
+                self._load_component(c)
+        self.load_transactions([lineno for lineno, msg in self._index["invalid"]])
+        self.load_transactions([self._index["max_seq"][1]])
+        return
+
+    @property
+    def transaction_count(self):
+        return len(self._comp_of_lineno) - 1
+
+    @property
+    def component_count(self):
+        return len(self._index["components"])
+
+    @property
+    def loaded_count(self):
+        """ Number of components loaded so far """
+        return len(self._loaded)
+
+    @property
+    def max_seq(self):
+        return self._index["max_seq"][0]
+
+    @property
+    def max_seq_t(self):
+        """ The max sequence transaction, if it is loaded """
+        return self._transactions.get(self._index["max_seq"][1])
+
+    def invalid_list_msg(self):
+        """ Return (transaction, message) for the loaded invalid transactions """
+        return [(self._transactions[lineno], msg) for lineno, msg in self._index["invalid"]
+                if lineno in self._transactions]
+
+    @property
+    def worker_dict(self):
+        """ Loaded workers keyed by emp id, in the same order as the run that saved them """
+        workers = self._index["workers"]
+        return OrderedDict((workers[i][0], self._workers[i]) for i in sorted(self._workers))
+
+    def worker_lookup(self):
+        """ Loaded workers keyed by emp id, like worker_dict but without the order """
+        workers = self._index["workers"]
+        return dict((workers[i][0], w) for i, w in self._workers.items())
+
+    @property
+    def position_dict(self):
+        """ Loaded positions keyed by position id """
+        positions = self._index["positions"]
+        return OrderedDict((positions[code][0][0], p) for code, p in sorted(self._positions.items())
+                           if code >= len(SPECIAL_POSITIONS))
+
+    @property
+    def trans_list(self):
+        """ Loaded transactions in lineno order """
+        return [self._transactions[lineno] for lineno in sorted(self._transactions)]
+
+    @property
+    def transaction_index(self):
+        """ Loaded transactions by lineno, None where not loaded, the same as wave.py """
+        ret = [None] * (self.transaction_count + 1)
+        for lineno, t in self._transactions.items():
+            ret[lineno] = t
+        return ret
@@ -0,0 +1,93 @@
+"""
+    Sorting helpers for lists of transactions.
+
+    Workers and positions keep their transaction lists in sort key order as
+    transactions are added (insert_transaction), with a list of the keys
+    alongside to bisect on. Only the runs of transactions with the same key
+    need the comparison operators (sort_ties), the list never has to be
+    sorted from scratch. Inserting after the equal keys puts everything
+    where sort_transactions would, so the order is the same as sorting the
+    whole list again after each add.
+
+    Kept free of module level imports from __init__ so position.py can use
+    it without a circular import.
+"""
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from operator import attrgetter
+
+_sort_key = attrgetter("sort_key")
+
+def sort_transactions(tlist):
+    """
+        Sort a list of transactions in place, in the same order as sorting
+        with the Transaction comparison operators.
+        Everything is ordered by the precomputed (date, type seq) sort key.
+        Only runs of transactions with the same date and type fall back to the
+        comparison operators, which handle the position handoff (moving out
+        of a position happens before moving into it)
+    """
+    tlist.sort(key=_sort_key)
+    start = 0
+    for key, group in groupby(tlist, _sort_key):
+        n = sum(1 for _ in group)
+        if n > 1:
+            tlist[start:start + n] = sorted(tlist[start:start + n])
+        start += n
+    return tlist
+
+def insert_transaction(tlist, keys, t):
+    """
+        Insert t into tlist, which is in sort key order with keys (the sort keys
+        of tlist) kept alongside. t goes after the transactions with the same key,
+        as a stable sort would put it. Returns True if t shares its key with another
+    """
+    key = t.sort_key
+    i = bisect_right(keys, key)
+    keys.insert(i, key)
+    tlist.insert(i, t)
+    return i > 0 and keys[i - 1] == key
+
+def find_transaction(tlist, keys, t):
+    """ Return the index of (the first) t in tlist, None if it isn't there """
+    key = t.sort_key
+    i = bisect_left(keys, key)
+    n = len(keys)
+    ret = None
+    while i < n and keys[i] == key:
+        if tlist[i] is t:
+            ret = i
+            break
+        i += 1
+    return ret
+
+def sort_ties(tlist, keys, ties):
+    """
+        Order each run of transactions whose key is in ties with the comparison
+        operators, the same as sort_transactions does. Keys that are no longer
+        shared are dropped from ties
+    """
+    for key in list(ties):
+        lo = bisect_left(keys, key)
+        hi = bisect_right(keys, key, lo)
+        if hi - lo > 1:
+            tlist[lo:hi] = sorted(tlist[lo:hi])
+        else:
+            ties.discard(key)
+    return
+
+def key_order(tlist):
+    """
+        Put tlist in sort key order (a stable sort, ties keep their order) for
+        insert_transaction. Returns the keys and the set of keys shared by more
+        than one transaction, None if there are none
+    """
+    tlist.sort(key=_sort_key)
+    keys = [t.sort_key for t in tlist]
+    ties = None
+    for i in range(1, len(keys)):
+        if keys[i] == keys[i - 1]:
+            if ties is None:
+                ties = set()
+            ties.add(keys[i])
+    return keys, ties
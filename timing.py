@@ -0,0 +1,148 @@
+"""
+    Phase timers for wave.py. Each phase (ingest, build, validate, ...) gets
+    its wall clock time and whatever counts the caller adds (rows, workers,
+    files, ...). Optionally one phase is run under cProfile.
+
+    The report is written as JSON (--timing), next to the output file, so
+    runs can be compared over time. With a Memory_Monitor (see memory.py) the
+    report also has the memory use at the end of each phase (--memory-report)
+    and the run is stopped, report written, once RSS goes over --memory-limit.
+"""
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+from collections import OrderedDict
+from memory import peak_rss, memory_report
+from __init__ import *
+
+# Phases wave.py goes through, in order. Not every run has all of them
+PHASES = ["ingest", "build", "validate", "edges", "sequence", "final_term",
+          "snapshot", "dumps", "stats", "output"]
+
+# Functions listed in the report for the profiled phase
+PROFILE_TOP = 30
+
+REPORT_VERSION = 1
+
+class Phase_Timer(object):
+    """
+        Times consecutive phases. phase() ends the current phase and starts the
+        next one, stop() ends the last one. A phase entered more than once adds up.
+        The report goes next to output_file
+    """
+
+    def __init__(self, output_file, profile_phase=None, memory=None):
+        self._output_file = output_file
+        self._memory = memory
+        self._start = time.time()
+        self._phases = OrderedDict()
+        self._current = None
+        self._current_start = None
+        self._profile_phase = profile_phase
+        self._profiler = None
+        self._aborted = None
+        return
+
+    def phase(self, name, **counts):
+        """ End the current phase and start phase name, adding counts to it """
+        self.stop()
+        if name not in self._phases:
+            self._phases[name] = {"seconds": 0.0, "counts": OrderedDict()}
+        self._current = name
+        if name == self._profile_phase:
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._current_start = time.time()
+        self.count(**counts)
+        return
+
+    def count(self, **counts):
+        """ Add counts to the current phase """
+        phase_counts = self._phases[self._current]["counts"]
+        for k, v in sorted(counts.items()):
+            phase_counts[k] = phase_counts.get(k, 0) + v
+        self.check()
+        return
+
+    def check(self):
+        """ Stop the run if the memory monitor is over its limit, writing the report first """
+        if self._memory is None:
+            return
+        rss = self._memory.over_limit()
+        if rss is None:
+            return
+        name = self._current
+        memory = self._memory.measure()
+        error("Memory use of {:0.0f} MB is over the limit of {:0.0f} MB in phase {}".format(
+                rss / 1048576.0, self._memory.limit / 1048576.0, name))
+        error(memory_report(memory))
+        self.stop()
+        if name is not None:
+            self._phases[name]["memory"] = memory
+        self._aborted = name
+        error("Wrote report {}".format(self.write()))
+        sys.exit(1)
+
+    def stop(self):
+        """ End the current phase, if any """
+        if self._current is None:
+            return
+        seconds = time.time() - self._current_start
+        if self._current == self._profile_phase:
+            self._profiler.disable()
+        self._phases[self._current]["seconds"] += seconds
+        info("Phase {} took {:0.3f} seconds".format(self._current, seconds))
+        if self._memory is not None and self._memory.report:
+            self._phases[self._current]["memory"] = self._memory.measure()
+        self._current = None
+        return
+
+    def _profile_report(self, fname):
+        """ Save the raw profile to fname and return its top functions """
+        self._profiler.dump_stats(fname)
+        stats = pstats.Stats(fname)
+        top = []
+        for func in sorted(stats.stats, key=lambda f: -stats.stats[f][3])[:PROFILE_TOP]:
+            cc, nc, tt, ct, callers = stats.stats[func]
+            top.append(OrderedDict([("function", "{}:{}({})".format(*func)), ("calls", nc),
+                                    ("tottime", round(tt, 6)), ("cumtime", round(ct, 6))]))
+        return OrderedDict([("phase", self._profile_phase), ("file", fname), ("top", top)])
+
+    def report(self, profile_fname=None):
+        """ Return the report as a dict, saving the profile (if any) to profile_fname """
+        self.stop()
+        ret = OrderedDict()
+        ret["version"] = REPORT_VERSION
+        ret["command"] = sys.argv
+        ret["started"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._start))
+        ret["total_seconds"] = round(time.time() - self._start, 6)
+        ret["peak_rss"] = peak_rss()
+        if self._memory is not None and self._memory.limit is not None:
+            ret["memory_limit"] = self._memory.limit
+            ret["aborted_in"] = self._aborted
+        ret["phases"] = []
+        for name, p in self._phases.items():
+            phase = OrderedDict([("name", name), ("seconds", round(p["seconds"], 6)), ("counts", p["counts"])])
+            if "memory" in p:
+                phase["memory"] = p["memory"]
+            ret["phases"].append(phase)
+        if self._profiler is not None and profile_fname:
+            ret["profile"] = self._profile_report(profile_fname)
+        return ret
+
+    def write(self):
+        """
+            Write the report next to the output file, as <name>.timing.json (and
+            the profile as <name>.<phase>.prof). Returns the report file name
+        """
+        base = os.path.splitext(self._output_file)[0]
+        fname = base + ".timing.json"
+        report = self.report("{}.{}.prof".format(base, self._profile_phase))
+        with open(fname, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        return fname
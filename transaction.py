@@ -1,4 +1,10 @@
 from __init__ import *
+from context import current_context
+from scheduler import Wave_Scheduler
+from sorting import sort_transactions
+
+# Enum.__str__ is slow, output_row looks the staffing model strings up instead
+_STAFFING_STR = dict((s, str(s)) for s in Staffing_Models)
 
 log_emp_ids = ["xx27059"]
 
@@ -14,31 +20,53 @@ class Transaction(object):
 
     """
 
-    _max_seq = -1
-    _max_seq_t = None
+    # Slots rather than a per instance __dict__, we create one of these for
+    # every row in the input files
+    __slots__ = ("_date", "_ttype", "_emp_id", "_position_id", "_lineno",
+                 "_rec_number", "_to_position", "_worker", "_from_position",
+                 "_valid", "_invalid_msg", "_worker_edge", "_pos_edge",
+                 "_pre_reqs_calcd", "__seq_calcd", "_seq", "_top_of_stack",
+                 "_sort_key")
+
+    # The max seq and the invalid list are kept per run, see context.py
+
     # Class method to track the longest sequence
     @classmethod
     def max_seq(cls, seq, t):
-        if seq > cls._max_seq:
-            cls._max_seq = seq
-            cls._max_seq_t = t
-        elif seq == cls._max_seq and cls._max_seq_t < t:
-            cls._max_seq_t = t
+        context = current_context()
+        if seq > context.max_seq:
+            context.max_seq = seq
+            context.max_seq_t = t
+        elif seq == context.max_seq and context.max_seq_t < t:
+            context.max_seq_t = t
         return
 
-    _invalid_list = {}
+    @classmethod
+    def get_max_seq(cls):
+        return current_context().max_seq
+
+    @classmethod
+    def get_max_seq_t(cls):
+        """ Return the transaction with the max seq """
+        return current_context().max_seq_t
+
     @classmethod
     def add_to_invalid_list(cls, t, msg):
-        cls._invalid_list[t] = msg
+        current_context().invalid_list[t] = msg
         return
 
     @classmethod
     def get_invalid_list_msg(cls):
-        return cls._invalid_list.items()
+        return current_context().invalid_list.items()
 
     @classmethod
     def get_invalid_transactions(cls):
-        return cls._invalid_list
+        return current_context().invalid_list
+
+    @classmethod
+    def clear_invalid_list(cls):
+        current_context().invalid_list = {}
+        return
 
     @classmethod
     def header(cls):
@@ -57,13 +85,16 @@ class Transaction(object):
         self._from_position = None
         self._valid = True
         self._invalid_msg = "Valid Transaction"
-        self._pre_reqs = []
-        self.__pos_pre_reqs = []
-        self.__worker_pre_reqs = []
+        self._worker_edge = None
+        self._pos_edge = None
         self._pre_reqs_calcd = False
         self.__seq_calcd = False
         self._seq = 0
         self._top_of_stack = False
+        # Sorts only need the date and type, the position handoff tie break
+        # is left to the comparison operators (see sorting.py). One int (type
+        # seqs are under 256) bisects faster than a (date, type) tuple
+        self._sort_key = date.toordinal() << 8 | ttype.seq
         if ttype == HIRE:
             self._from_position = PRE_HIRE
         if ttype == TERM:
@@ -83,7 +114,7 @@ class Transaction(object):
         ret_str += "\tTo Position:\n\t\t{}\n".format(self._to_position)
         ret_str += "\tFrom Position:\n\t\t{}\n".format(self._from_position)
         ret_str += "\tPre-reqs:\n"
-        for t in self._pre_reqs:
+        for t in self.return_pre_reqs():
             ret_str += "\t\t{}\n".format(t)
         ret_str += "\n"
         return ret_str
@@ -109,70 +140,79 @@ class Transaction(object):
             raise e
         return output
 
-    @staticmethod
-    def _uniquify(my_list):
-        """ 
-            Given a list, return a copy that has only unique values 
-            Keep order intact
+    def output_row(self):
+        """ The fields of output() as a tuple, for csv.writer (see output.py) """
+        try:
+            row = (self._rec_number, self._worker.emp_id, self._seq, self._date,
+                   self._ttype.ttype, self._to_position.pos_id, _STAFFING_STR[self._to_position.staffing_model],
+                   self._from_position.pos_id, _STAFFING_STR[self._from_position.staffing_model], self._lineno,
+                   self._valid)
+        except Exception as e:
+            print("Error outputting transaction")
+            print(self)
+            raise e
+        return row
+
+    def calc_edges(self):
+        """
+            Find the transactions that must be completed immediately before this one.
+            If you think of the dependencies as a graph, with a transaction as a node,
+            each node can only have two edges to the next transaction. One is the worker edge,
+            the other is the position edge. We only store those two edges, the full
+            list of pre-reqs is built from them when asked for (see return_pre_reqs)
         """
-        keys = {}
-        for i in my_list:
-            keys[i] = 1
-        return keys.keys()
+        if self._valid and not self._pre_reqs_calcd:
+            # Get the position based pre-req
+            if self._to_position.staffing_model != JOB_MGMT:
+                self._pos_edge = self._to_position.get_prior_transaction(self)
+            # Get the worker based pre-req
+            self._worker_edge = self._worker.get_prior_transaction(self)
+            self._pre_reqs_calcd = True
+        return
 
     def return_pre_reqs(self):
         """
             Build list of transactions that must be completed before this one.
-            Go through each transaction for to_position
-            And then for worker
-            If you think of the dependencies as a graph, with a transaction as a node,
-            each node can only have two edges to the next transaction. One is the worker edge,
-            the other is the position edge
+            Walks the worker and position edges back from this transaction. The
+            list is not kept, so memory stays proportional to the number of
+            transactions rather than the size of every transitive closure
         """
         if not self._valid:
             return []
 
-        if not self._pre_reqs_calcd:
-            # Get the position based pre-reqs (pt)
-            if self._to_position.staffing_model != JOB_MGMT:
-                pt = self._to_position.get_prior_transaction(self)
-                if pt:
-                    self.__pos_pre_reqs += pt.return_pre_reqs() + [pt, ]
-            # Get the worker based pre-reqs (wt)
-            wt = self._worker.get_prior_transaction(self)
-            if wt:
-                self.__worker_pre_reqs += wt.return_pre_reqs() + [wt, ]
-            self._pre_reqs = self.__pos_pre_reqs + self.__worker_pre_reqs
-            self._pre_reqs = Transaction._uniquify(self._pre_reqs)
-            self._pre_reqs.sort()
-        self._pre_reqs_calcd = True
-        return self._pre_reqs
+        pre_reqs = []
+        seen = set()
+        stack = [self]
+        while stack:
+            t = stack.pop()
+            t.calc_edges()
+            for e in (t._pos_edge, t._worker_edge):
+                if e is not None and e not in seen:
+                    seen.add(e)
+                    pre_reqs.append(e)
+                    stack.append(e)
+        return sort_transactions(pre_reqs)
 
     def set_final_term_seq(self):
         """ Used to set the sequence when we want final terms in a final file """
         # Made this less generic so it would not be used incorrectly as the
         # sequence logic is very complicated
         if self._ttype is TERM:
-            self._seq = Transaction._max_seq
+            self._seq = current_context().max_seq
         return
 
 
     def get_seq(self):
-        """ Return seq, perform needed functions """
-        if not self._pre_reqs_calcd:
-            error("Called get_seq with no pre-reqs calcd")
-            self.return_pre_reqs()
-        if self.__seq_calcd:
-            ret = self._seq
-        else:
-            ret = self._calc_seq()
-        return ret
+        """ Return seq, sequencing this transaction (and its pre-reqs) if needed """
+        if not self.__seq_calcd:
+            Wave_Scheduler().schedule([self])
+        return self._seq
 
     def __derive_seq(self, t):
         """ Given a transaction, return the next seq value which will always 
             be equal or +1
         """
-        t_seq = t.get_seq()
+        t_seq = t.seq
         if t.ttype > self.ttype:
             # LOA start and stop are a special case
             if t.ttype not in [LOA_START, LOA_STOP] or self.ttype not in [LOA_START, LOA_STOP]:
@@ -185,31 +225,75 @@ class Transaction(object):
                 t_seq += 1
         return t_seq
 
-    def _calc_seq(self):
+    def calc_seq(self):
         """
-            For each transaction in _pre_reqs list, assign a sequence
-            For each edge, look at the last seq and calc accordingly
+            Assign a sequence based on the transactions on the other end
+            of our worker and position edges. Both of those must already
+            be sequenced, Wave_Scheduler takes care of the ordering
         """
         if not self._pre_reqs_calcd:
-            self.return_pre_reqs()
-        if not self.__worker_pre_reqs:
+            self.calc_edges()
+        if self._worker_edge is None:
             w_seq = 0
         else:
             # get the seq of the previous trans on the worker edge
-            # get_seq causes seq to be calculated (vs. just property seq)
-            w_t =  self.__worker_pre_reqs[-1]
-            w_seq = self.__derive_seq(w_t)
-        if not self.__pos_pre_reqs:
+            w_seq = self.__derive_seq(self._worker_edge)
+        if self._pos_edge is None:
             p_seq = 0
         else:
             # get seq of previous trans on position edge
-            p_t = self.__pos_pre_reqs[-1]
-            p_seq = self.__derive_seq(p_t)
+            p_seq = self.__derive_seq(self._pos_edge)
         self._seq = max(w_seq, p_seq)
         Transaction.max_seq(self._seq, self)
         self.__seq_calcd = True
         return self._seq
 
+    def critical_edge(self):
+        """
+            Return the transaction on the edge that set our seq (the worker edge
+            if both did), None if neither did: seq 0, or a final term moved to
+            the last wave
+        """
+        ret = None
+        if self._valid and self._seq > 0:
+            for e in (self._worker_edge, self._pos_edge):
+                if e is not None and self.__derive_seq(e) == self._seq:
+                    ret = e
+                    break
+        return ret
+
+    def set_seq(self, seq):
+        """ Record a seq calculated in another process (see partition.py) """
+        self._seq = seq
+        self.__seq_calcd = True
+        Transaction.max_seq(seq, self)
+        return
+
+    def get_state(self, pos_code):
+        """
+            Return what validation and sequencing worked out for this transaction
+            as plain values (see snapshot.py). pos_code maps a Position to a code,
+            edges are saved as the lineno of the transaction on the other end
+        """
+        return (self._position_id, pos_code(self._to_position), pos_code(self._from_position), self._valid,
+                self._invalid_msg,
+                self._worker_edge.lineno if self._worker_edge is not None else None,
+                self._pos_edge.lineno if self._pos_edge is not None else None,
+                self._pre_reqs_calcd, self.__seq_calcd, self._seq, self._top_of_stack)
+
+    def set_state(self, state, position, transaction):
+        """
+            Restore a state from get_state. position maps a code back to a Position
+            and transaction maps a lineno back to a Transaction
+        """
+        (self._position_id, to_code, from_code, self._valid, self._invalid_msg, worker_edge, pos_edge,
+                self._pre_reqs_calcd, self.__seq_calcd, self._seq, self._top_of_stack) = state
+        self._to_position = position(to_code)
+        self._from_position = position(from_code)
+        self._worker_edge = transaction(worker_edge) if worker_edge is not None else None
+        self._pos_edge = transaction(pos_edge) if pos_edge is not None else None
+        return
+
     def invalidate(self, msg):
         """ 
             This transaction somehow is not valid 
@@ -233,6 +317,9 @@ class Transaction(object):
     @property
     def valid(self):
         return self._valid
+    @property
+    def invalid_msg(self):
+        return self._invalid_msg
 
     @property
     def from_position(self):
@@ -281,6 +368,13 @@ class Transaction(object):
     def seq(self):
         return self._seq
     @property
+    def seq_calcd(self):
+        return self.__seq_calcd
+    @property
+    def edges(self):
+        """ Return the transactions on the other end of our worker and position edges """
+        return [e for e in (self._worker_edge, self._pos_edge) if e is not None]
+    @property
     def rec_sort_id(self):
         """ Return record # if exists, otherwise lineno"""
         if self._rec_number:
@@ -298,6 +392,12 @@ class Transaction(object):
     @property
     def lineno(self):
         return self._lineno
+    @property
+    def rec_number(self):
+        return self._rec_number
+    @property
+    def sort_key(self):
+        return self._sort_key
 
     """ Allows us to compare transactions for > < """
     def __lt__(self, other):
@@ -1,3 +1,4 @@
+from context import current_context
 
 class Trans_Type(object):
     """
@@ -6,6 +7,7 @@ class Trans_Type(object):
     """
     _types_list = []
     _seq_list = []
+    _keyword_map = {}
 
     @classmethod
     def _add_type(cls, ttype):
@@ -15,6 +17,9 @@ class Trans_Type(object):
             raise
         else:
             cls._seq_list.append(ttype.seq)
+        # First type registered for a keyword wins, same as the old linear scan
+        for k in ttype._keywords:
+            cls._keyword_map.setdefault(k, ttype)
         return
 
     @classmethod
@@ -25,12 +30,12 @@ class Trans_Type(object):
     @classmethod
     def get_type(cls, type_str):
         """ Given a type string, return matching type. Return None if none found """
-        ret = None
-        for tt in cls._types_list:
-            if type_str in tt:
-                ret = tt
-                break
-        return ret
+        return cls._keyword_map.get(type_str)
+
+    @classmethod
+    def keyword_map(cls):
+        """ Returns a copy of the keyword -> type lookup table """
+        return dict(cls._keyword_map)
 
     def __init__(self, trans_type, seq, keywords):
         self._keywords = []
@@ -42,39 +47,50 @@ class Trans_Type(object):
         self._ttype = trans_type
         self._seq = seq
         Trans_Type._add_type(self)
-        self._transaction_list = []
-        self._invalid_list = []
-        self._record_sorted_list = []
         return
 
+    def _state(self):
+        """ The transactions of this type are kept per run, see context.py """
+        return current_context().type_state(self)
+
     def get_ordered_transactions(self, include_bad=True):
         """ Return a list of transactions sorted by record number """
-        if len(self._record_sorted_list) == 0:
-            self._record_sorted_list = sorted(self._transaction_list, key= lambda t: t.rec_sort_id)
-        return self._record_sorted_list
+        state = self._state()
+        if len(state.record_sorted) == 0:
+            state.record_sorted = sorted(state.transactions, key= lambda t: t.rec_sort_id)
+        return state.record_sorted
+
+    def reset(self):
+        """ Forget the transactions of this type """
+        state = self._state()
+        state.transactions = []
+        state.invalid = []
+        state.record_sorted = []
+        return
 
     def add_to_invalid_list(self, t):
         """ Add to a list of invalid transactions """
-        self._invalid_list.append(t)
+        self._state().invalid.append(t)
         return
 
     def add_transaction(self, t):
         """ keep a list of all transactions of this type """
-        self._transaction_list.append(t)
+        self._state().transactions.append(t)
         return
 
     @property
     def total_count(self):
         """ Return the number of transactions of this type """
-        return len(self._transaction_list)
+        return len(self._state().transactions)
 
     @property
     def good_count(self):
-        return len(self._transaction_list) - len(self._invalid_list)
+        state = self._state()
+        return len(state.transactions) - len(state.invalid)
 
     @property
     def bad_count(self):
-        return len(self._invalid_list)
+        return len(self._state().invalid)
 
     def __contains__(self, type_str):
         """ Return true if this type has key of type_str """
@@ -5,6 +5,8 @@
     Requires enum (either with 3.x or the backport for 2.7)
 
     Module level variables / constants are outlined in __init__.py
+    To sequence from another program, without a process per run, use a
+    Sequencer (see sequencer.py)
 
     This module takes a list of transactions as input files and generates
     the sequencing for loading those transactions into Workday.
@@ -12,7 +14,9 @@
     Overall flow:
     Process command line arguments
     Open the transaction file(s)
-    As it reads the file, it maps the transaction type using _get_type()
+    As it reads the file, it decodes the date and transaction type using
+    a Row_Decoder (see decoder.py). Parsed files are saved in the parse cache
+    (see cache.py) so a rerun on the same files skips the parsing
     Read the data, creating Transaction objects for each line
         ** we break out the creation of Transactions from Workers and
         Positions for clarity, accepting the performance hit
@@ -27,12 +31,21 @@
     that a worker is hired before they have a job change)
 
     Once we have all the required data, and we have removed invalid transactions,
-    for each worker, start at top of stack transaction for each worker (most recent one)
-    and derive the list of pre-requisites. This should get you pre-requisites
-    for every valid transaction
+    for each transaction find the transaction immediately before it for the
+    worker and for the position (the worker and position edges). The full list
+    of pre-requisites is only built from those edges when an output asks for it
+
+    With --incremental the input files are delta files for a run saved with
+    --save-snapshot, only the workers / positions they reach go through the
+    steps above again (see incremental.py)
 
     Finally, generate output as specified in the program invocation
 
+    Each of these phases is timed (see timing.py), --timing writes the times
+    and counts to <output file>.timing.json and --profile runs one phase
+    under cProfile. --memory-report adds the memory use of each phase (see
+    memory.py) and --memory-limit stops the run once it uses too much
+
     Files need to be in the following excel csv format:
     record id, employee id, event date, position id, <unused>, transaction type
     
@@ -55,19 +68,32 @@
 
     TODO: Add ability to include row headers in command line (which position)
     TODO: Add ability to take in staffing model (job mgmt)
-    TODO: Add errored-record-file option
     TODO: Clean up logging / messaging between debug and verbose
     TODO: Add guide to adding transaction types (what methods you need to look at
 """
 import csv
 import sys
 import time
-import datetime as dt
 import os.path
 import argparse
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 from worker import Worker
 from transaction import Transaction
+from decoder import Row_Decoder
+from scheduler import Wave_Scheduler
+from memory import footprint_report, Memory_Monitor
+from columnar import Columnar_Engine
+from ingest import Input_Reader
+from cache import Parse_Cache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+from partition import Component_Processor
+from build import build_structures
+from snapshot import save_snapshot
+from incremental import Incremental_Run
+from dumps import print_debug, print_dumps, print_sequence
+from errored import read_record_ids, errored_records
+from outofcore import Out_Of_Core_Run, DEFAULT_BATCH_ROWS
+from output import write_transactions, write_by_type, write_by_wave, write_sqlite
+from timing import Phase_Timer, PHASES
 from __init__ import *
 
 # Specify the indexed location for each field in input files:
@@ -78,6 +104,7 @@ EMP_ID_INDEX = 1
 EFFECTIVE_DATE_INDEX = 2
 POSITION_ID_INDEX = 3
 TRANS_TYPE_INDEX = 4
+INDEXES = (RECORD_ID, EMP_ID_INDEX, EFFECTIVE_DATE_INDEX, POSITION_ID_INDEX, TRANS_TYPE_INDEX)
 
 def pager(page_size, iterable):
     """ Helper function to easily page through iterables """
@@ -97,6 +124,24 @@ def _get_type(type_str):
         raise Exception
     return ret
 
+def input_reader(args, stream=False):
+    """
+        Return the Input_Reader for the input files, using the parse cache unless told
+        not to. See ingest.Input_Reader for stream
+    """
+    if args.no_cache:
+        cache = None
+    else:
+        cache = Parse_Cache(args.cache_dir, args.cache_size * 1024 * 1024, INDEXES, args.ignore_rows)
+    return Input_Reader(args.input_file, INDEXES, args.ignore_rows, args.jobs,
+                        args.chunk_size * 1024 * 1024, cache, stream)
+
+def write_timing(timer, args):
+    """ Write the timing report next to the output file if asked for """
+    if args.timing or args.profile or args.memory_report:
+        info("Wrote timing report {}".format(timer.write()))
+    return
+
 def parse_command_line():
     """ Process command line arguments """
     parser = argparse.ArgumentParser(
@@ -117,6 +162,13 @@ def parse_command_line():
                               "master file. Output is orded by record id if available, "
                               "otherwise order by load order. Output files are put in "
                               "current directory, and named <type>.<timestamp>.csv."))
+    parser.add_argument("--file-by-wave", action="store_true",
+                        help=("Generate one output file per wave and transaction type, the files that "
+                              "get loaded. Files are ordered by record id and named "
+                              "Wave_<wave>.<type>.<timestamp>.csv"))
+    parser.add_argument("--sqlite", metavar="FILE",
+                        help=("Also write the results to the SQLite database FILE, with indexes on emp id, "
+                              "position, wave / type and record number and a table of invalid transactions"))
     parser.add_argument("--errored-records-file", nargs=2, help=("Transaction type string and file name. File "
                                                                  "contains list of errored records. Generates "
                                                                  "output file containing on transactions related to "
@@ -134,6 +186,48 @@ def parse_command_line():
     parser.add_argument("--dump-worker", action="append", help="Dump transaction list for worker with worker id")
     parser.add_argument("--dump-position", action="append", help="Dump transaction list for position with worker id")
     parser.add_argument("--dump-transaction", action="append", help="Dump transaction list for transaction with lineno")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help=("Number of processes used to parse the input files, and to validate "
+                              "and sequence independent groups of workers / positions"))
+    parser.add_argument("--chunk-size", type=int, default=64,
+                        help="With --jobs, split input files into chunks of this many MB")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always parse the input files, don't read or write the parse cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory for the parse cache (default {})".format(DEFAULT_CACHE_DIR))
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help="Size limit of the parse cache in MB, least recently used files are evicted")
+    parser.add_argument("--save-snapshot", metavar="FILE",
+                        help=("Save the validated / sequenced data to FILE, query.py can then dump "
+                              "workers, positions and transactions from it without rerunning"))
+    parser.add_argument("--incremental", metavar="SNAPSHOT",
+                        help=("Input files are delta files added to the run saved in SNAPSHOT (see "
+                              "--save-snapshot). Only the workers / positions they touch are "
+                              "validated and sequenced again"))
+    parser.add_argument("--out-of-core", action="store_true",
+                        help=("Keep the transactions in a temporary database on disk and only build "
+                              "objects for a batch of independent workers / positions at a time, "
+                              "for inputs that don't fit in memory"))
+    parser.add_argument("--spill-dir", help="Directory for the --out-of-core database (default the temp dir)")
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS,
+                        help="Rows per --out-of-core batch, bigger batches use more memory")
+    parser.add_argument("--timing", action="store_true",
+                        help=("Write the time taken and object / row counts of each phase to "
+                              "<output file>.timing.json"))
+    parser.add_argument("--profile", choices=PHASES, metavar="PHASE",
+                        help=("Run PHASE under cProfile, saved to <output file>.PHASE.prof with the top "
+                              "functions in the timing report (implies --timing). Phases are "
+                              "{}".format(", ".join(PHASES))))
+    parser.add_argument("--memory-report", action="store_true",
+                        help=("Add the memory use at the end of each phase to the timing report: RSS, "
+                              "bytes held by transactions, workers, positions and pre-req edges and, "
+                              "under Python 3, the top tracemalloc allocation sites (implies --timing)"))
+    parser.add_argument("--memory-limit", type=int, metavar="MB",
+                        help=("Stop the run, writing the timing report and memory use, once its RSS "
+                              "goes over MB"))
+    parser.add_argument("--engine", choices=["object", "columnar"], default="object",
+                        help=("Sequencing engine. columnar stores transactions in numpy arrays, "
+                              "it is much faster on large files but only generates output files"))
     mgroup = parser.add_mutually_exclusive_group()
     mgroup.add_argument("-p", "--position", help="Output only transactions with specified position (position id)",
                         action="append", required=False)
@@ -187,114 +281,217 @@ if __name__ == "__main__":
             for t in Trans_Type.all_types():
                 print("\t{}".format(t))
             raise
-        file = args.errored_recoreds_file[1]
+        file = args.errored_records_file[1]
         if not os.path.isfile(file):
             error("File {} does not exist.".format(file))
             raise Exception
+        if args.worker or args.position or args.save_snapshot or args.incremental:
+            error("--errored-records-file can't be used with --worker, --position, --save-snapshot or --incremental")
+            sys.exit(1)
+
+    if args.save_snapshot and (args.worker or args.position):
+        error("--save-snapshot needs the whole data set, it can't be used with --worker or --position")
+        sys.exit(1)
+    if args.incremental and (args.worker or args.position):
+        error("--incremental can't be used with --worker or --position")
+        sys.exit(1)
 
     if args.anonymize:
         Worker.anonymize()
         Position.anonymize()
 
+    memory = None
+    if args.memory_report or args.memory_limit:
+        memory = Memory_Monitor(args.memory_limit * 1024 * 1024 if args.memory_limit else None,
+                                args.memory_report)
+    timer = Phase_Timer(args.output_file, args.profile, memory)
+
+    if args.engine == "columnar":
+        unsupported = [opt for opt, flag in [
+                ("--test", args.test), ("--stats", args.stats), ("--debug", args.debug),
+                ("--worker", args.worker), ("--position", args.position),
+                ("--sequence", args.sequence is not None), ("--dump-worker", args.dump_worker),
+                ("--dump-position", args.dump_position), ("--dump-transaction", args.dump_transaction),
+                ("--errored-records-file", args.errored_records_file),
+                ("--file-by-wave", args.file_by_wave), ("--sqlite", args.sqlite),
+                ("--save-snapshot", args.save_snapshot), ("--incremental", args.incremental),
+                ("--out-of-core", args.out_of_core)] if flag]
+        if unsupported:
+            error("Options not supported by the columnar engine: {}".format(", ".join(unsupported)))
+            sys.exit(1)
+        timer.phase("ingest", files=len(args.input_file))
+        engine = Columnar_Engine(*INDEXES, anonymize=args.anonymize)
+        for fname, rows in input_reader(args).batches():
+            engine.add_rows(rows)
+            timer.count(rows=len(rows))
+            info("Read {} lines from {}".format(len(rows), fname))
+        timer.phase("validate")
+        info("Validating worker data")
+        engine.validate()
+        timer.phase("edges")
+        info("Calculating dependencies")
+        engine.calc_edges()
+        timer.phase("sequence")
+        engine.schedule()
+        timer.count(waves=engine.max_seq + 1)
+        if args.final_term_file:
+            timer.phase("final_term")
+            engine.set_final_term_seq()
+        info("Max sequence is {}".format(engine.max_seq))
+        timer.phase("output")
+        info("Generating output")
+        if args.file_by_type:
+            engine.write_by_type(time.strftime("%Y-%m-%d_%H%M%S"), Transaction.header())
+        else:
+            info("Writing file {}".format(args.output_file))
+            engine.write(args.output_file, Transaction.header())
+            timer.count(files=1)
+        write_timing(timer, args)
+        stop = time.time()
+        info("Done. Running time was {:0.0f} seconds".format(stop - start))
+        sys.exit(0)
+
+    if args.out_of_core:
+        unsupported = [opt for opt, flag in [
+                ("--test", args.test), ("--stats", args.stats), ("--debug", args.debug),
+                ("--worker", args.worker), ("--position", args.position),
+                ("--sequence", args.sequence is not None), ("--dump-worker", args.dump_worker),
+                ("--dump-position", args.dump_position), ("--dump-transaction", args.dump_transaction),
+                ("--errored-records-file", args.errored_records_file), ("--anonymize", args.anonymize),
+                ("--save-snapshot", args.save_snapshot), ("--incremental", args.incremental)] if flag]
+        if unsupported:
+            error("Options not supported with --out-of-core: {}".format(", ".join(unsupported)))
+            sys.exit(1)
+        run = Out_Of_Core_Run(args.spill_dir, args.batch_rows)
+        try:
+            timer.phase("ingest", files=len(args.input_file))
+            timer.count(rows=run.read(input_reader(args, stream=True).batches()))
+            # Batches are validated and sequenced in one go
+            timer.phase("sequence")
+            info("Validating and sequencing")
+            run.run()
+            timer.count(waves=run.max_seq + 1)
+            info("Max sequence is {}".format(run.max_seq))
+            timer.phase("output")
+            info("Generating output")
+            header = Transaction.header()
+            if args.file_by_type:
+                run.write_by_type(time.strftime("%Y-%m-%d_%H%M%S"), header, args.final_term_file)
+            elif args.file_by_wave:
+                run.write_by_wave(time.strftime("%Y-%m-%d_%H%M%S"), header, args.final_term_file)
+            else:
+                info("Writing file {}".format(args.output_file))
+                run.write(args.output_file, header, args.final_term_file)
+                timer.count(files=1)
+            if args.sqlite:
+                info("Writing database {}".format(args.sqlite))
+                run.write_sqlite(args.sqlite, args.final_term_file)
+        finally:
+            run.close()
+        write_timing(timer, args)
+        stop = time.time()
+        info("Done. Running time was {:0.0f} seconds".format(stop - start))
+        sys.exit(0)
+
     """ Start processing files """
     trans_list = []
     ctr = 0
-    transaction_dict = {}
-    file_row_cnt = 0
-    for fname in args.input_file:
-        info("Opening {}".format(fname))
-        with open(fname,"rU") as csvfile:
+    # Transactions by lineno, nothing at 0
+    transaction_index = [None]
+    if args.test:
+        # Print the first row of the first file with the field mapping
+        decoder = Row_Decoder()
+        with open(args.input_file[0], "rU") as csvfile:
             reader = csv.reader(csvfile)
-
-            # Skip first n rows
             if args.ignore_rows is not None:
                 for i in range(args.ignore_rows):
                     reader.next()
-
-            for row in reader:
-                try:
-                    ctr += 1
-
-                    d = dt.datetime.strptime(row[EFFECTIVE_DATE_INDEX], "%m/%d/%Y").date()
-                    ttype = _get_type(row[TRANS_TYPE_INDEX])
-
-                    t = Transaction(d, ttype, row[EMP_ID_INDEX], row[POSITION_ID_INDEX], ctr, row[RECORD_ID])
-                    trans_list.append(t)
-                    ttype.add_transaction(t)
-                    transaction_dict[str(ctr)] = t
-
-                    if args.test:
-                        print(row)
-                        print(t.test_str())
-                        sys.exit(0)
-                except:
-                    error("Exception reading row")
-                    error(row)
-                    error("From file {}".format(fname))
-                    raise
-            file_row_cnt = ctr - file_row_cnt
-        info("Finished reading {} lines from {}".format(file_row_cnt, fname))
-
-    # Create my various lists / dicts
-    worker_dict = {}
-    position_dict = {}
-
-    """
-        Now that we have a list of transactions sorted by date / type
-        we can go out and build out the extra data needed including:
-            Worker objects
-            Position objects
-            from_position
-    """
-    info("Building data structures")
-    for row in trans_list:
-        # Employee should always exist, check
-        if row.emp_id == "":
-            print("Missing employee id")
+            row = reader.next()
+            t = Transaction(decoder.date(row[EFFECTIVE_DATE_INDEX]), decoder.ttype(row[TRANS_TYPE_INDEX]),
+                            row[EMP_ID_INDEX], row[POSITION_ID_INDEX], 1, row[RECORD_ID])
             print(row)
-            raise Exception
-        elif row.emp_id not in worker_dict:
-            worker_dict[row.emp_id] = Worker(row.emp_id)
-
-        # Add the transaction to the worker, and the worker to the trans
-        worker = worker_dict[row.emp_id]
-        row.worker = worker
-        worker.add_transaction(row)
-
-        # Now check position
-        if row.position_id == "" and row.ttype in [
-                    HIRE, CHANGE_JOB, ORG_ASSN]:
-                print("Missing position ID where required")
-                print(row)
-                raise Exception
-        # LOAs, TERMS don't have positions, we'll fix later
-        elif row.position_id != "":
-            if row.position_id not in position_dict:
-                if row.position_id == "Pre_Conversion":
-                    position_dict[row.position_id] = Position(row.position_id, JOB_MGMT)
-                else:
-                    position_dict[row.position_id] = Position(row.position_id)
-
-            # Add the position to the transaction and the transaction to the
-            # position
-            position = position_dict[row.position_id]
-            row.to_position = position
-            position.add_transaction(row)
-
-    """
-        Now we have a full list of positions, workers and transactions.
-        Go through each worker and fill in missing data:
-            from_position for transactions
-            to_position/from for LOA and TERM transactions
-            Also, perform basic validations on both positions and workers
-    """
-    info("Validating worker data")
-    for w in worker_dict.values():
-        w.validate()
+            print(t.test_str())
+            sys.exit(0)
+
+    incremental = None
+    timer.phase("ingest", files=len(args.input_file))
+    if args.incremental:
+        # Only the components the delta files reach are validated and sequenced,
+        # all of it is timed as ingest
+        info("Applying delta files to snapshot {}".format(args.incremental))
+        incremental = Incremental_Run(args.incremental)
+        incremental.run(input_reader(args).batches(), args.jobs)
+        trans_list = incremental.trans_list
+        worker_dict = incremental.worker_dict
+        position_dict = incremental.position_dict
+        input_positions = incremental.input_positions
+        transaction_index = [None] * (trans_list[-1].lineno + 1 if trans_list else 1)
+        for t in trans_list:
+            transaction_index[t.lineno] = t
+        if memory:
+            memory.track(trans_list, worker_dict, position_dict, transaction_index)
+        timer.count(rows=len(trans_list), workers=len(worker_dict), positions=len(position_dict),
+                    waves=Transaction.get_max_seq() + 1)
+        parallel = True
+    else:
+        # Create my various lists / dicts
+        worker_dict = {}
+        position_dict = {}
+        if memory:
+            memory.track(trans_list, worker_dict, position_dict, transaction_index)
+
+        # The position ids as read, validation fills in the missing ones
+        input_positions = [] if args.save_snapshot else None
+        for fname, rows in input_reader(args).batches():
+            for rec, emp, d, ttype, pos in rows:
+                if input_positions is not None:
+                    input_positions.append(pos)
+                ctr += 1
+                t = Transaction(d, ttype, emp, pos, ctr, rec)
+                trans_list.append(t)
+                ttype.add_transaction(t)
+                transaction_index.append(t)
+            timer.count(rows=len(rows))
+            info("Finished reading {} lines from {}".format(len(rows), fname))
+
+        """
+            Now that we have a list of transactions sorted by date / type
+            we can go out and build out the extra data needed including:
+                Worker objects
+                Position objects
+                from_position
+        """
+        timer.phase("build")
+        info("Building data structures")
+        build_structures(trans_list, worker_dict, position_dict)
+        timer.count(workers=len(worker_dict), positions=len(position_dict))
+
+        """
+            Now we have a full list of positions, workers and transactions.
+            Go through each worker and fill in missing data:
+                from_position for transactions
+                to_position/from for LOA and TERM transactions
+                Also, perform basic validations on both positions and workers
+        """
+        # Workers / positions that share nothing can be validated and sequenced
+        # independently, do that in parallel if asked to
+        parallel = args.jobs > 1 and not args.worker and not args.position and not args.errored_records_file
+        timer.phase("validate")
+        if parallel:
+            # Sequencing is timed with validation here
+            info("Validating and sequencing components")
+            Component_Processor(worker_dict, position_dict).run(args.jobs)
+            timer.count(waves=Transaction.get_max_seq() + 1)
+        elif not args.errored_records_file:
+            # --errored-records-file only validates what the records need, see errored.py
+            info("Validating worker data")
+            for w in worker_dict.values():
+                w.validate()
 
-    info("Validating position data")
-    for p in position_dict.values():
-        p.validate()
+            info("Validating position data")
+            for p in position_dict.values():
+                p.validate()
+        timer.count(invalid=len(Transaction.get_invalid_transactions()))
 
 
     """
@@ -304,34 +501,41 @@ if __name__ == "__main__":
     """
 
     # Go through each transaction and get pre-reqs
+    timer.phase("edges")
     info("Calculating dependencies")
-    if not args.worker and not args.position:
-        for p in pager(args.page_size, worker_dict.values()):
-            for w in p:
-                    if not w.valid:
-                        continue
-                    t = w.top_of_stack()
-                    if not t:
-                        continue
-                    t.return_pre_reqs()
-            info("Processed pre-reqs for {} workers.".format(len(p)))
-        for p in pager(args.page_size, worker_dict.values()):
+    if not args.worker and not args.position and not args.errored_records_file:
+        # An incremental run has the edges of the restored and rebuilt transactions
+        for p in pager(args.page_size, [] if incremental else worker_dict.values()):
             for w in p:
                 if not w.valid:
                     continue
-                t = w.top_of_stack()
-                if not t:
-                    continue
-                t.get_seq()
-            info("Processed sequences for {} workers".format(len(p)))
+                for t in w.get_transactions():
+                    t.calc_edges()
+            timer.check()
+            info("Processed pre-reqs for {} workers.".format(len(p)))
+        # Components processed in parallel already have their seq
+        if not parallel:
+            timer.phase("sequence")
+            scheduler = Wave_Scheduler()
+            for p in pager(args.page_size, worker_dict.values()):
+                scheduler.schedule(t for w in p if w.valid for t in w.get_transactions())
+                timer.check()
+                info("Processed sequences for {} workers".format(len(p)))
+            timer.count(waves=Transaction.get_max_seq() + 1)
         if args.final_term_file:
+            timer.phase("final_term")
             # Push all top of stack terms to final wave
-            seq = Transaction._max_seq
+            seq = Transaction.get_max_seq()
             for w in worker_dict.values():
                 if not w.valid:
                     continue
                 if w.top_of_stack().ttype is TERM:
                     w.top_of_stack().set_final_term_seq()
+        if incremental:
+            waves, files = incremental.changes()
+            print("Changed waves: {}".format(" ".join(str(i) for i in waves) or "none"))
+            for i, tt in files:
+                print("\tWave {} {}".format(i, tt))
     elif args.worker: # Only calc for worker(s) (and related workers as needed)
         for emp_id in args.worker:
             if emp_id not in worker_dict:
@@ -359,58 +563,35 @@ if __name__ == "__main__":
             trans_list = []
             for p in position_set:
                 trans_list += p.get_transactions()
+    elif args.errored_records_file:  # Only calc for the errored records
+        ttype = _get_type(args.errored_records_file[0])
+        rec_ids = read_record_ids(args.errored_records_file[1])
+        trans_list = errored_records(ttype, rec_ids, worker_dict, position_dict, trans_list)
+        info("{} transactions needed for {} errored records".format(len(trans_list), len(rec_ids)))
 
-    info("Max sequence is {}".format(Transaction._max_seq))
+    info("Max sequence is {}".format(Transaction.get_max_seq()))
+
+    if args.save_snapshot:
+        timer.phase("snapshot")
+        info("Saving snapshot {}".format(args.save_snapshot))
+        save_snapshot(args.save_snapshot, trans_list, worker_dict, position_dict, input_positions)
 
     """ 
         Dump specific workers or positions for use in debugging
         if specified on command line
     """
+    if args.debug or args.dump_worker or args.dump_position or args.dump_transaction:
+        timer.phase("dumps")
     if args.debug:
-        print("Dumping max sequence transaction\n{}".format(Transaction._max_seq_t))
-        print(Transaction._max_seq_t.dump())
-        print("Dumping bad workers")
-        for w in worker_dict.values():
-            if w.invalid:
-                print(w.dump())
-        print("Done printing invalid workers")
-        print("Dumping bad transactions")
-        for t, m in Transaction.get_invalid_list_msg():
-            print("Reason: {}".format(m))
-            print("\t{}".format(t.dump()))
-        print("Done printing invalid transactions")
-    if args.dump_worker:
-        print("Dumping worker(s)")
-        for w in args.dump_worker:
-            if w not in worker_dict:
-                print("Employee id {} not found in data file".format(w))
-            else:
-                print(worker_dict[w].dump())
-    if args.dump_position:
-        print("Dumping position(s)")
-        for p in args.dump_position:
-            if p not in position_dict:
-                print("Position id {} not found in data file".format(p))
-            else:
-                print(position_dict[p].dump())
-    if args.dump_transaction:
-        for t in args.dump_transaction:
-            if t not in transaction_dict:
-                print("Transaction lineno {} not found in data file".format(t))
-            else:
-                print(transaction_dict[t].dump())
-
-    info("Calculating statistics")
-    master_list = []
-    for i in range(Transaction._max_seq + 1):
-        master_list.append(OrderedDict([(key, []) for key in Trans_Type.all_types()]))
-    for t in trans_list:
-        if not t.valid:
-            continue
-        i = t.seq
-        tt = t.ttype
-        master_list[i][tt].append(t)
+        print_debug(worker_dict, Transaction.get_invalid_list_msg(), Transaction.get_max_seq_t())
+    print_dumps(worker_dict, position_dict, transaction_index,
+                args.dump_worker, args.dump_position, args.dump_transaction)
+
     if args.stats:
+        timer.phase("stats")
+        info("Calculating statistics")
+        # Number of transactions going into each (wave, type) file
+        file_counts = Counter((t.seq, t.ttype) for t in trans_list if t.valid)
         print("Total transaction count: {}".format(len(trans_list)))
         print("Transaction type summary:")
         for tt in Trans_Type.all_types():
@@ -422,44 +603,38 @@ if __name__ == "__main__":
         print("Wave summary:")
         file_ctr = 0
         file_stats = OrderedDict.fromkeys(Trans_Type.all_types(), 0)
-        for i in range(Transaction._max_seq + 1):
+        for i in range(Transaction.get_max_seq() + 1):
             print("Wave {}".format(i))
-            for k, v in master_list[i].iteritems():
-                if v:
+            for k in Trans_Type.all_types():
+                if file_counts[(i, k)]:
                     file_ctr += 1
                     file_stats[k] += 1
-                    print("\t{} has {} transactions.".format(k, len(v)))
+                    print("\t{} has {} transactions.".format(k, file_counts[(i, k)]))
         print("A total of {} files will have to be loaded".format(file_ctr))
         for tt, ct in file_stats.iteritems():
             print("\t{:3} file(s) of type {}".format(ct, tt))
+        print(footprint_report(trans_list, worker_dict.values(), position_dict.values()))
 
+    timer.phase("output")
     info("Generating output")
     # Let's find some complicated worker transactions if requested
     if args.sequence is not None:
-        for w in worker_dict.values():
-            if w.max_seq >= args.sequence:
-                t = w.top_of_stack()
-                print("Found top-level worker transaction w seq > {}".format(args.sequence))
-                print("Pre-reqs for {}".format(t))
-                for ts in t.return_pre_reqs():
-                    print("\t{}".format(ts))
+        print_sequence(worker_dict, args.sequence)
 
     # Generate output files
+    needed = set(trans_list) if args.errored_records_file else None
     if args.file_by_type:
-        timestamp = time.strftime("%Y-%m-%d_%H%M%S")
-        for tt in Trans_Type.all_types():
-            fname = "{}.{}.csv".format(str(tt.ttype).replace(" ", "_"), timestamp)
-            info("Writing file {}".format(fname))
-            with open(fname, "w") as f:
-                f.write(Transaction.header() + "\n")
-                for t in tt.get_ordered_transactions():
-                    f.write(t.output() + "\n")
+        timer.count(files=len(write_by_type(time.strftime("%Y-%m-%d_%H%M%S"), Transaction.header(), needed)))
+    elif args.file_by_wave:
+        timer.count(files=len(write_by_wave(time.strftime("%Y-%m-%d_%H%M%S"), Transaction.header(), needed)))
     else:
         info("Writing file {}".format(args.output_file))
-        with open(args.output_file, "w") as f:
-            f.write(Transaction.header() + "\n")
-            for t in trans_list:
-                f.write(t.output() + "\n")
+        write_transactions(args.output_file, Transaction.header(), trans_list)
+        timer.count(files=1, rows=len(trans_list))
+    if args.sqlite:
+        info("Writing database {}".format(args.sqlite))
+        write_sqlite(args.sqlite, trans_list, Transaction.get_invalid_list_msg())
+    write_timing(timer, args)
     stop = time.time()
     info("Done. Running time was {:0.0f} seconds".format(stop - start))
 
@@ -0,0 +1,120 @@
+#!/usr/bin/env python -B
+"""
+    What-if runs: how much of the wave plan moves if some transactions are
+    dropped, given another date, or new ones are added, without editing the
+    input files and running everything again.
+
+    A what-if starts from a run saved with wave.py --save-snapshot and only
+    validates and sequences again the components (see partition.py) the
+    changes reach, the same way --incremental does (see incremental.py).
+    It runs in its own Run_Context and only reads the snapshot, so the saved
+    run, and any other run in the same process, is left as it was.
+
+    Ex:
+        wave.py data/*.csv --save-snapshot run.snap
+        whatif.py run.snap --remove 1500 --date 1733=4/1/2010 --add fixes.csv
+"""
+import sys
+import time
+import json
+import argparse
+from transaction import Transaction
+from incremental import Incremental_Run
+from ingest import Input_Reader
+from decoder import Row_Decoder
+from context import Run_Context
+from sequencer import DEFAULT_INDEXES
+from __init__ import *
+
+def what_if(snapshot_fname, remove=(), dates=None, add=(), final_term=False, jobs=1):
+    """
+        Apply the changes to the run saved in snapshot_fname:
+            remove      linenos of the transactions to drop
+            dates       {lineno: date} for the transactions to move
+            add         rows to add, (record id, emp id, date, Trans_Type, position id)
+                        like ingest.Input_Reader, numbered after the saved transactions
+        final_term must match the --final-term-file of the saved run. Returns a dict of
+            max_seq, baseline_max_seq
+            waves       the waves whose contents change
+            moved       (lineno, saved wave, wave) for the transactions whose wave
+                        changed, the wave is None if invalid, removed or added
+    """
+    with Run_Context():
+        run = Incremental_Run(snapshot_fname)
+        run.run([("added rows", list(add))] if add else [], jobs, remove, dates)
+        if final_term:
+            for w in run.worker_dict.values():
+                if w.valid and w.top_of_stack().ttype is TERM:
+                    w.top_of_stack().set_final_term_seq()
+        waves, files = run.changes()
+        run.close()
+        ret = {
+            "max_seq": Transaction.get_max_seq(),
+            "baseline_max_seq": run.baseline_max_seq,
+            "waves": waves,
+            "moved": [(t.lineno, before, after) for t, before, after in run.moved()],
+        }
+    return ret
+
+def parse_dates(values):
+    """ Parse LINENO=M/D/Y values into {lineno: date} """
+    decoder = Row_Decoder()
+    ret = {}
+    for value in values or []:
+        try:
+            lineno, date_str = value.split("=", 1)
+            ret[int(lineno)] = decoder.date(date_str.strip())
+        except ValueError:
+            error("Bad --date {}, expected LINENO=M/D/Y".format(value))
+            sys.exit(1)
+    return ret
+
+def parse_command_line():
+    """ Process command line arguments """
+    parser = argparse.ArgumentParser(
+        description="Show the waves that move if transactions of a saved run are removed, re-dated or added")
+    parser.add_argument("snapshot", metavar="Snapshot File", help="Snapshot saved by wave.py")
+    parser.add_argument("--remove", type=int, action="append", metavar="LINENO",
+                        help="Drop the transaction with this lineno")
+    parser.add_argument("--date", action="append", metavar="LINENO=M/D/Y",
+                        help="Give the transaction with this lineno another effective date")
+    parser.add_argument("--add", action="append", metavar="FILE",
+                        help="Add the rows of this file, same layout as the input files")
+    parser.add_argument("-i", "--ignore-rows", type=int, help="Ignore first n rows of the --add files")
+    parser.add_argument("--final-term-file", action="store_true",
+                        help="The snapshot was saved with --final-term-file")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Processes used to validate and sequence the changed components")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    start = time.time()
+
+    args = parse_command_line()
+
+    if args.verbose:
+        l.setLevel(logging.INFO)
+    else:
+        l.setLevel(logging.WARNING)
+
+    dates = parse_dates(args.date)
+    add = []
+    if args.add:
+        for fname, rows in Input_Reader(args.add, DEFAULT_INDEXES, args.ignore_rows).batches():
+            add += rows
+    result = what_if(args.snapshot, args.remove or (), dates, add, args.final_term_file, args.jobs)
+    info("What-if took {:0.3f} seconds".format(time.time() - start))
+
+    if args.json:
+        print(json.dumps(result, indent=1))
+    else:
+        print("Max sequence: {} -> {}".format(result["baseline_max_seq"], result["max_seq"]))
+        print("Changed waves: {}".format(" ".join(str(i) for i in result["waves"]) or "none"))
+        for lineno, before, after in result["moved"]:
+            print("\tLine {}: {} -> {}".format(lineno, "-" if before is None else before,
+                                              "-" if after is None else after))
+    sys.exit(0)
@@ -5,6 +5,9 @@
 """
 from __init__ import *
 from enum import Enum
+from bisect import bisect_right
+from sorting import insert_transaction, find_transaction, sort_ties, key_order
+from context import current_context
 
 # Log employees allows you to log information about a list of emp ids for debugging
 log_employees = ["x62883"]
@@ -19,24 +22,35 @@ INACTIVE = Status.INACTIVE
 ON_LEAVE = Status.ON_LEAVE
 
 class Worker(object):
+    __slots__ = ("_emp_id", "_tlist", "_keys", "_ties", "_timeline_dates", "_timeline_pos",
+                 "_invalid_list", "_sorted", "_validated", "_valid", "flag", "_key")
+
     # Set to true if you want the worker to log all it's transactions
     _log_trans = False
-    _anonymize = False
 
     @classmethod
     def anonymize(cls):
-        cls._anonymize = True
+        """ Output keys rather than employee ids for the rest of this run """
+        current_context().anonymize = True
         return
 
     def __init__(self, emp_id):
         self._emp_id = emp_id
+        # In sort key order, with the keys alongside (see sorting.py)
         self._tlist = []
-        self._invalid_list = []
+        self._keys = []
+        # Keys shared by more than one transaction, allocated on first use
+        self._ties = None
+        self._timeline_dates = None
+        self._timeline_pos = None
+        # Most workers never have an invalid transaction, allocated on first use
+        self._invalid_list = None
+        # Runs of transactions with the same key are in order
         self._sorted = False
         self._validated = False
         self._valid = True
         self.flag = False
-        self._key = "W{:06d}".format(worker_seq.next())
+        self._key = "W{:06d}".format(current_context().worker_seq.next())
         return
 
     def dump(self):
@@ -48,7 +62,7 @@ class Worker(object):
         for t in self._tlist:
             ret_str += "\t\t{}\n".format(t)
         ret_str += "\tInvalid Transaction List\n"
-        for t in self._invalid_list:
+        for t in self._invalid_list or []:
             ret_str += "\t\t{}\n".format(t)
         ret_str += "\n"
         return ret_str
@@ -73,25 +87,35 @@ class Worker(object):
         return ret_list
 
     def add_transaction(self, transaction):
-        self._tlist.append(transaction)
+        if insert_transaction(self._tlist, self._keys, transaction):
+            if self._ties is None:
+                self._ties = set()
+            self._ties.add(transaction.sort_key)
         self._sorted = False
+        self._timeline_dates = None
+        return
+
+    def _build_timeline(self):
+        """
+            Build the sorted date -> to_position timeline used by pos_as_of.
+            Needs to_position filled in, so it's built at the end of validate
+        """
+        self._sort()
+        self._timeline_dates = [t.date for t in self._tlist]
+        self._timeline_pos = [t.to_position for t in self._tlist]
         return
 
     def pos_as_of(self, as_of_date):
         """ Return the workers position as of the given date """
-        self._sort()
-        last_t = None
-        ret = None
-        for t in self._tlist:
-            if t.date <= as_of_date:
-                last_t = t
-            else:
-                # We need the position in the last transaction (last_t)
-                if last_t is None:
-                    ret = None
-                else:
-                    ret = last_t.to_position
-                    break
+        if self._timeline_dates is None:
+            self._build_timeline()
+        # i is the first transaction after as_of_date. If there isn't one
+        # (or nothing is on/before the date) we don't know the position
+        i = bisect_right(self._timeline_dates, as_of_date)
+        if i == 0 or i == len(self._timeline_dates):
+            ret = None
+        else:
+            ret = self._timeline_pos[i - 1]
         return ret
 
     def validate(self):
@@ -102,6 +126,7 @@ class Worker(object):
             print(self)
             raise e
         self._validated = True
+        self._build_timeline()
         return
 
     def _validate(self):
@@ -219,16 +244,23 @@ class Worker(object):
         return # END _validate
 
     def remove_transaction(self, trans):
-        if trans in self._tlist:
+        i = find_transaction(self._tlist, self._keys, trans)
+        if i is not None:
             # Need a new list in case we are iterating through old one
             self._tlist = list(self._tlist)
-            self._tlist.remove(trans)
+            del self._tlist[i]
+            del self._keys[i]
+            if self._invalid_list is None:
+                self._invalid_list = []
             self._invalid_list.append(trans)
+            self._timeline_dates = None
         return
 
     def _sort(self):
-        if not self._sorted and len(self._tlist) != 0:
-                self._tlist.sort()
+        if not self._sorted:
+            if len(self._tlist) != 0:
+                if self._ties:
+                    sort_ties(self._tlist, self._keys, self._ties)
                 self._tlist[-1].top_of_stack = True
         self._sorted = True
         return
@@ -240,23 +272,47 @@ class Worker(object):
         """
         if not self._sorted:
             self._sort()
-        if t not in self._tlist:
+        i = find_transaction(self._tlist, self._keys, t)
+        if not i:
             ret = None
         else:
-            i = self._tlist.index(t)
-            if i is 0:
-                ret = None
-            else:
-                ret = self._tlist[i - 1]
+            ret = self._tlist[i - 1]
         return ret
 
     def get_transactions(self):
         self._sort()
         return self._tlist
 
+    def get_invalid_transactions(self):
+        return list(self._invalid_list or [])
+
+    def mark_validated(self, valid):
+        """ Record the outcome of a validate() that was run in another process (see partition.py) """
+        self._valid = valid
+        self._validated = True
+        self._build_timeline()
+        return
+
+    def get_state(self):
+        """ Return our state as plain values, transactions as linenos (see snapshot.py) """
+        return (self._emp_id, self._key, self._valid, self._validated, self._sorted, self.flag,
+                [t.lineno for t in self._tlist], [t.lineno for t in self._invalid_list or []])
+
+    def set_state(self, state, transaction):
+        """ Restore a state from get_state, transaction maps a lineno back to a Transaction """
+        (self._emp_id, self._key, self._valid, self._validated, self._sorted, self.flag,
+                tlist, invalid_list) = state
+        self._tlist = [transaction(i) for i in tlist]
+        self._invalid_list = [transaction(i) for i in invalid_list] or None
+        for t in self._tlist + (self._invalid_list or []):
+            t.worker = self
+        self._keys, self._ties = key_order(self._tlist)
+        self._timeline_dates = None
+        return
+
     @property
     def emp_id(self):
-        if Worker._anonymize:
+        if current_context().anonymize:
             ret = self._key
         else:
             ret = self._emp_id